@@ -0,0 +1,63 @@
+"""
+Bulk throughput and tunnel setup time of the paramiko and OpenSSH tunnel
+backends.
+
+Usage:
+
+.. code-block:: none
+
+    /path/to/trifeni$ python -m benchmarks.bench_backends --megabytes 32 --tunnels 8
+"""
+from __future__ import print_function
+import argparse
+import logging
+import time
+
+from trifeni import SSHTunnelManager
+
+from .loopback import start_loopback, generate_client_key, fetch_blob, free_port, report
+
+module_logger = logging.getLogger(__name__)
+
+# the loopback server's host key changes every run
+openssh_options = {"StrictHostKeyChecking": "no", "UserKnownHostsFile": "/dev/null",
+                   "LogLevel": "ERROR"}
+
+def measure(ports, keyfile, backend, nbytes, tunnels):
+    kwargs = {"port": ports["ssh"], "keyfile": keyfile}
+    if backend == "openssh":
+        kwargs["ssh_options"] = openssh_options
+    with SSHTunnelManager(backend=backend) as manager:
+        local_ports = [free_port() for i in range(tunnels)]
+        t0 = time.time()
+        for local_port in local_ports:
+            manager.create_tunnel("127.0.0.1", "127.0.0.1", local_port, ports["blob"], **kwargs)
+        setup = (time.time() - t0) / tunnels
+        fetch_blob("127.0.0.1", local_ports[0], 1024) # warm up
+        t0 = time.time()
+        received = fetch_blob("127.0.0.1", local_ports[0], nbytes)
+        delta = time.time() - t0
+    return setup, received, delta
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--backends", nargs="+", default=["paramiko", "openssh"])
+    parser.add_argument("--megabytes", type=float, default=32.0)
+    parser.add_argument("--tunnels", type=int, default=8, help="tunnels created per backend")
+    args = parser.parse_args()
+
+    proc, ports = start_loopback()
+    keyfile = generate_client_key()
+    nbytes = int(args.megabytes * 1024**2)
+    rows = []
+    try:
+        for backend in args.backends:
+            setup, received, delta = measure(ports, keyfile, backend, nbytes, args.tunnels)
+            rows.append((backend, "{:.1f}".format(1000 * setup),
+                         "{:.1f}".format(received / 1024.**2 / delta)))
+    finally:
+        proc.terminate()
+    report("Tunnel backends", ("backend", "setup ms/tunnel", "MB/s"), rows)
+
+if __name__ == "__main__":
+    main()
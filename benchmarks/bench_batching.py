@@ -0,0 +1,82 @@
+"""
+Call rate of small commands through a tunneled proxy: plain per-call proxies,
+oneway calls, explicit batches, and a CommandQueue.
+
+Usage:
+
+.. code-block:: none
+
+    /path/to/trifeni$ python -m benchmarks.bench_batching --calls 2000
+"""
+from __future__ import print_function
+import argparse
+import logging
+import time
+
+import trifeni
+from trifeni import DaemonTunnel, config
+
+from .loopback import start_loopback, generate_client_key, pyro_echo_uri, report
+
+module_logger = logging.getLogger(__name__)
+
+port_offset = 1000
+
+def per_call(dt, uri, calls, batch_size):
+    proxy = dt.get_remote_object(uri)
+    for i in range(calls):
+        proxy.square(i)
+    proxy._pyroRelease()
+
+def oneway_calls(dt, uri, calls, batch_size):
+    proxy = trifeni.oneway(dt.get_remote_object(uri), "square")
+    for i in range(calls):
+        proxy.square(i)
+    proxy._pyroOneway.clear()
+    proxy.square(0) # wait for the server to catch up
+    proxy._pyroRelease()
+
+def batches(dt, uri, calls, batch_size):
+    proxy = dt.get_remote_object(uri)
+    for start in range(0, calls, batch_size):
+        with trifeni.batch(proxy) as b:
+            for i in range(start, min(calls, start + batch_size)):
+                b.square(i)
+            list(b())
+    proxy._pyroRelease()
+
+def command_queue(dt, uri, calls, batch_size):
+    with dt.get_command_queue(uri, max_size=batch_size, max_delay=0.01) as commands:
+        for i in range(calls):
+            commands.submit("square", i)
+    commands.proxy.square(0)
+
+modes = [("per-call", per_call), ("oneway", oneway_calls),
+         ("batch", batches), ("command queue", command_queue)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    proc, ports = start_loopback(port_offset=port_offset)
+    config.ssh_configure({"loopback": {"HostName": "127.0.0.1", "Port": ports["ssh"],
+                                       "User": "bench", "IdentityFile": generate_client_key()}})
+    uri = pyro_echo_uri(ports["pyro"] - port_offset)
+    rows = []
+    try:
+        with DaemonTunnel(remote_server_name="loopback") as dt:
+            dt.get_remote_object(uri)._pyroRelease() # create the tunnel up front
+            for name, mode in modes:
+                t0 = time.time()
+                mode(dt, uri, args.calls, args.batch_size)
+                delta = time.time() - t0
+                rows.append((name, args.calls, "{:.2f}".format(delta),
+                             "{:.0f}".format(args.calls / delta)))
+    finally:
+        proc.terminate()
+    report("Small command call rate", ("mode", "calls", "seconds", "calls/s"), rows)
+
+if __name__ == "__main__":
+    main()
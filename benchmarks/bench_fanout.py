@@ -0,0 +1,125 @@
+"""
+Opening many tunnels at once against an SSH server that drops connections
+beyond a MaxStartups like limit, with and without handshake admission
+control.
+
+The loopback SSH server sits behind a proxy that closes new connections
+while ``--max-startups`` others are still in their first
+``--startup-seconds``, much like sshd drops unauthenticated connections
+beyond MaxStartups. Scenarios:
+
+- ``unlimited``: every handshake starts at once, and isn't retried.
+- ``limited``: handshakes are admitted ``--limit`` at a time, and retried
+  after a backoff when dropped.
+
+Usage:
+
+.. code-block:: none
+
+    /path/to/trifeni$ python -m benchmarks.bench_fanout --tunnels 40 --max-startups 10
+"""
+from __future__ import print_function
+import argparse
+import logging
+import socket
+import threading
+import time
+
+from trifeni import SSHTunnelManager
+from trifeni.util import HandshakeLimiter, metrics
+
+from .loopback import start_loopback, generate_client_key, free_port, spawn, relay, report
+
+module_logger = logging.getLogger(__name__)
+
+scenarios = ("unlimited", "limited")
+
+class StartupThrottle(object):
+    """TCP proxy that drops connections beyond max_startups starting ones."""
+    def __init__(self, target, max_startups, startup_seconds):
+        self.target = target
+        self.max_startups = max_startups
+        self.startup_seconds = startup_seconds
+        self.dropped = 0
+        self._starting = []
+        self._lock = threading.Lock()
+        self._listener = socket.socket()
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(128)
+        self.port = self._listener.getsockname()[1]
+        spawn(self._accept_loop)
+
+    def _admit(self):
+        now = time.time()
+        with self._lock:
+            self._starting = [t for t in self._starting if now - t < self.startup_seconds]
+            if len(self._starting) >= self.max_startups:
+                self.dropped += 1
+                return False
+            self._starting.append(now)
+            return True
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, address = self._listener.accept()
+            except socket.error:
+                return
+            if not self._admit():
+                client.close()
+                continue
+            server = socket.create_connection(self.target)
+            spawn(relay, client, server)
+
+    def close(self):
+        self._listener.close()
+
+def measure(ports, keyfile, scenario, tunnels, max_startups, startup_seconds, limit):
+    throttle = StartupThrottle(("127.0.0.1", ports["ssh"]), max_startups, startup_seconds)
+    limiter = HandshakeLimiter.for_host(("127.0.0.1", throttle.port))
+    if scenario == "unlimited":
+        limiter.limit, limiter.retries = None, 0
+    else:
+        limiter.limit = limit
+    metrics.reset()
+    specs = [{"args": ["127.0.0.1", "127.0.0.1", free_port(), ports["echo"]],
+              "kwargs": {"port": throttle.port, "keyfile": keyfile}} for i in range(tunnels)]
+    try:
+        with SSHTunnelManager() as manager:
+            t0 = time.time()
+            manager.create_tunnels(specs, max_workers=tunnels)
+            delta = time.time() - t0
+            opened = sum(1 for tunnel in manager.tunnels.values() if tunnel.open)
+    finally:
+        throttle.close()
+    snapshot = metrics.snapshot()
+    queue = snapshot["timings"].get("handshake.queue_seconds", {"max": 0.0})
+    return opened, delta, throttle.dropped, snapshot["counters"].get("handshake.retries", 0), queue["max"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--scenarios", nargs="+", default=list(scenarios), choices=scenarios)
+    parser.add_argument("--tunnels", type=int, default=40)
+    parser.add_argument("--max-startups", type=int, default=10)
+    parser.add_argument("--startup-seconds", type=float, default=0.5)
+    parser.add_argument("--limit", type=int, default=HandshakeLimiter.default_limit,
+                        help="handshakes admitted at a time")
+    args = parser.parse_args()
+
+    proc, ports = start_loopback()
+    keyfile = generate_client_key()
+    rows = []
+    try:
+        for scenario in args.scenarios:
+            opened, delta, dropped, retries, queue = measure(
+                ports, keyfile, scenario, args.tunnels, args.max_startups, args.startup_seconds, args.limit)
+            rows.append((scenario, "{}/{}".format(opened, args.tunnels), "{:.2f}".format(delta),
+                         dropped, retries, "{:.2f}".format(queue)))
+    finally:
+        proc.terminate()
+    report("Fan-out of {} tunnels, MaxStartups {}".format(args.tunnels, args.max_startups),
+           ("scenario", "opened", "seconds", "dropped", "retries", "max queue s"), rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Memory and threads per idle forward tunnel, and how long tearing them down
+takes. The tunnels share one transport pool, so what's measured is the cost
+of the tunnel itself.
+
+Usage:
+
+.. code-block:: none
+
+    /path/to/trifeni$ python -m benchmarks.bench_memory --tunnels 100 500
+"""
+from __future__ import print_function
+import argparse
+import gc
+import logging
+import resource
+import threading
+import time
+import tracemalloc
+
+from trifeni.util import SSHTunnel, TransportPool
+
+from .loopback import start_loopback, generate_client_key, free_port, report
+
+module_logger = logging.getLogger(__name__)
+
+def rss():
+    """Resident set size of this process, in bytes."""
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize()
+
+def measure(ports, keyfile, count):
+    pool = TransportPool("127.0.0.1", ports["ssh"], None, keyfile)
+    pool.connect()
+    gc.collect()
+    threads0, rss0 = threading.active_count(), rss()
+    tracemalloc.start()
+    snapshot0 = tracemalloc.take_snapshot()
+    tunnels = []
+    for i in range(count):
+        tunnels.append(SSHTunnel("127.0.0.1", "127.0.0.1", free_port(), ports["blob"],
+                                 port=ports["ssh"], keyfile=keyfile, transport_pool=pool))
+    gc.collect()
+    snapshot1 = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in snapshot1.compare_to(snapshot0, "filename"))
+    threads1, rss1 = threading.active_count(), rss()
+    t0 = time.time()
+    for tunnel in tunnels:
+        tunnel.destroy()
+    teardown = time.time() - t0
+    pool.close()
+    return allocated / count, (rss1 - rss0) / count, threads1 - threads0, teardown / count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--tunnels", type=int, nargs="+", default=[100, 500])
+    args = parser.parse_args()
+
+    proc, ports = start_loopback()
+    keyfile = generate_client_key()
+    rows = []
+    try:
+        for count in args.tunnels:
+            allocated, resident, threads, teardown = measure(ports, keyfile, count)
+            rows.append((count, "{:.0f}".format(allocated), "{:.0f}".format(resident), threads,
+                         "{:.2f}".format(teardown * 1e3)))
+    finally:
+        proc.terminate()
+    report("Idle forward tunnels", ("tunnels", "python bytes/tunnel", "RSS bytes/tunnel", "threads",
+                                    "teardown ms/tunnel"), rows)
+
+if __name__ == "__main__":
+    main()
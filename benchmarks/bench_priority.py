@@ -0,0 +1,117 @@
+"""
+Latency of Pyro4 calls on a control tunnel while bulk tunnels to the same
+host saturate an emulated link, with and without traffic classes.
+
+Both kinds of tunnel share one SSH transport, which goes through a
+``LinkProxy`` in front of the loopback SSH server. Scenarios:
+
+- ``none``: no traffic classes.
+- ``classes``: a "control" class for the Pyro4 tunnel, "bulk" for the others.
+- ``capped``: classes, and bulk tunnels capped at ``--cap`` of the link's
+  bandwidth.
+
+Usage:
+
+.. code-block:: none
+
+    /path/to/trifeni$ python -m benchmarks.bench_priority --profile wan --bulk 2 --interval 0.05
+"""
+from __future__ import print_function
+import argparse
+import logging
+import threading
+import time
+
+import Pyro4
+
+from trifeni import SSHTunnelManager
+from trifeni.util import LinkProfile, LinkProxy, check_connection, metrics
+
+from .loopback import start_loopback, generate_client_key, fetch_blob, free_port, pyro_echo_uri, report
+
+module_logger = logging.getLogger(__name__)
+
+scenarios = ("none", "classes", "capped")
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def measure(ports, keyfile, profile, scenario, bulk, seconds, interval, cap):
+    control_kwargs, bulk_kwargs = {}, {}
+    if scenario != "none":
+        control_kwargs["traffic_class"] = "control"
+        bulk_kwargs["traffic_class"] = "bulk"
+    if scenario == "capped":
+        bulk_kwargs["rate_limit"] = cap * profile.bandwidth / bulk
+    metrics.reset()
+    with LinkProxy(("127.0.0.1", ports["ssh"]), profile, seed=0) as proxy, \
+            SSHTunnelManager() as manager:
+        pyro_port, blob_port = free_port(), free_port()
+        pool = manager.get_transport_pool("127.0.0.1", port=proxy.port, keyfile=keyfile)
+        manager.create_tunnel("127.0.0.1", "127.0.0.1", pyro_port, ports["pyro"], port=proxy.port,
+                              keyfile=keyfile, transport_pool=pool, **control_kwargs)
+        manager.create_tunnel("127.0.0.1", "127.0.0.1", blob_port, ports["blob"], port=proxy.port,
+                              keyfile=keyfile, transport_pool=pool, **bulk_kwargs)
+        control = Pyro4.Proxy(pyro_echo_uri(pyro_port))
+        check_connection(control._pyroBind, timeout=0.5, attempts=10)
+        stop = threading.Event()
+        received = [0 for i in range(bulk)]
+
+        def load(i):
+            while not stop.is_set():
+                received[i] += fetch_blob("127.0.0.1", blob_port, 2**22)
+
+        threads = [threading.Thread(target=load, args=(i,)) for i in range(bulk)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        time.sleep(1.0) # let the bulk transfers fill the link
+        latencies = []
+        t0 = time.time()
+        while time.time() - t0 < seconds:
+            start = time.time()
+            control.square(len(latencies))
+            latencies.append(time.time() - start)
+            time.sleep(interval)
+        delta = time.time() - t0
+        stop.set()
+        control._pyroRelease()
+    for thread in threads:
+        thread.join()
+    waits = metrics.snapshot()["timings"].get("scheduler.wait_seconds", {"count": 0})
+    return latencies, sum(received) / (delta + 1.0), waits["count"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--profile", default="wan", choices=sorted(LinkProfile.profiles))
+    parser.add_argument("--scenarios", nargs="+", default=list(scenarios), choices=scenarios)
+    parser.add_argument("--bulk", type=int, default=2, help="concurrent bulk transfers")
+    parser.add_argument("--seconds", type=float, default=5.0, help="control calls per scenario")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between control calls")
+    parser.add_argument("--cap", type=float, default=0.8,
+                        help="bulk rate cap, as a fraction of the link's bandwidth")
+    args = parser.parse_args()
+
+    profile = LinkProfile.profile(args.profile)
+    if profile.bandwidth is None:
+        parser.error("profile {} has no bandwidth limit to saturate".format(args.profile))
+    proc, ports = start_loopback()
+    keyfile = generate_client_key()
+    rows = []
+    try:
+        for scenario in args.scenarios:
+            latencies, rate, waits = measure(ports, keyfile, profile, scenario,
+                                             args.bulk, args.seconds, args.interval, args.cap)
+            rows.append((scenario, len(latencies),
+                         "{:.1f}".format(1000 * percentile(latencies, 0.5)),
+                         "{:.1f}".format(1000 * percentile(latencies, 0.95)),
+                         "{:.1f}".format(1000 * percentile(latencies, 0.99)),
+                         "{:.0f}".format(rate / 1024.), waits))
+    finally:
+        proc.terminate()
+    report("Control calls under bulk load ({})".format(args.profile),
+           ("scenario", "calls", "p50 ms", "p95 ms", "p99 ms", "bulk KB/s", "waits"), rows)
+
+if __name__ == "__main__":
+    main()
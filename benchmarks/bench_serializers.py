@@ -0,0 +1,92 @@
+"""
+Encode time, and encode plus transfer time through a tunnel, of typical array
+and dict payloads for each available Pyro4 serializer.
+
+Usage:
+
+.. code-block:: none
+
+    /path/to/trifeni$ python -m benchmarks.bench_serializers --serializers serpent marshal json pickle
+"""
+from __future__ import print_function
+import argparse
+import logging
+import time
+
+import Pyro4
+
+from trifeni import DaemonTunnel, config
+
+from .loopback import start_loopback, generate_client_key, pyro_echo_uri, report
+
+module_logger = logging.getLogger(__name__)
+
+port_offset = 1000
+
+def array_payload(size):
+    return [0.5 * i for i in range(size)]
+
+def dict_payload(size):
+    return {"channel{}".format(i): {"power": 0.5 * i, "gain": i, "label": "ch{}".format(i)}
+            for i in range(size // 10)}
+
+payloads = [("array", array_payload), ("dict", dict_payload)]
+
+def available(names):
+    for name in names:
+        try:
+            Pyro4.util.get_serializer(name)
+        except Pyro4.errors.SerializeError:
+            module_logger.warning("{} is not installed, skipping".format(name))
+        else:
+            yield name
+
+def encode_time(serializer, payload, calls):
+    serializer = Pyro4.util.get_serializer(serializer)
+    t0 = time.time()
+    for i in range(calls):
+        data, compressed = serializer.serializeCall("PyroEcho", "echo", (payload,), {})
+    return (time.time() - t0) / calls, len(data)
+
+def call_time(proxy, payload, calls):
+    proxy.echo(payload)
+    t0 = time.time()
+    for i in range(calls):
+        proxy.echo(payload)
+    return (time.time() - t0) / calls
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--serializers", nargs="+",
+                        default=["serpent", "marshal", "json", "msgpack", "pickle"])
+    parser.add_argument("--size", type=int, default=10000,
+                        help="number of elements in the array payload")
+    parser.add_argument("--calls", type=int, default=50)
+    args = parser.parse_args()
+
+    serializers = list(available(args.serializers))
+    # the benchmark's own server is trusted, so let it and the client use pickle
+    Pyro4.config.SERIALIZERS_ACCEPTED = set(Pyro4.config.SERIALIZERS_ACCEPTED) | set(serializers)
+
+    proc, ports = start_loopback(port_offset=port_offset)
+    config.ssh_configure({"loopback": {"HostName": "127.0.0.1", "Port": ports["ssh"],
+                                       "User": "bench", "IdentityFile": generate_client_key()}})
+    uri = pyro_echo_uri(ports["pyro"] - port_offset)
+    rows = []
+    try:
+        with DaemonTunnel(remote_server_name="loopback") as dt:
+            for payload_name, make_payload in payloads:
+                payload = make_payload(args.size)
+                for serializer in serializers:
+                    proxy = dt.get_remote_object(uri, serializer=serializer)
+                    encode, nbytes = encode_time(serializer, payload, args.calls)
+                    call = call_time(proxy, payload, args.calls)
+                    proxy._pyroRelease()
+                    rows.append((payload_name, serializer, nbytes,
+                                 "{:.2f}".format(1000 * encode), "{:.2f}".format(1000 * call)))
+    finally:
+        proc.terminate()
+    report("Serializer encode and call time", ("payload", "serializer", "bytes", "encode ms", "call ms"), rows)
+
+if __name__ == "__main__":
+    main()
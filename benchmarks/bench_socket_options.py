@@ -0,0 +1,62 @@
+"""
+Per call latency of Pyro4 calls through a forward tunnel, for different
+SocketOptions profiles.
+
+Usage:
+
+.. code-block:: none
+
+    /path/to/trifeni$ python -m benchmarks.bench_socket_options --profiles system default --sizes 64 4096
+"""
+from __future__ import print_function
+import argparse
+import logging
+import time
+
+import Pyro4
+
+from trifeni import SSHTunnel
+
+from .loopback import start_loopback, generate_client_key, free_port, pyro_echo_uri, report
+
+module_logger = logging.getLogger(__name__)
+
+def measure(ports, keyfile, profile, size, calls):
+    local_port = free_port()
+    with SSHTunnel("127.0.0.1", "127.0.0.1", local_port, ports["pyro"],
+                   port=ports["ssh"], keyfile=keyfile, socket_options=profile):
+        with Pyro4.Proxy(pyro_echo_uri(local_port)) as proxy:
+            payload = "x" * size
+            proxy.echo(payload)
+            t0 = time.time()
+            for i in range(calls):
+                proxy.echo(payload)
+            return (time.time() - t0) / calls
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--profiles", nargs="+", default=["system", "default"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 4096, 65536],
+                        help="payload sizes, in bytes")
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    proc, ports = start_loopback()
+    keyfile = generate_client_key()
+    rows = []
+    try:
+        for size in args.sizes:
+            baseline = None
+            for profile in args.profiles:
+                latency = measure(ports, keyfile, profile, size, args.calls)
+                if baseline is None:
+                    baseline = latency
+                rows.append((size, profile, "{:.3f}".format(latency * 1e3),
+                             "{:+.3f}".format((latency - baseline) * 1e3)))
+    finally:
+        proc.terminate()
+    report("Pyro4 call latency by socket profile",
+           ("payload bytes", "profile", "ms/call", "vs first profile"), rows)
+
+if __name__ == "__main__":
+    main()
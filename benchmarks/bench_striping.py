@@ -0,0 +1,66 @@
+"""
+Aggregate throughput of a forward tunnel as a function of the number of
+striped SSH transports per host.
+
+Usage:
+
+.. code-block:: none
+
+    /path/to/trifeni$ python -m benchmarks.bench_striping --transports 1 2 4 --clients 8
+"""
+from __future__ import print_function
+import argparse
+import logging
+import threading
+import time
+
+from trifeni import SSHTunnelManager
+
+from .loopback import start_loopback, generate_client_key, fetch_blob, free_port, report
+
+module_logger = logging.getLogger(__name__)
+
+def measure(ports, keyfile, transports, policy, clients, nbytes):
+    local_port = free_port()
+    with SSHTunnelManager(transports_per_host=transports, stripe_policy=policy) as manager:
+        manager.create_tunnel("127.0.0.1", "127.0.0.1", local_port, ports["blob"],
+                              port=ports["ssh"], keyfile=keyfile)
+        fetch_blob("127.0.0.1", local_port, 1024) # warm up
+        received = [0 for i in range(clients)]
+
+        def client(i):
+            received[i] = fetch_blob("127.0.0.1", local_port, nbytes)
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+        t0 = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        delta = time.time() - t0
+    return sum(received), delta
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--transports", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--policy", choices=["round-robin", "least-loaded"], default="round-robin")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent connections")
+    parser.add_argument("--megabytes", type=float, default=8.0, help="payload per connection")
+    args = parser.parse_args()
+
+    proc, ports = start_loopback()
+    keyfile = generate_client_key()
+    nbytes = int(args.megabytes * 1024**2)
+    rows = []
+    try:
+        for transports in args.transports:
+            total, delta = measure(ports, keyfile, transports, args.policy, args.clients, nbytes)
+            rows.append((transports, args.clients, "{:.1f}".format(total / 1024.**2),
+                         "{:.2f}".format(delta), "{:.1f}".format(total / 1024.**2 / delta)))
+    finally:
+        proc.terminate()
+    report("Striped transports ({})".format(args.policy),
+           ("transports", "clients", "MB", "seconds", "MB/s"), rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Compare TransportOptions profiles: bulk throughput and small message round
+trip time through a forward tunnel.
+
+Usage:
+
+.. code-block:: none
+
+    /path/to/trifeni$ python -m benchmarks.bench_transport_options --profiles default lan long-haul compressed
+"""
+from __future__ import print_function
+import argparse
+import logging
+import socket
+import time
+
+from trifeni import SSHTunnel
+from trifeni.util import TransportOptions
+
+from .loopback import start_loopback, generate_client_key, fetch_blob, free_port, report
+
+module_logger = logging.getLogger(__name__)
+
+def round_trip(local_port, calls, size=64):
+    sock = socket.create_connection(("127.0.0.1", local_port))
+    payload = b"x" * size
+    t0 = time.time()
+    for i in range(calls):
+        sock.sendall(payload)
+        received = 0
+        while received < size:
+            received += len(sock.recv(size - received))
+    delta = time.time() - t0
+    sock.close()
+    return delta / calls
+
+def measure(ports, keyfile, profile, nbytes, calls):
+    blob_port, echo_port = free_port(), free_port()
+    kwargs = dict(port=ports["ssh"], keyfile=keyfile, transport_options=profile)
+    with SSHTunnel("127.0.0.1", "127.0.0.1", blob_port, ports["blob"], **kwargs), \
+         SSHTunnel("127.0.0.1", "127.0.0.1", echo_port, ports["echo"], **kwargs):
+        fetch_blob("127.0.0.1", blob_port, 1024)
+        t0 = time.time()
+        received = fetch_blob("127.0.0.1", blob_port, nbytes)
+        bulk = received / 1024.**2 / (time.time() - t0)
+        latency = round_trip(echo_port, calls)
+    return bulk, latency
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--profiles", nargs="+", default=sorted(TransportOptions.profiles))
+    parser.add_argument("--megabytes", type=float, default=16.0, help="bulk payload size")
+    parser.add_argument("--calls", type=int, default=500, help="number of round trips")
+    args = parser.parse_args()
+
+    proc, ports = start_loopback()
+    keyfile = generate_client_key()
+    rows = []
+    try:
+        for profile in args.profiles:
+            bulk, latency = measure(ports, keyfile, profile, int(args.megabytes * 1024**2), args.calls)
+            rows.append((profile, repr(TransportOptions.profile(profile)),
+                         "{:.1f}".format(bulk), "{:.3f}".format(latency * 1e3)))
+    finally:
+        proc.terminate()
+    report("SSH transport profiles", ("profile", "options", "bulk MB/s", "round trip ms"), rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Tunnel setup, proxy binding and bulk transfers over an emulated WAN link.
+
+Setup goes through a ``LinkProxy`` in front of the loopback SSH server, so
+that the SSH handshake sees the link's round trips. Binding and transfers go
+through tunnels whose relays emulate the link (``trifeni.util.link_emulator``).
+
+Usage:
+
+.. code-block:: none
+
+    /path/to/trifeni$ python -m benchmarks.bench_wan --profiles lan wan station lossy-station
+"""
+from __future__ import print_function
+import argparse
+import logging
+import time
+
+import Pyro4
+
+from trifeni.util import SSHTunnel, LinkProfile, LinkProxy, link_emulator, check_connection
+
+from .loopback import start_loopback, generate_client_key, fetch_blob, free_port, pyro_echo_uri, report
+
+module_logger = logging.getLogger(__name__)
+
+def measure_setup(ports, keyfile, profile, tunnels):
+    with LinkProxy(("127.0.0.1", ports["ssh"]), profile, seed=0) as proxy:
+        t0 = time.time()
+        for i in range(tunnels):
+            tunnel = SSHTunnel("127.0.0.1", "127.0.0.1", free_port(), ports["blob"],
+                               port=proxy.port, keyfile=keyfile)
+            tunnel.destroy()
+    return (time.time() - t0) / tunnels
+
+def measure_transfers(ports, keyfile, profile, nbytes, calls):
+    blob_port, pyro_port = free_port(), free_port()
+    blob = SSHTunnel("127.0.0.1", "127.0.0.1", blob_port, ports["blob"], port=ports["ssh"], keyfile=keyfile)
+    pyro = SSHTunnel("127.0.0.1", "127.0.0.1", pyro_port, ports["pyro"], port=ports["ssh"], keyfile=keyfile)
+    try:
+        with link_emulator.emulate(profile, seed=0):
+            proxy = Pyro4.Proxy(pyro_echo_uri(pyro_port))
+            t0 = time.time()
+            bound = check_connection(proxy._pyroBind, timeout=0.5, attempts=10)
+            bind = time.time() - t0
+            t0 = time.time()
+            for i in range(calls):
+                proxy.square(i)
+            call = (time.time() - t0) / calls
+            proxy._pyroRelease()
+            t0 = time.time()
+            received = fetch_blob("127.0.0.1", blob_port, nbytes)
+            rate = received / (time.time() - t0)
+    finally:
+        blob.destroy()
+        pyro.destroy()
+    return bound, bind, call, rate
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--profiles", nargs="+", default=["lan", "wan", "station", "lossy-station"],
+                        choices=sorted(LinkProfile.profiles))
+    parser.add_argument("--megabytes", type=float, default=1.0)
+    parser.add_argument("--tunnels", type=int, default=3, help="tunnels set up per profile")
+    parser.add_argument("--calls", type=int, default=20, help="Pyro calls per profile")
+    args = parser.parse_args()
+
+    proc, ports = start_loopback()
+    keyfile = generate_client_key()
+    nbytes = int(args.megabytes * 1024**2)
+    rows = []
+    try:
+        for name in args.profiles:
+            profile = LinkProfile.profile(name)
+            setup = measure_setup(ports, keyfile, profile, args.tunnels)
+            bound, bind, call, rate = measure_transfers(ports, keyfile, profile, nbytes, args.calls)
+            rows.append((name, "{:.0f}".format(1000 * profile.latency),
+                         "{:.0f}".format(1000 * setup),
+                         "{:.0f}".format(1000 * bind) if bound else "failed",
+                         "{:.1f}".format(1000 * call),
+                         "{:.0f}".format(rate / 1024.)))
+    finally:
+        proc.terminate()
+    report("Emulated links", ("profile", "RTT ms", "setup ms", "bind ms", "call ms", "KB/s"), rows)
+
+if __name__ == "__main__":
+    main()
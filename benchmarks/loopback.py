@@ -0,0 +1,407 @@
+"""
+Loopback SSH stand-in for benchmarking trifeni without a real remote server.
+
+``LoopbackSSHServer`` is a small paramiko server that accepts any key, and
+supports the kinds of forwarding trifeni uses: ``direct-tcpip`` and
+``direct-streamlocal@openssh.com`` channels (forward tunnels) and
+``tcpip-forward`` requests (reverse tunnels).
+``BlobServer`` plays the part of a remote daemon that streams bulk payloads.
+
+Both can be run in a separate process with ``start_loopback``, so that the
+"remote" side doesn't share an interpreter (and a GIL) with the tunnels being
+measured.
+
+Tunnels usually forward a local port to the same remote port, which collides
+when "remote" is this machine. With a ``port_offset``, the stand-in behaves
+like a remote host whose port P is local port P + port_offset.
+"""
+from __future__ import print_function
+import logging
+import multiprocessing
+import os
+import select
+import socket
+import struct
+import tempfile
+import threading
+import time
+import warnings
+
+import paramiko
+import Pyro4
+
+__all__ = [
+    "LoopbackSSHServer",
+    "BlobServer",
+    "EchoServer",
+    "PyroEchoServer",
+    "pyro_echo_uri",
+    "start_loopback",
+    "generate_client_key",
+    "fetch_blob",
+    "free_port",
+    "report"
+]
+
+module_logger = logging.getLogger(__name__)
+
+# the loopback server has a fresh host key every run.
+warnings.filterwarnings("ignore", message="Unknown .* host key")
+logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+relay_bufsize = 32768
+
+def free_port(host="127.0.0.1"):
+    """Get a port that nothing is currently bound to."""
+    sock = socket.socket()
+    sock.bind((host, 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def generate_client_key(bits=2048):
+    """
+    Write a fresh RSA key to a temporary file. The loopback server accepts any
+    key, but SSHTunnel needs a keyfile to exist.
+
+    Returns:
+        str: path to the private key.
+    """
+    fd, path = tempfile.mkstemp(prefix="trifeni-bench-", suffix=".key")
+    os.close(fd)
+    paramiko.RSAKey.generate(bits).write_private_key_file(path)
+    return path
+
+def relay(sock, chan):
+    """Copy data between sock and chan until either side closes."""
+    try:
+        while True:
+            r, w, x = select.select([sock, chan], [], [])
+            if sock in r:
+                data = sock.recv(relay_bufsize)
+                if len(data) == 0:
+                    break
+                chan.sendall(data)
+            if chan in r:
+                data = chan.recv(relay_bufsize)
+                if len(data) == 0:
+                    break
+                sock.sendall(data)
+    except (socket.error, EOFError, paramiko.SSHException):
+        pass
+    finally:
+        try:
+            chan.close()
+        except (socket.error, EOFError): # the client closed the transport first
+            pass
+        sock.close()
+
+def spawn(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class StandInServerInterface(paramiko.ServerInterface):
+
+    def __init__(self, transport, port_offset=0):
+        self.transport = transport
+        self.port_offset = port_offset
+        self.destinations = {}
+        self.listeners = {}
+
+    def get_allowed_auths(self, username):
+        return "publickey,password"
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        if kind == "direct-streamlocal@openssh.com" and self.transport.streamlocal_path:
+            self.destinations[chanid] = self.transport.streamlocal_path
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self.destinations[chanid] = (destination[0], destination[1] + self.port_offset)
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_port_forward_request(self, address, port):
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            listener.bind((address or "127.0.0.1", port + self.port_offset if port else 0))
+        except socket.error:
+            return False
+        listener.listen(64)
+        if not port:
+            port = listener.getsockname()[1]
+        self.listeners[port] = listener
+        spawn(self.serve_reverse, listener, (address, port))
+        return port
+
+    def cancel_port_forward_request(self, address, port):
+        listener = self.listeners.pop(port, None)
+        if listener is not None:
+            listener.close()
+
+    def serve_reverse(self, listener, server_addr):
+        while self.transport.is_active():
+            try:
+                sock, src_addr = listener.accept()
+            except socket.error:
+                return
+            try:
+                chan = self.transport.open_forwarded_tcpip_channel(src_addr, server_addr)
+            except Exception:
+                sock.close()
+                continue
+            spawn(relay, sock, chan)
+
+
+class StandInTransport(paramiko.Transport):
+    """
+    paramiko hands the server interface nothing but the kind of unknown
+    channels, so pick out the socket path of streamlocal channels here.
+    """
+    streamlocal_path = None
+
+    def _parse_channel_open(self, m):
+        self.streamlocal_path = None
+        if m.get_text() == "direct-streamlocal@openssh.com":
+            m.get_int(), m.get_int(), m.get_int()
+            self.streamlocal_path = m.get_text()
+        m.rewind()
+        paramiko.Transport._parse_channel_open(self, m)
+
+
+class LoopbackSSHServer(object):
+    """
+    Minimal SSH server listening on the loopback interface.
+
+    Attributes:
+        host (str): listening address
+        port (int): listening port
+        host_key (paramiko.RSAKey): server host key
+        port_offset (int): offset between forwarded ports and local ports.
+    """
+    def __init__(self, host="127.0.0.1", port=0, host_key=None, port_offset=0):
+        if host_key is None:
+            host_key = paramiko.RSAKey.generate(2048)
+        self.host_key = host_key
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(128)
+        self.host, self.port = self.listener.getsockname()
+        self.port_offset = port_offset
+        self.transports = []
+
+    def serve_forever(self):
+        while True:
+            try:
+                sock, addr = self.listener.accept()
+            except socket.error:
+                return
+            spawn(self.serve_transport, sock)
+
+    def serve_transport(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = StandInTransport(sock)
+        transport.add_server_key(self.host_key)
+        transport.use_compression(True) # offered, used only if the client asks
+        interface = StandInServerInterface(transport, port_offset=self.port_offset)
+        try:
+            transport.start_server(server=interface)
+        except Exception as err:
+            module_logger.debug("serve_transport: handshake failed: {}".format(err))
+            return
+        self.transports.append(transport)
+        while transport.is_active():
+            chan = transport.accept(timeout=1.0)
+            if chan is None:
+                continue
+            destination = interface.destinations.pop(chan.get_id(), None)
+            if destination is None:
+                continue
+            try:
+                if isinstance(destination, str):
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    sock.connect(destination)
+                else:
+                    sock = socket.create_connection(destination)
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except socket.error:
+                chan.close()
+                continue
+            spawn(relay, sock, chan)
+
+    def close(self):
+        self.listener.close()
+        for transport in self.transports:
+            transport.close()
+
+
+class BlobServer(object):
+    """
+    TCP server standing in for a remote daemon that serves bulk payloads.
+    Clients send an 8 byte big-endian length, and get that many bytes back.
+    """
+    chunk = b"x" * relay_bufsize
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(128)
+        self.host, self.port = self.listener.getsockname()
+
+    def serve_forever(self):
+        while True:
+            try:
+                sock, addr = self.listener.accept()
+            except socket.error:
+                return
+            spawn(self.serve_client, sock)
+
+    def serve_client(self, sock):
+        try:
+            while True:
+                header = recv_exactly(sock, 8)
+                if header is None:
+                    return
+                remaining = struct.unpack(">Q", header)[0]
+                while remaining > 0:
+                    n = sock.send(self.chunk[:min(remaining, len(self.chunk))])
+                    remaining -= n
+        except socket.error:
+            pass
+        finally:
+            sock.close()
+
+
+class EchoServer(BlobServer):
+    """TCP server that sends back whatever it receives."""
+    def serve_client(self, sock):
+        try:
+            while True:
+                data = sock.recv(relay_bufsize)
+                if len(data) == 0:
+                    return
+                sock.sendall(data)
+        except socket.error:
+            pass
+        finally:
+            sock.close()
+
+
+@Pyro4.expose
+class PyroEcho(object):
+    def echo(self, payload):
+        return payload
+
+    def square(self, x):
+        return x**2
+
+
+class PyroEchoServer(object):
+    """Pyro4 daemon with a single "PyroEcho" object."""
+    object_id = "PyroEcho"
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.daemon = Pyro4.Daemon(host=host, port=port)
+        self.uri = self.daemon.register(PyroEcho(), objectId=self.object_id)
+        self.port = self.uri.port
+
+    def serve_forever(self):
+        self.daemon.requestLoop()
+
+
+def pyro_echo_uri(port):
+    """URI of the PyroEcho object, as seen through a tunnel on port."""
+    return "PYRO:{}@localhost:{}".format(PyroEchoServer.object_id, port)
+
+def recv_exactly(sock, nbytes):
+    buf = b""
+    while len(buf) < nbytes:
+        data = sock.recv(nbytes - len(buf))
+        if len(data) == 0:
+            return None
+        buf += data
+    return buf
+
+def fetch_blob(host, port, nbytes, sock=None):
+    """
+    Ask a BlobServer for nbytes bytes, and read them all.
+
+    Returns:
+        int: number of bytes received
+    """
+    close = sock is None
+    if sock is None:
+        sock = socket.create_connection((host, port))
+    sock.sendall(struct.pack(">Q", nbytes))
+    received = 0
+    while received < nbytes:
+        data = sock.recv(min(relay_bufsize * 4, nbytes - received))
+        if len(data) == 0:
+            break
+        received += len(data)
+    if close:
+        sock.close()
+    return received
+
+def _run_loopback(ready, ssh_port, extra_servers, port_offset):
+    server = LoopbackSSHServer(port=ssh_port, port_offset=port_offset)
+    ports = {"ssh": server.port}
+    spawn(server.serve_forever)
+    for name, cls in extra_servers:
+        extra = cls()
+        spawn(extra.serve_forever)
+        ports[name] = extra.port
+    ready.put(ports)
+    while True:
+        time.sleep(3600)
+
+default_servers = (("blob", BlobServer), ("echo", EchoServer), ("pyro", PyroEchoServer))
+
+def start_loopback(ssh_port=0, extra_servers=default_servers, port_offset=0):
+    """
+    Run a LoopbackSSHServer, and a BlobServer, EchoServer and PyroEchoServer,
+    in a separate process.
+
+    Args:
+        ssh_port (int, optional): SSH port. Defaults to any free port.
+        extra_servers (tuple, optional): (name, class) pairs of servers to run
+            alongside the SSH server.
+        port_offset (int, optional): see LoopbackSSHServer.
+
+    Returns:
+        tuple: multiprocessing.Process, and a dict mapping "ssh", "blob",
+            "echo" and "pyro" to their ports on 127.0.0.1. Call terminate on
+            the process when done.
+    """
+    ready = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_run_loopback, args=(ready, ssh_port, extra_servers, port_offset))
+    proc.daemon = True
+    proc.start()
+    ports = ready.get(timeout=60)
+    return proc, ports
+
+def report(title, header, rows):
+    """Print a small fixed width table of benchmark results."""
+    print(title)
+    print("-" * len(title))
+    widths = [max(len(str(h)), max([len(str(row[i])) for row in rows] or [0]))
+              for i, h in enumerate(header)]
+    line = "  ".join("{{:>{}}}".format(w) for w in widths)
+    print(line.format(*header))
+    for row in rows:
+        print(line.format(*row))
+    print("")
@@ -0,0 +1,243 @@
+"""
+Soak test for long running tunnel managers: churn forward and reverse tunnels
+and Pyro calls against the loopback SSH stand-in, and watch threads, file
+descriptors, resident memory, SSH transports and the manager's tunnels for
+growth. While the churn runs, each worker may have a few tunnels, threads and
+sockets in flight. Once it has stopped and things have settled, usage has to
+be back within the thresholds of the baseline. Exits with status 1, and a
+diff of the object types and threads that grew, if it isn't.
+
+Usage:
+
+.. code-block:: none
+
+    /path/to/trifeni$ python -m benchmarks.soak --duration 3600 --sample-interval 60
+"""
+from __future__ import print_function
+import argparse
+import collections
+import gc
+import logging
+import os
+import re
+import resource
+import socket
+import sys
+import threading
+import time
+
+import paramiko
+import Pyro4
+
+from trifeni import SSHTunnelManager
+
+from .loopback import start_loopback, generate_client_key, free_port, pyro_echo_uri, spawn, EchoServer
+
+module_logger = logging.getLogger(__name__)
+
+def rss():
+    """Resident set size of this process, in bytes."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+def open_fds():
+    """Number of open file descriptors of this process."""
+    return len(os.listdir("/proc/self/fd"))
+
+def live_transports():
+    """Number of paramiko Transports that are still active."""
+    return len([obj for obj in gc.get_objects()
+                if isinstance(obj, paramiko.Transport) and obj.is_active()])
+
+def type_counts():
+    """Number of live objects tracked by the garbage collector, by type name."""
+    gc.collect()
+    return collections.Counter(type(obj).__name__ for obj in gc.get_objects())
+
+def thread_names():
+    """Live threads, by name, with the counter Python numbers them with removed."""
+    return collections.Counter(re.sub(r"-\d+", "", thread.name) for thread in threading.enumerate())
+
+class SoakMonitor(object):
+    """
+    Sample resource usage, and compare samples to a baseline.
+
+    Attributes:
+        manager (SSHTunnelManager): manager whose tunnels are counted.
+        thresholds (dict): largest allowed growth of each sampled quantity
+            over the baseline.
+        baseline (dict): sample taken by ``set_baseline``.
+        samples (list): (elapsed seconds, sample) pairs.
+    """
+    def __init__(self, manager, thresholds):
+        self.manager = manager
+        self.thresholds = thresholds
+        self.baseline = None
+        self.samples = []
+        self._baseline_types = None
+        self._baseline_threads = None
+        self._t0 = time.time()
+
+    def sample(self):
+        return collections.OrderedDict([
+            ("threads", threading.active_count()),
+            ("fds", open_fds()),
+            ("rss_mb", rss() / 1024.**2),
+            ("transports", live_transports()),
+            ("tunnels", len(self.manager.tunnels))
+        ])
+
+    def set_baseline(self):
+        self.baseline = self.sample()
+        self._baseline_types = type_counts()
+        self._baseline_threads = thread_names()
+
+    def record(self, allowance=None):
+        """
+        Take a sample, and return the quantities that grew past their
+        thresholds.
+
+        Args:
+            allowance (dict, optional): extra growth allowed for each
+                quantity, for instance for work in flight.
+        Returns:
+            dict: growth of each quantity that grew past its threshold.
+        """
+        if allowance is None: allowance = {}
+        current = self.sample()
+        self.samples.append((time.time() - self._t0, current))
+        return {name: current[name] - self.baseline[name] for name in self.thresholds
+                if current[name] - self.baseline[name] > self.thresholds[name] + allowance.get(name, 0)}
+
+    def settle(self, timeout):
+        """
+        Record samples until usage is back within thresholds, for at most
+        timeout seconds: threads and sockets take a moment to go away.
+
+        Returns:
+            dict: growth past thresholds in the last sample.
+        """
+        deadline = time.time() + timeout
+        while True:
+            gc.collect()
+            failed = self.record()
+            if not failed or time.time() >= deadline:
+                return failed
+            time.sleep(0.5)
+
+    def leak_report(self, top=15):
+        """
+        Returns:
+            str: object types and threads that grew since the baseline.
+        """
+        lines = ["object types (+growth):"]
+        grown = type_counts() - self._baseline_types
+        for name, count in grown.most_common(top):
+            lines.append("  {:>8}  {}".format("+{}".format(count), name))
+        lines.append("threads (+growth):")
+        for name, count in (thread_names() - self._baseline_threads).most_common(top):
+            lines.append("  {:>8}  {}".format("+{}".format(count), name))
+        return "\n".join(lines)
+
+def churn_forward(manager, ports, keyfile):
+    local_port = free_port()
+    tunnel = manager.create_tunnel("127.0.0.1", "127.0.0.1", local_port, ports["pyro"],
+                                   port=ports["ssh"], keyfile=keyfile)
+    with Pyro4.Proxy(pyro_echo_uri(local_port)) as proxy:
+        for i in range(5):
+            assert proxy.square(i) == i**2
+    manager.destroy_tunnel(tunnel.tunnel_id)
+
+def churn_reverse(manager, ports, keyfile, echo_port):
+    remote_port = free_port()
+    tunnel = manager.create_tunnel("127.0.0.1", "127.0.0.1", remote_port, echo_port,
+                                   port=ports["ssh"], keyfile=keyfile, reverse=True)
+    sock = socket.create_connection(("127.0.0.1", remote_port), timeout=5.0)
+    try:
+        sock.sendall(b"ping")
+        assert sock.recv(4) == b"ping"
+    finally:
+        sock.close()
+    manager.destroy_tunnel(tunnel.tunnel_id)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to run")
+    parser.add_argument("--sample-interval", type=float, default=10.0)
+    parser.add_argument("--warmup", type=int, default=20, help="cycles before the baseline")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-threads", type=int, default=4, help="allowed thread growth")
+    parser.add_argument("--max-fds", type=int, default=16, help="allowed file descriptor growth")
+    parser.add_argument("--max-rss", type=float, default=32.0, help="allowed RSS growth, in MB")
+    parser.add_argument("--max-transports", type=int, default=0, help="allowed transport growth")
+    parser.add_argument("--max-tunnels", type=int, default=0, help="allowed tunnel growth")
+    parser.add_argument("--settle", type=float, default=15.0,
+                        help="seconds allowed for usage to go back down after the churn")
+    args = parser.parse_args()
+
+    thresholds = {"threads": args.max_threads, "fds": args.max_fds, "rss_mb": args.max_rss,
+                  "transports": args.max_transports, "tunnels": args.max_tunnels}
+    # what a single worker can have open mid-cycle: a tunnel with its transport,
+    # relay threads and sockets on both ends.
+    inflight = {"threads": 12 * args.workers, "fds": 12 * args.workers,
+                "transports": 2 * args.workers, "tunnels": args.workers}
+    proc, ports = start_loopback()
+    keyfile = generate_client_key()
+    echo = EchoServer()
+    spawn(echo.serve_forever)
+    manager = SSHTunnelManager()
+    monitor = SoakMonitor(manager, thresholds)
+    cycles, errors = [0], collections.Counter()
+    stop = threading.Event()
+
+    def cycle():
+        churn_forward(manager, ports, keyfile)
+        churn_reverse(manager, ports, keyfile, echo.port)
+
+    def worker():
+        while not stop.is_set():
+            try:
+                cycle()
+            except Exception as err:
+                errors[type(err).__name__] += 1
+                module_logger.debug("worker: {!r}".format(err))
+            cycles[0] += 1
+
+    failed = {}
+    try:
+        for i in range(args.warmup):
+            cycle()
+        monitor.set_baseline()
+        print("baseline: {}".format(dict(monitor.baseline)))
+        workers = [threading.Thread(target=worker) for i in range(args.workers)]
+        for thread in workers:
+            thread.daemon = True
+            thread.start()
+        deadline = time.time() + args.duration
+        while time.time() < deadline and not failed:
+            stop.wait(min(args.sample_interval, max(deadline - time.time(), 0)))
+            failed = monitor.record(allowance=inflight)
+            elapsed, sample = monitor.samples[-1]
+            print("{:8.0f}s  cycles {:6d}  errors {:4d}  {}".format(
+                elapsed, cycles[0], sum(errors.values()),
+                "  ".join("{} {:.1f}".format(name, value) for name, value in sample.items())))
+        stop.set()
+        for thread in workers:
+            thread.join()
+        if not failed:
+            failed = monitor.settle(args.settle)
+    finally:
+        stop.set()
+        manager.cleanup()
+        proc.terminate()
+
+    if errors:
+        print("errors: {}".format(dict(errors)))
+    if failed:
+        print("FAILED, grew past thresholds: {}".format(failed))
+        print(monitor.leak_report())
+        sys.exit(1)
+    print("OK, {} cycles".format(cycles[0]))
+
+if __name__ == "__main__":
+    main()
@@ -45,8 +45,6 @@ with trifeni.DaemonTunnel(remote_server_name="remote_alias") as dt:
 # but it might be useful to use callbacks when calling methods that take a long
 # time to call (longer than the timeout of the server).
 
-import threading
-
 class Callbacks(object):
 
     @Pyro4.expose
@@ -54,9 +52,25 @@ class Callbacks(object):
         print(res)
         # do something with res
 
-callbacks = Callbacks()
+# register_callback registers the object with a daemon trifeni runs for the
+# whole process, and forwards the daemon's port from the remote. Every tunnel
+# to the same remote shares that one reverse forward.
+
+with trifeni.DaemonTunnel(remote_server_name="remote_alias") as dt:
+    handler = Pyro4.Proxy(dt.register_callback(Callbacks()))
+    obj_proxy = dt.get_remote_object(uri, proxy_class=MyProxy)
+    obj_proxy.square_with_callback(100, callback_info={
+        "handler": handler,
+        "callback_name": "some_callback"
+    })
+
+# A daemon of your own can still be used, with register_remote_daemon. It gets
+# a shared reverse forward too.
+
+import threading
+
 fresh_daemon = Pyro4.Daemon()
-fresh_daemon_uri = fresh_daemon.register(callbacks)
+fresh_daemon_uri = fresh_daemon.register(Callbacks())
 daemon_thread = threading.Thread(target=fresh_daemon.requestLoop)
 daemon_thread.daemon = True
 daemon_thread.start()
@@ -65,6 +79,6 @@ with trifeni.DaemonTunnel(remote_server_name="remote_alias") as dt:
     dt.register_remote_daemon(fresh_daemon)
     obj_proxy = dt.get_remote_object(uri, proxy_class=MyProxy)
     obj_proxy.square_with_callback(100, callback_info={
-        "handler": Pyro4.Proxy(fresh_daemon_uri)
+        "handler": Pyro4.Proxy(fresh_daemon_uri),
         "callback_name": "some_callback"
     })
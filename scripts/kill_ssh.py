@@ -1,4 +1,4 @@
-from pyro4tunneling.util import kill_processes
+from trifeni.util import kill_processes
 
 if __name__ == '__main__':
     kill_processes('ssh', '-L')
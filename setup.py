@@ -1,11 +1,12 @@
 import os
+import re
 from setuptools import setup
 
-from .trifeni import __version__
-
 def read(fname):
     return open(os.path.join(os.path.dirname(__file__), fname)).read()
 
+__version__ = re.search(r'__version__ = "(.*)"', read("trifeni/__init__.py")).group(1)
+
 setup(
     name = "trifeni",
     version = __version__,
@@ -15,7 +16,10 @@ setup(
     install_requires=[
         'Pyro4', 'paramiko'
     ],
-    packages=["trifeni"],
+    packages=["trifeni", "trifeni.util"],
+    entry_points={
+        "console_scripts": ["trifeni = trifeni.cli:main"]
+    },
     keywords = ["pyro4","tunneling","ssh tunneling"],
     url = "https://github.com/dean-shaff/pyro4tunneling",
     data_files = [("", ["LICENSE"])]
@@ -0,0 +1,69 @@
+import unittest
+import logging
+import threading
+
+import Pyro4
+
+from trifeni import CommandQueue, batch, oneway
+from . import TestServer
+
+module_logger = logging.getLogger(__name__)
+
+class TestBatching(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.daemon = Pyro4.Daemon()
+        cls.uri = cls.daemon.register(TestServer())
+        cls.daemon_thread = threading.Thread(target=cls.daemon.requestLoop)
+        cls.daemon_thread.daemon = True
+        cls.daemon_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.daemon.shutdown()
+
+    def test_batch(self):
+        with Pyro4.Proxy(self.uri) as proxy:
+            with batch(proxy) as b:
+                for x in range(5):
+                    b.square(x)
+                self.assertEqual(list(b()), [x**2 for x in range(5)])
+
+    def test_oneway(self):
+        with Pyro4.Proxy(self.uri) as proxy:
+            self.assertIsNone(oneway(proxy, "square").square(3))
+
+    def test_command_queue_flush(self):
+        with Pyro4.Proxy(self.uri) as proxy:
+            queue = CommandQueue(proxy, max_size=1000, max_delay=60.0, oneway=False)
+            for x in range(10):
+                queue.submit("square", x)
+            self.assertEqual(queue.flush(), [x**2 for x in range(10)])
+            queue.close()
+            self.assertEqual(queue.stats["submitted"], 10)
+            self.assertEqual(queue.stats["batches"], 1)
+
+    def test_command_queue_flush_error(self):
+        with Pyro4.Proxy(self.uri) as proxy:
+            with CommandQueue(proxy, max_size=1000, max_delay=60.0, oneway=False) as queue:
+                queue.submit("square", 2)
+                queue.submit("square", "not a number")
+                queue.submit("square", 3)
+                with self.assertRaises(TypeError):
+                    queue.flush()
+                self.assertEqual(queue.stats["errors"], 1)
+                queue.submit("square", 4)
+                self.assertEqual(queue.flush(), [16])
+
+    def test_command_queue_size(self):
+        with Pyro4.Proxy(self.uri) as proxy:
+            with CommandQueue(proxy, max_size=4, max_delay=60.0) as queue:
+                for x in range(8):
+                    queue.submit("square", x)
+            self.assertEqual(queue.stats["batches"], 2)
+            self.assertEqual(queue.stats["errors"], 0)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import logging
+import threading
+
+import Pyro4
+
+from trifeni import CallbackDaemon, DaemonTunnel
+from trifeni.errors import TunnelError
+
+module_logger = logging.getLogger(__name__)
+
+class FakeTunnel(object):
+    def __init__(self, args, kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.tunnel_id = str(id(self))
+        self.open = args[0] != "10.0.0.9" # never connects
+
+class FakeManager(object):
+    unblocked = threading.Event()
+    def __init__(self):
+        self.tunnels = {}
+    def create_tunnel(self, *args, **kwargs):
+        if args[0] == "10.0.0.8": # slow to connect
+            self.unblocked.wait(5.0)
+        tunnel = FakeTunnel(args, kwargs)
+        self.tunnels[tunnel.tunnel_id] = tunnel
+        return tunnel
+    def destroy_tunnel(self, _id):
+        del self.tunnels[_id]
+
+class FakeCallbackDaemon(CallbackDaemon):
+    def create_manager(self):
+        return FakeManager()
+
+@Pyro4.expose
+class Callbacks(object):
+    def __init__(self):
+        self.results = []
+    def some_callback(self, res):
+        self.results.append(res)
+        return len(self.results)
+
+class TestCallbackDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.callbacks = FakeCallbackDaemon(host="127.0.0.1")
+
+    def tearDown(self):
+        self.callbacks.shutdown()
+
+    def test_register(self):
+        handler = Callbacks()
+        uri = self.callbacks.register(handler)
+        self.assertEqual(self.callbacks.register(handler), uri)
+        self.assertEqual(uri.port, self.callbacks.port)
+        with Pyro4.Proxy(uri) as proxy:
+            self.assertEqual(proxy.some_callback(4), 1)
+        self.assertEqual(handler.results, [4])
+        self.callbacks.unregister(handler)
+        self.assertNotIn(uri.object, self.callbacks.daemon.objectsById)
+
+    def test_forwards(self):
+        first = self.callbacks.acquire_forward("10.0.0.5", username="obs")
+        second = self.callbacks.acquire_forward("10.0.0.5", username="obs")
+        other = self.callbacks.acquire_forward("10.0.0.6", username="obs")
+        self.assertIs(first, second)
+        self.assertEqual(first.refcount, 2)
+        tunnel, = first.manager.tunnels.values()
+        port = self.callbacks.port
+        self.assertEqual(tunnel.args, ("10.0.0.5", "127.0.0.1", port, port))
+        self.assertTrue(tunnel.kwargs["reverse"])
+        self.callbacks.release_forward(first)
+        self.assertIn(first.key, self.callbacks.forwards)
+        self.callbacks.release_forward(second)
+        self.assertNotIn(first.key, self.callbacks.forwards)
+        self.assertEqual(first.manager.tunnels, {})
+        self.assertIn(other.key, self.callbacks.forwards)
+
+    def test_forward_failed(self):
+        with self.assertRaises(TunnelError):
+            self.callbacks.acquire_forward("10.0.0.9", username="obs")
+        self.assertEqual(self.callbacks.forwards, {})
+        with self.assertRaises(TunnelError): # tried again, not cached
+            self.callbacks.acquire_forward("10.0.0.9", username="obs")
+
+    def test_forward_outside_lock(self):
+        FakeManager.unblocked.clear()
+        slow = threading.Thread(target=self.callbacks.acquire_forward, args=("10.0.0.8",),
+                                kwargs={"username": "obs"})
+        slow.start()
+        try:
+            forward = self.callbacks.acquire_forward("10.0.0.5", username="obs")
+            self.assertTrue(forward.open)
+            self.assertTrue(slow.is_alive())
+        finally:
+            FakeManager.unblocked.set()
+            slow.join()
+
+    def test_local_tunnel(self):
+        with DaemonTunnel(local=True) as dt:
+            uri = dt.register_callback(Callbacks())
+            self.assertEqual(dt.callback_forwards, {})
+        self.assertIsInstance(uri, Pyro4.core.URI)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+import logging
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+
+import Pyro4
+
+from trifeni import util, TunnelAgent
+from trifeni.cli import (top_rows, format_table, parse_port, create_parser, remove_stale_socket,
+                         private_dir, agent_daemon)
+
+module_logger = logging.getLogger(__name__)
+
+class StatsTunnel(object):
+    def __init__(self, tunnel_id, local_port):
+        self.tunnel_id = tunnel_id
+        self.remote_alias = "remote"
+        self.remote_ip = "10.0.0.1"
+        self.port = 22
+        self.username = "user"
+        self.relay_ip = "localhost"
+        self.local_port = local_port
+        self.remote_port = local_port
+        self.reverse = False
+        self.open = True
+        self.stats = util.TunnelStats()
+        self.destroyed = False
+    def destroy(self, drain_timeout=None):
+        self.destroyed = True
+
+class TestCLI(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = util.SSHTunnelManager()
+        for tunnel in (StatsTunnel("aaaa1111", 9090), StatsTunnel("bbbb2222", 9091)):
+            self.manager.tunnels[tunnel.tunnel_id] = tunnel
+        self.agent = TunnelAgent(self.manager)
+
+    def test_tunnel_stats(self):
+        stats = util.TunnelStats()
+        stats.opened(0.01)
+        stats.transferred(bytes_out=10)
+        stats.transferred(bytes_in=20)
+        stats.failed()
+        snapshot = stats.snapshot()
+        self.assertEqual((snapshot["connections"], snapshot["bytes_out"], snapshot["bytes_in"],
+                          snapshot["errors"]), (1, 10, 20, 1))
+        stats.closed()
+        self.assertEqual(stats.snapshot()["connections_total"], 1)
+        self.assertEqual(stats.snapshot()["connections"], 0)
+
+    def test_agent(self):
+        self.assertEqual(len(self.agent.list_tunnels()), 2)
+        self.assertEqual(self.agent.describe("bbbb")["local_port"], 9091)
+        with self.assertRaises(KeyError):
+            self.agent.describe("cccc")
+        self.assertEqual(self.agent.destroy_tunnel("aaaa"), "aaaa1111")
+        self.assertEqual(list(self.agent.stats()), ["bbbb2222"])
+
+    def test_top_rows(self):
+        previous = self.agent.stats()
+        previous["aaaa1111"]["time"] -= 1.0
+        previous["bbbb2222"]["time"] -= 1.0
+        busy = self.manager.tunnels["bbbb2222"].stats
+        busy.opened(0.002)
+        busy.transferred(bytes_out=4096, bytes_in=2048)
+        rows = top_rows(self.agent.list_tunnels(), previous)
+        self.assertEqual(rows[0][0], "bbbb2222")
+        self.assertEqual(rows[0][3], "1/1")
+        self.assertEqual(rows[1][6], "-")
+        self.assertIn("ROUTE", format_table(["ID", "ROUTE"], [row[:2] for row in rows]))
+
+    def test_parser(self):
+        args = create_parser().parse_args(["create", "remote", "9090", "/tmp/remote.sock", "-R"])
+        self.assertTrue(args.reverse)
+        self.assertEqual(parse_port(args.local_port), 9090)
+        self.assertEqual(parse_port(args.remote_port), "/tmp/remote.sock")
+
+    def test_remove_stale_socket(self):
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, "agent.sock")
+        try:
+            remove_stale_socket(path)
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(path)
+            listener.listen(1)
+            with self.assertRaises(EnvironmentError):
+                remove_stale_socket(path)
+            self.assertTrue(os.path.exists(path))
+            listener.close() # the socket file outlives the agent
+            remove_stale_socket(path)
+            self.assertFalse(os.path.exists(path))
+            with open(path, "w") as f:
+                f.write("not a socket")
+            with self.assertRaises(EnvironmentError):
+                remove_stale_socket(path)
+            self.assertTrue(os.path.exists(path))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_socket_permissions(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            agent_dir = os.path.join(tmp_dir, "trifeni-me")
+            private_dir(agent_dir)
+            self.assertEqual(stat.S_IMODE(os.stat(agent_dir).st_mode), 0o700)
+            private_dir(agent_dir)
+            os.chmod(agent_dir, 0o755)
+            with self.assertRaises(EnvironmentError):
+                private_dir(agent_dir)
+            os.chmod(agent_dir, 0o700)
+            path = os.path.join(agent_dir, "agent.sock")
+            daemon = agent_daemon(Pyro4.core.URI("PYRO:agent@./u:{}".format(path)))
+            try:
+                self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+            finally:
+                daemon.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_tcp_needs_key(self):
+        uri = Pyro4.core.URI("PYRO:{}@127.0.0.1:0".format(TunnelAgent.object_id))
+        with self.assertRaises(ValueError):
+            agent_daemon(uri)
+        daemon = agent_daemon(uri, hmac_key=b"secret")
+        agent_uri = daemon.register(self.agent, TunnelAgent.object_id)
+        thread = threading.Thread(target=daemon.requestLoop)
+        thread.daemon = True
+        thread.start()
+        try:
+            with Pyro4.Proxy(agent_uri) as proxy:
+                with self.assertRaises(Pyro4.errors.CommunicationError):
+                    proxy.list_tunnels()
+            with Pyro4.Proxy(agent_uri) as proxy:
+                proxy._pyroHmacKey = b"secret"
+                self.assertEqual(len(proxy.list_tunnels()), 2)
+        finally:
+            daemon.shutdown()
+            thread.join()
+            daemon.close()
+
+if __name__ == "__main__":
+    unittest.main()
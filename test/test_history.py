@@ -0,0 +1,82 @@
+import unittest
+import logging
+import shutil
+import tempfile
+import time
+
+from trifeni import AccessHistory
+from trifeni.history import Prewarmer
+
+module_logger = logging.getLogger(__name__)
+
+class FakeTunnel(object):
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.warmed = []
+    def warmable(self, spec):
+        return "name" in spec
+    def warm(self, spec):
+        time.sleep(self.delay)
+        if spec["name"] == "Broken":
+            raise IOError("no route")
+        self.warmed.append(spec["name"])
+
+class TestAccessHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.history = AccessHistory(self.directory, max_entries=3, half_life=3600.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record(self):
+        for name in ["a", "b", "b", "c", "d"]:
+            self.history.record("me@station:22", {"name": name})
+        entries = self.history.entries("me@station:22")
+        self.assertEqual(len(entries), 3)
+        self.assertEqual(self.history.top("me@station:22", 1), [{"name": "b"}])
+        reloaded = AccessHistory(self.directory)
+        self.assertEqual(len(reloaded.top("me@station:22")), 3)
+        self.assertEqual(reloaded.top("me@other:22"), [])
+
+    def test_score(self):
+        now = time.time()
+        recent = {"count": 1, "last": now}
+        old = {"count": 3, "last": now - 2*3600.0}
+        self.assertGreater(self.history.score(recent, now), self.history.score(old, now))
+
+class TestPrewarmer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.history = AccessHistory(self.directory)
+        for spec in [{"name": "A"}, {"name": "A"}, {"name": "Broken"}, {"uri": "PYRO:x@localhost:1"}]:
+            self.history.record("station", spec)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hits(self):
+        tunnel = FakeTunnel(delay=0.1)
+        prewarmer = Prewarmer(tunnel, self.history, "station")
+        prewarmer.start()
+        self.assertTrue(prewarmer.access({"name": "A"})) # waits for the warm up
+        self.assertFalse(prewarmer.access({"name": "Broken"}))
+        self.assertFalse(prewarmer.access({"name": "New"}))
+        self.assertIsNone(prewarmer.access({"name": "A"}))
+        prewarmer.stop()
+        self.assertEqual(tunnel.warmed, ["A"])
+        stats = prewarmer.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertEqual(self.history.entries("station")['{"name": "A"}']["count"], 3)
+
+    def test_limit(self):
+        tunnel = FakeTunnel()
+        prewarmer = Prewarmer(tunnel, self.history, "station", limit=1)
+        prewarmer.start()
+        prewarmer.join()
+        self.assertEqual(tunnel.warmed, ["A"])
+
+if __name__ == "__main__":
+    unittest.main()
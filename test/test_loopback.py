@@ -0,0 +1,187 @@
+"""
+Integration tests of the relay paths, through the loopback SSH stand-in that
+the benchmarks use.
+"""
+import unittest
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+import Pyro4
+
+from trifeni import SSHTunnelManager
+from trifeni.util import TrafficScheduler, check_connection, metrics
+
+from benchmarks.loopback import (start_loopback, generate_client_key, fetch_blob,
+                                 free_port, pyro_echo_uri, spawn)
+
+module_logger = logging.getLogger(__name__)
+
+def recv_all(sock, nbytes):
+    buf = b""
+    while len(buf) < nbytes:
+        data = sock.recv(nbytes - len(buf))
+        if len(data) == 0:
+            break
+        buf += data
+    return buf
+
+class UnixEchoServer(object):
+    """Echo server on a Unix domain socket, standing in for a remote one."""
+    def __init__(self, path):
+        self.path = path
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen(8)
+        spawn(self.serve_forever)
+
+    def serve_forever(self):
+        while True:
+            try:
+                sock, addr = self.listener.accept()
+            except socket.error:
+                return
+            spawn(self.serve_client, sock)
+
+    def serve_client(self, sock):
+        try:
+            while True:
+                data = sock.recv(4096)
+                if len(data) == 0:
+                    return
+                sock.sendall(data)
+        except socket.error:
+            pass
+        finally:
+            sock.close()
+
+    def close(self):
+        self.listener.close()
+
+class TestLoopback(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.proc, cls.ports = start_loopback()
+        cls.keyfile = generate_client_key()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.proc.terminate()
+        os.remove(cls.keyfile)
+
+    def create_tunnel(self, manager, remote_port, **kwargs):
+        local_port = free_port()
+        tunnel = manager.create_tunnel("127.0.0.1", "127.0.0.1", local_port, remote_port,
+                                       port=self.ports["ssh"], keyfile=self.keyfile, **kwargs)
+        self.assertTrue(tunnel.open)
+        return tunnel
+
+    def test_striping(self):
+        with SSHTunnelManager(transports_per_host=2) as manager:
+            tunnel = self.create_tunnel(manager, self.ports["echo"])
+            pool = tunnel.transport_pool
+            self.assertEqual(len(pool.clients), 2)
+            socks = [socket.create_connection(("127.0.0.1", tunnel.local_port)) for i in range(2)]
+            for i, sock in enumerate(socks):
+                sock.sendall("hello {}".format(i).encode())
+            for i, sock in enumerate(socks):
+                self.assertEqual(recv_all(sock, 7), "hello {}".format(i).encode())
+            # round robin: one connection on each transport.
+            self.assertEqual(pool.active, [1, 1])
+            for sock in socks:
+                sock.close()
+            # a second tunnel to the host shares the pool.
+            tunnel_blob = self.create_tunnel(manager, self.ports["blob"])
+            self.assertIs(tunnel_blob.transport_pool, pool)
+            received = [0, 0]
+            def fetch(i):
+                received[i] = fetch_blob("127.0.0.1", tunnel_blob.local_port, 2**22)
+            threads = [threading.Thread(target=fetch, args=(i,)) for i in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(received, [2**22, 2**22])
+
+    def test_drain(self):
+        payload = "x" * 2**22
+        results = []
+        with SSHTunnelManager() as manager:
+            tunnel = self.create_tunnel(manager, self.ports["pyro"])
+            proxy = Pyro4.Proxy(pyro_echo_uri(tunnel.local_port))
+            check_connection(proxy._pyroBind, timeout=0.5, attempts=10)
+
+            def call():
+                results.append(proxy.echo(payload))
+
+            thread = threading.Thread(target=call)
+            thread.start()
+            while tunnel.stats.bytes_out == 0 and thread.is_alive():
+                thread.join(0.001)
+            metrics.reset()
+            manager.destroy_tunnel(tunnel.tunnel_id, drain_timeout=30.0)
+            thread.join()
+            proxy._pyroRelease()
+        counters = metrics.snapshot()["counters"]
+        self.assertEqual(results, [payload])
+        self.assertEqual(counters["drain.connections"], 1)
+        self.assertEqual(counters["drain.closed_idle"], 1)
+        self.assertEqual(counters["drain.forced"], 0)
+
+    def test_unix_socket(self):
+        tmp_dir = tempfile.mkdtemp()
+        server = UnixEchoServer(os.path.join(tmp_dir, "echo.sock"))
+        try:
+            with SSHTunnelManager() as manager:
+                tunnel = self.create_tunnel(manager, server.path)
+                sock = socket.create_connection(("127.0.0.1", tunnel.local_port))
+                sock.sendall(b"over streamlocal")
+                self.assertEqual(recv_all(sock, 16), b"over streamlocal")
+                sock.close()
+
+                local_path = os.path.join(tmp_dir, "local.sock")
+                manager.create_tunnel("127.0.0.1", "127.0.0.1", local_path, server.path,
+                                      port=self.ports["ssh"], keyfile=self.keyfile)
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(local_path)
+                sock.sendall(b"socket to socket")
+                self.assertEqual(recv_all(sock, 16), b"socket to socket")
+                sock.close()
+        finally:
+            server.close()
+            shutil.rmtree(tmp_dir)
+
+    def test_traffic_classes(self):
+        metrics.reset()
+        with SSHTunnelManager() as manager:
+            control = self.create_tunnel(manager, self.ports["pyro"], traffic_class="control")
+            pool = control.transport_pool
+            bulk = manager.create_tunnel("127.0.0.1", "127.0.0.1", free_port(), self.ports["blob"],
+                                         port=self.ports["ssh"], keyfile=self.keyfile,
+                                         transport_pool=pool, traffic_class="bulk")
+            proxy = Pyro4.Proxy(pyro_echo_uri(control.local_port))
+            check_connection(proxy._pyroBind, timeout=0.5, attempts=10)
+            received = []
+            thread = threading.Thread(target=lambda: received.append(
+                fetch_blob("127.0.0.1", bulk.local_port, 2**24)))
+            thread.start()
+            squares = [proxy.square(i) for i in range(50)]
+            # oneway calls get no response, and mustn't hold bulk tunnels off.
+            proxy._pyroOneway.add("echo")
+            proxy.echo("fire and forget")
+            time.sleep(0.2)
+            scheduler = TrafficScheduler.for_host(("127.0.0.1", self.ports["ssh"]))
+            self.assertIs(control.traffic.scheduler, scheduler)
+            self.assertIsNone(scheduler.most_urgent)
+            thread.join()
+            proxy._pyroRelease()
+        self.assertEqual(squares, [i**2 for i in range(50)])
+        self.assertEqual(received, [2**24])
+
+if __name__ == "__main__":
+    unittest.main()
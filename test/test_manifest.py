@@ -0,0 +1,150 @@
+import unittest
+import logging
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import Pyro4
+import Pyro4.naming
+import Pyro4.socketutil
+
+from trifeni import Manifest, ManifestApplier, ManifestWatcher, config
+
+module_logger = logging.getLogger(__name__)
+
+class FakeTunnel(object):
+    def __init__(self, args, kwargs):
+        self.args = args
+        self.tunnel_id = kwargs["tunnel_id"]
+        self.open = args[2] != 9999 # port 9999 never connects
+
+class FakeManager(object):
+    def __init__(self):
+        self.tunnels = {}
+        self.created = 0
+        self.destroyed = 0
+    def create_tunnels(self, specs, max_workers=8):
+        for spec in specs:
+            tunnel = FakeTunnel(spec["args"], spec["kwargs"])
+            self.tunnels[tunnel.tunnel_id] = tunnel
+            self.created += 1
+    def destroy_tunnel(self, _id, drain_timeout=None):
+        del self.tunnels[_id]
+        self.destroyed += 1
+
+def forwards(*ports):
+    return {"forwards": [{"host": "station", "local_port": port} for port in ports]}
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = FakeManager()
+        self.applier = ManifestApplier(self.manager)
+
+    def tearDown(self):
+        config.set_manifest_hosts({})
+
+    def test_tunnel_specs(self):
+        manifest = Manifest.from_dict({
+            "hosts": {"station": {"HostName": "10.0.0.5"}},
+            "reverse": [{"host": "station", "local_port": 50000}],
+            "objects": {"a": {"host": "station"}, "b": {"host": "station"},
+                        "c": {"host": "station", "uri": "PYRO:c@localhost:50001"}}
+        })
+        config.set_manifest_hosts(manifest.host_entries())
+        specs = list(manifest.tunnel_specs().values())
+        self.assertEqual(len(specs), 3)
+        self.assertIn({"args": ["station", "localhost", 9090, 9090], "kwargs": {}}, specs)
+        with self.assertRaises(ValueError):
+            Manifest.from_dict({"forward": []})
+
+    def test_bad_hosts(self):
+        with self.assertRaises(ValueError) as context:
+            Manifest.from_dict({"hosts": {"station": {"User": "obs"}}})
+        self.assertIn("station", str(context.exception))
+        with self.assertRaises(ValueError):
+            Manifest.from_dict({"hosts": {"station": {"HostName": "10.0.0.5", "Port": "ssh"}}})
+        manifest = Manifest.from_dict({"hosts": {"a": {"HostName": "10.0.0.5", "Port": "2222"},
+                                                 "b": {"HostName": "10.0.0.6"}}})
+        self.assertEqual((manifest.hosts["a"]["Port"], manifest.hosts["b"]["Port"]), (2222, 22))
+
+    def test_apply(self):
+        result = self.applier.apply(Manifest.from_dict(forwards(9090, 9091)))
+        self.assertEqual(result, {"opened": 2, "closed": 0, "unchanged": 0, "failed": 0})
+        kept = dict(self.manager.tunnels)
+        result = self.applier.apply(Manifest.from_dict(forwards(9090, 9092)))
+        self.assertEqual(result, {"opened": 1, "closed": 1, "unchanged": 1, "failed": 0})
+        self.assertTrue(set(kept) & set(self.manager.tunnels))
+        self.assertEqual(self.manager.created, 3)
+        self.applier.cleanup()
+        self.assertEqual(self.manager.tunnels, {})
+
+    def test_host_change(self):
+        manifest = dict(forwards(9090), hosts={"station": {"HostName": "10.0.0.5"}})
+        self.applier.apply(Manifest.from_dict(manifest))
+        manifest["hosts"]["station"]["HostName"] = "10.0.0.6"
+        result = self.applier.apply(Manifest.from_dict(manifest))
+        self.assertEqual((result["opened"], result["closed"]), (1, 1))
+
+    def test_hosts_replaced(self):
+        manifest = dict(forwards(9090), hosts={"station": {"HostName": "10.0.0.5"}})
+        self.applier.apply(Manifest.from_dict(manifest))
+        self.assertEqual(config.get_host("station")["HostName"], "10.0.0.5")
+        self.assertNotIn("station", config.hosts)
+        self.applier.apply(Manifest.from_dict(forwards(9090)))
+        self.assertIsNone(config.get_host("station"))
+
+    def test_nameserver_objects(self):
+        ns_port = Pyro4.socketutil.findProbablyUnusedPort()
+        ns_uri, ns_daemon, ns_server = Pyro4.naming.startNS(port=ns_port)
+        thread = threading.Thread(target=ns_daemon.requestLoop)
+        thread.daemon = True
+        thread.start()
+        try:
+            # the fake manager forwards nothing, so look up on the nameserver itself.
+            manifest = Manifest.from_dict({"objects": {
+                "Telescope": {"host": "station", "ns_port": ns_port},
+                "Missing": {"host": "station", "ns_port": ns_port}}})
+            ns_daemon.nameserver.register("Telescope", "PYRO:Telescope@localhost:50123")
+            result = self.applier.apply(manifest)
+            self.assertEqual((result["opened"], result["failed"]), (2, 1))
+            routes = sorted(tunnel.args[2:] for tunnel in self.manager.tunnels.values())
+            self.assertEqual(routes, sorted([[ns_port, ns_port], [50123, 50123]]))
+
+            # the daemon moved: its forward is replaced.
+            ns_daemon.nameserver.register("Telescope", "PYRO:Telescope@localhost:50124", safe=False)
+            result = self.applier.apply(manifest)
+            self.assertEqual((result["opened"], result["closed"], result["unchanged"]), (1, 1, 1))
+            routes = sorted(tunnel.args[2:] for tunnel in self.manager.tunnels.values())
+            self.assertEqual(routes, sorted([[ns_port, ns_port], [50124, 50124]]))
+        finally:
+            ns_daemon.shutdown()
+
+    def test_failed(self):
+        result = self.applier.apply(Manifest.from_dict(forwards(9090, 9999)))
+        self.assertEqual((result["opened"], result["failed"]), (1, 1))
+        self.assertEqual(len(self.manager.tunnels), 1)
+        result = self.applier.apply(Manifest.from_dict(forwards(9090, 9999)))
+        self.assertEqual((result["unchanged"], result["failed"]), (1, 1))
+
+    def test_watcher(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(tmp_dir, "manifest.json")
+            with open(file_path, "w") as f:
+                json.dump(forwards(9090), f)
+            watcher = ManifestWatcher(file_path, self.applier,
+                                      ssh_config_path=os.path.join(tmp_dir, "ssh_config"))
+            self.assertEqual(watcher.check()["opened"], 1)
+            self.assertIsNone(watcher.check())
+            with open(file_path, "w") as f:
+                f.write("{")
+            self.assertIsNone(watcher.check())
+            self.assertEqual(len(self.manager.tunnels), 1)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import logging
+import threading
+
+import Pyro4
+import Pyro4.naming
+import Pyro4.socketutil
+
+from trifeni import NameServerTunnel
+from trifeni.nameserver import nameservers
+from trifeni.util import metrics, SSHTunnelManager
+
+module_logger = logging.getLogger(__name__)
+
+class TestSharedNameServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ns_port = Pyro4.socketutil.findProbablyUnusedPort()
+        ns_uri, cls.ns_daemon, ns_server = Pyro4.naming.startNS(port=cls.ns_port)
+        cls.ns_daemon.nameserver.register("TestServer", "PYRO:TestServer@localhost:50000")
+        cls.thread = threading.Thread(target=cls.ns_daemon.requestLoop)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ns_daemon.shutdown()
+
+    def test_shared(self):
+        metrics.reset()
+        tunnels = [NameServerTunnel(ns_port=self.ns_port, local=True) for i in range(3)]
+        self.assertEqual(metrics.snapshot()["counters"]["nameserver.locates"], 1)
+        self.assertIs(tunnels[0].ns, tunnels[2].ns)
+        handle = tunnels[0].nameserver
+        self.assertEqual(handle.refcount, 3)
+        self.assertEqual(str(tunnels[1].lookup_uri("TestServer")), "PYRO:TestServer@localhost:50000")
+        for tunnel in tunnels:
+            tunnel.cleanup()
+        self.assertNotIn(handle.key, nameservers.handles)
+        self.assertIsNone(handle.ns)
+
+    def test_key(self):
+        handles = [nameservers.acquire("localhost", ns_port=self.ns_port, local=True,
+                                       create_tunnel_kwargs=kwargs)
+                   for kwargs in ({"keyfile": "id_a"}, {"keyfile": "id_b"}, {"keyfile": "id_a"})]
+        handles.append(nameservers.acquire("localhost", ns_port=self.ns_port, local=True,
+                                           create_tunnel_kwargs={"keyfile": "id_a"}, backend="openssh"))
+        try:
+            self.assertIs(handles[0], handles[2])
+            self.assertIsNot(handles[0], handles[1])
+            self.assertIsNot(handles[0], handles[3])
+            self.assertEqual(len(nameservers.handles), 3)
+        finally:
+            for handle in handles:
+                nameservers.release(handle)
+        self.assertEqual(nameservers.handles, {})
+
+    def test_unshared(self):
+        with NameServerTunnel(ns_port=self.ns_port, local=True, share_nameserver=False) as ns:
+            self.assertIsNone(ns.nameserver)
+            self.assertEqual(nameservers.handles, {})
+            ns.lookup_uri("TestServer")
+
+    def test_forward_create_tunnel_kwargs(self):
+        created = []
+        def create_tunnel(manager, *args, **kwargs):
+            created.append((args, kwargs))
+        with NameServerTunnel(ns_port=self.ns_port, local=True,
+                              create_tunnel_kwargs={"keyfile": "id_test"}) as ns:
+            original, SSHTunnelManager.create_tunnel = SSHTunnelManager.create_tunnel, create_tunnel
+            try:
+                ns._forward(ns.lookup_uri("TestServer"))
+            finally:
+                SSHTunnelManager.create_tunnel = original
+        self.assertEqual(created[0][0][2:], (50000, 50000))
+        self.assertEqual(created[0][1]["keyfile"], "id_test")
+
+if __name__ == "__main__":
+    unittest.main()
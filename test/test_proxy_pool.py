@@ -0,0 +1,46 @@
+import unittest
+import logging
+import threading
+
+import Pyro4
+
+from trifeni import ProxyPool
+from trifeni.util import thread_map
+from . import TestServer
+
+module_logger = logging.getLogger(__name__)
+
+class TestProxyPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.daemon = Pyro4.Daemon()
+        cls.uri = cls.daemon.register(TestServer())
+        cls.daemon_thread = threading.Thread(target=cls.daemon.requestLoop)
+        cls.daemon_thread.daemon = True
+        cls.daemon_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.daemon.shutdown()
+
+    def test_checkout(self):
+        with ProxyPool(self.uri, size=3) as pool:
+            def square(x):
+                with pool.proxy() as proxy:
+                    return proxy.square(x)
+            self.assertEqual(thread_map(square, range(12), max_workers=6),
+                             [x**2 for x in range(12)])
+            self.assertEqual(pool.status()["idle"], 3)
+
+    def test_broken_proxy_rebound(self):
+        with ProxyPool(self.uri, size=1, reconnect_interval=0.1) as pool:
+            with self.assertRaises(Pyro4.errors.CommunicationError):
+                with pool.proxy() as proxy:
+                    raise Pyro4.errors.ConnectionClosedError("simulated")
+            with pool.proxy(timeout=5.0) as proxy:
+                self.assertEqual(proxy.square(3), 9)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import logging
+import threading
+import time
+
+import Pyro4
+import Pyro4.naming
+import Pyro4.socketutil
+
+from trifeni import ReplicaSet, FailoverProxy
+from trifeni.errors import TunnelError
+from . import TestServer
+
+module_logger = logging.getLogger(__name__)
+
+@Pyro4.expose
+class HungServer(TestServer):
+    def square(self, x):
+        time.sleep(2.0)
+        return x**2
+
+def start_replica(server=None):
+    ns_port = Pyro4.socketutil.findProbablyUnusedPort()
+    ns_uri, ns_daemon, ns_server = Pyro4.naming.startNS(port=ns_port)
+    daemon = Pyro4.Daemon()
+    uri = daemon.register(TestServer() if server is None else server)
+    ns_daemon.nameserver.register("TestServer", uri)
+    for target in (ns_daemon.requestLoop, daemon.requestLoop):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+    return ns_port, ns_daemon, daemon
+
+class TestReplicaSet(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = {name: start_replica() for name in ("a", "b")}
+        self.replicas = {name: {"ns_port": self.servers[name][0]} for name in self.servers}
+
+    def tearDown(self):
+        for ns_port, ns_daemon, daemon in self.servers.values():
+            ns_daemon.shutdown()
+            daemon.shutdown()
+
+    def test_fastest(self):
+        with ReplicaSet(self.replicas, local=True) as replicas:
+            self.assertEqual(len(replicas.ranked()), 2)
+            replicas.replicas["a"].latency, replicas.replicas["b"].latency = 0.01, 0.001
+            proxy = replicas.get_remote_object("TestServer")
+            self.assertIsInstance(proxy, FailoverProxy)
+            self.assertEqual(proxy.replica.name, "b")
+            self.assertEqual(proxy.square(3), 9)
+            proxy._pyroRelease()
+
+    def test_failover(self):
+        with ReplicaSet(self.replicas, local=True) as replicas:
+            replicas.replicas["a"].latency, replicas.replicas["b"].latency = 0.001, 0.01
+            proxy = replicas.get_remote_object("TestServer")
+            self.assertEqual(proxy.replica.name, "a")
+            self.servers["a"][2].shutdown()
+            # the daemon's worker keeps serving the open connection; drop it too.
+            proxy.proxy._pyroConnection.close()
+            self.assertEqual(proxy.square(4), 16)
+            self.assertEqual(proxy.replica.name, "b")
+            self.assertFalse(replicas.replicas["a"].healthy)
+            proxy._pyroRelease()
+
+            self.servers["b"][2].shutdown()
+            with self.assertRaises(TunnelError):
+                replicas.get_remote_object("TestServer")
+
+    def test_call_timeout(self):
+        self.servers["c"] = start_replica(HungServer())
+        replicas = {"b": self.replicas["b"], "c": {"ns_port": self.servers["c"][0]}}
+        with ReplicaSet(replicas, local=True, call_timeout=0.5) as replicas:
+            replicas.replicas["b"].latency, replicas.replicas["c"].latency = 0.01, 0.001
+            proxy = replicas.get_remote_object("TestServer")
+            self.assertEqual(proxy.replica.name, "c")
+            self.assertEqual(proxy.proxy._pyroTimeout, 0.5)
+            self.assertEqual(proxy.square(5), 25)
+            self.assertEqual(proxy.replica.name, "b")
+            self.assertFalse(replicas.replicas["c"].healthy)
+            proxy._pyroRelease()
+
+    def test_unreachable(self):
+        self.replicas["c"] = {"ns_port": Pyro4.socketutil.findProbablyUnusedPort()}
+        with ReplicaSet(self.replicas, local=True) as replicas:
+            status = replicas.status()
+            self.assertFalse(status["c"]["healthy"])
+            self.assertTrue(status["a"]["healthy"])
+            self.assertEqual(len(replicas.ranked()), 2)
+
+if __name__ == "__main__":
+    unittest.main()
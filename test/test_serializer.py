@@ -0,0 +1,58 @@
+import unittest
+import logging
+import threading
+
+import Pyro4
+
+from trifeni import DaemonTunnel, check_serializer
+from trifeni.errors import TunnelError
+from . import TestServer
+
+module_logger = logging.getLogger(__name__)
+
+class TestSerializer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.daemon = Pyro4.Daemon()
+        cls.uri = cls.daemon.register(TestServer())
+        cls.daemon_thread = threading.Thread(target=cls.daemon.requestLoop)
+        cls.daemon_thread.daemon = True
+        cls.daemon_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.daemon.shutdown()
+
+    def test_check_serializer(self):
+        self.assertEqual(check_serializer("marshal"), "marshal")
+        with self.assertRaises(TunnelError):
+            check_serializer("no-such-serializer")
+        if "pickle" not in Pyro4.config.SERIALIZERS_ACCEPTED:
+            with self.assertRaises(TunnelError):
+                check_serializer("pickle")
+
+    def test_tunnel_serializer(self):
+        with DaemonTunnel(local=True, serializer="marshal") as dt:
+            proxy = dt.get_remote_object(self.uri)
+            self.assertEqual(proxy._pyroSerializer, "marshal")
+            self.assertEqual(proxy.square(4), 16)
+            proxy = dt.get_remote_object(self.uri, serializer="json")
+            self.assertEqual(proxy._pyroSerializer, "json")
+            self.assertEqual(proxy.square(5), 25)
+
+    def test_register_remote_daemon(self):
+        accepted = Pyro4.config.SERIALIZERS_ACCEPTED
+        Pyro4.config.SERIALIZERS_ACCEPTED = {"serpent"}
+        try:
+            with Pyro4.Daemon() as daemon:
+                with DaemonTunnel(local=True) as dt:
+                    dt.register_remote_daemon(daemon, serializer="serpent")
+                    with self.assertRaises(TunnelError):
+                        dt.register_remote_daemon(daemon, serializer="marshal")
+        finally:
+            Pyro4.config.SERIALIZERS_ACCEPTED = accepted
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import logging
+import os
+import tempfile
+import threading
+
+import Pyro4
+import Pyro4.naming
+import Pyro4.socketutil
+
+from trifeni import NameServerTunnel
+from . import TestServer
+
+module_logger = logging.getLogger(__name__)
+
+class TestState(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ns_port = Pyro4.socketutil.findProbablyUnusedPort()
+        ns_uri, cls.ns_daemon, ns_server = Pyro4.naming.startNS(port=cls.ns_port)
+        ns_thread = threading.Thread(target=cls.ns_daemon.requestLoop)
+        ns_thread.daemon = True
+        ns_thread.start()
+        cls.daemon = Pyro4.Daemon()
+        cls.uri = cls.daemon.register(TestServer())
+        with Pyro4.locateNS(port=cls.ns_port) as ns:
+            ns.register("TestServer", cls.uri)
+        daemon_thread = threading.Thread(target=cls.daemon.requestLoop)
+        daemon_thread.daemon = True
+        daemon_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.daemon.shutdown()
+        cls.ns_daemon.shutdown()
+
+    def setUp(self):
+        fd, self.state_file_path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.state_file_path)
+
+    def test_save_restore(self):
+        with NameServerTunnel(ns_port=self.ns_port, local=True) as ns:
+            self.assertEqual(ns.get_remote_object("TestServer").square(3), 9)
+            ns.save_state(self.state_file_path)
+
+        with NameServerTunnel(ns_port=self.ns_port, local=True) as ns:
+            self.assertEqual(ns.restore_state(self.state_file_path), [])
+            self.assertEqual(ns.uri_cache["TestServer"], self.uri)
+            ns.ns = None # the cache alone is enough to find the object
+            self.assertEqual(ns.get_remote_object("TestServer").square(4), 16)
+
+    def test_stale_uri(self):
+        daemon = Pyro4.Daemon()
+        uri = daemon.register(TestServer(), objectId="Moved")
+        daemon.close() # nothing listens at the cached location any more
+        with Pyro4.locateNS(port=self.ns_port) as ns_proxy:
+            ns_proxy.register("Moved", self.daemon.uriFor("Moved"))
+        self.daemon.register(TestServer(), objectId="Moved")
+        try:
+            with NameServerTunnel(ns_port=self.ns_port, local=True) as ns:
+                ns.uri_cache["Moved"] = uri
+                self.assertEqual(ns.get_remote_object("Moved").square(5), 25)
+                self.assertEqual(ns.uri_cache["Moved"], self.daemon.uriFor("Moved"))
+        finally:
+            self.daemon.unregister("Moved")
+
+    def test_invalidate(self):
+        with NameServerTunnel(ns_port=self.ns_port, local=True) as ns:
+            ns.lookup_uri("TestServer")
+            ns.invalidate("TestServer")
+            self.assertEqual(ns.uri_cache, {})
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    unittest.main()
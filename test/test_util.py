@@ -1,18 +1,44 @@
+import errno
+import json
 import logging
+import os
 import time
 import unittest
+import socket
+import subprocess
 import sys
+import tempfile
+import threading
+
+import paramiko
+import Pyro4.message
 
 from trifeni import util, config
+from trifeni.errors import TunnelError, PortInUseError
 
 module_logger = logging.getLogger(__name__)
 
+class FakeTunnel(object):
+    def __init__(self):
+        self.destroyed = 0
+    def destroy(self, drain_timeout=None):
+        self.destroyed += 1
+
 class TestUtil(unittest.TestCase):
 
     def test_init_tunnel_manager(self):
 
         tm = util.SSHTunnelManager()
 
+    def test_destroy_tunnel(self):
+        tm = util.SSHTunnelManager()
+        tunnel = FakeTunnel()
+        tm.tunnels["t"], tm.tunnel_specs["t"] = tunnel, {"args": [], "kwargs": {}}
+        tm.destroy_tunnel("t")
+        tm.cleanup()
+        self.assertEqual(tunnel.destroyed, 1)
+        self.assertEqual((tm.tunnels, tm.tunnel_specs), ({}, {}))
+
     def test_create_tunnel(self):
         
         tm = util.SSHTunnelManager()
@@ -20,6 +46,637 @@ class TestUtil(unittest.TestCase):
         module_logger.debug("test_create_tunnel: tunnel {}".format(t))
         time.sleep(2.0)
 
+class FakeTransport(object):
+    def __init__(self, active=True):
+        self.active = active
+    def is_active(self):
+        return self.active
+
+class FakeClient(object):
+    def __init__(self, active=True):
+        self.transport = FakeTransport(active)
+    def get_transport(self):
+        return self.transport
+    def close(self):
+        self.transport.active = False
+
+class TestTransportPool(unittest.TestCase):
+
+    def create_pool(self, size, policy):
+        pool = util.TransportPool("localhost", 22, "me", None, size=size, policy=policy)
+        pool.clients = [FakeClient() for i in range(size)]
+        pool.active = [0 for i in range(size)]
+        return pool
+
+    def test_round_robin(self):
+        pool = self.create_pool(3, "round-robin")
+        indices = [pool.acquire()[0] for i in range(6)]
+        self.assertEqual(indices, [0, 1, 2, 0, 1, 2])
+
+    def test_least_loaded(self):
+        pool = self.create_pool(3, "least-loaded")
+        first = [pool.acquire()[0] for i in range(3)]
+        self.assertEqual(sorted(first), [0, 1, 2])
+        pool.release(1)
+        self.assertEqual(pool.acquire()[0], 1)
+
+    def test_skips_inactive(self):
+        pool = self.create_pool(2, "round-robin")
+        pool.clients[0].close()
+        self.assertEqual([pool.acquire()[0] for i in range(2)], [1, 1])
+
+    def test_reconnect_dead(self):
+        pool = self.create_pool(2, "round-robin")
+        opened = []
+        def open_client(i, look_for_keys, password):
+            opened.append(i)
+            return FakeClient()
+        pool._open = open_client
+        pool._credentials = (False, None)
+        for client in pool.clients:
+            client.close()
+        self.assertFalse(pool.connected)
+        self.assertEqual(pool.dead(), [0, 1])
+        index, transport = pool.acquire()
+        self.assertTrue(transport.is_active())
+        self.assertEqual((sorted(opened), pool.dead()), ([0, 1], []))
+        pool.clients[1].close()
+        pool.connect()
+        self.assertEqual((opened[-1], pool.dead()), (1, []))
+
+    def test_bad_policy(self):
+        with self.assertRaises(ValueError):
+            util.TransportPool("localhost", 22, "me", None, policy="random")
+
+class TestTransportOptions(unittest.TestCase):
+
+    def test_from_host_config(self):
+        options = util.TransportOptions.from_host_config({
+            "HostName": "remote", "Ciphers": "aes128-ctr, aes256-ctr",
+            "Compression": "yes", "WindowSize": "4194304"})
+        self.assertEqual(options.ciphers, ("aes128-ctr", "aes256-ctr"))
+        self.assertTrue(options.compression)
+        self.assertEqual(options.window_size, 4194304)
+        self.assertIsNone(options.macs)
+
+    def test_from_json(self):
+        # json gives unicode strings on Python 2
+        options = util.TransportOptions.from_host_config(json.loads(
+            '{"HostName": "remote", "Ciphers": "aes128-ctr", "Compression": "no"}'))
+        self.assertEqual(options.ciphers, ("aes128-ctr",))
+        self.assertFalse(options.compression)
+
+    def test_update(self):
+        host = util.TransportOptions(compression=True, window_size=2**20)
+        options = host.update({"window_size": 2**22})
+        self.assertTrue(options.compression)
+        self.assertEqual(options.window_size, 2**22)
+        self.assertEqual(host.update(None), host)
+
+    def test_profile(self):
+        self.assertEqual(util.TransportOptions.create("lan"),
+                         util.TransportOptions.profile("lan"))
+        with self.assertRaises(ValueError):
+            util.TransportOptions.profile("warp-speed")
+
+class TestSocketOptions(unittest.TestCase):
+
+    def test_apply(self):
+        sock = socket.socket()
+        util.SocketOptions.create({"nodelay": True, "keepalive": True}).apply(sock)
+        self.assertEqual(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY), 1)
+        self.assertEqual(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 1)
+        sock.close()
+
+    def test_default_profile(self):
+        self.assertTrue(util.SocketOptions.create(None).nodelay)
+        self.assertEqual(util.SocketOptions.create("system").as_dict(), {})
+
+class TestStreamLocal(unittest.TestCase):
+
+    def test_is_socket_path(self):
+        self.assertTrue(util.is_socket_path("/tmp/daemon.sock"))
+        self.assertFalse(util.is_socket_path(9090))
+        self.assertFalse(util.is_socket_path("9090"))
+
+    def test_unix_socket_not_listening(self):
+        self.assertFalse(util.test_unix_socket("/nonexistent/trifeni.sock"))
+
+class TestThreadMap(unittest.TestCase):
+
+    def test_order(self):
+        self.assertEqual(util.thread_map(lambda x: x**2, range(20), max_workers=4),
+                         [x**2 for x in range(20)])
+
+    def test_raises(self):
+        def fail_on_odd(x):
+            if x % 2:
+                raise ValueError(x)
+            return x
+        with self.assertRaises(ValueError):
+            util.thread_map(fail_on_odd, range(4))
+
+class TestOpenSSHBackend(unittest.TestCase):
+
+    def test_ssh_args(self):
+        options = util.TransportOptions(ciphers="aes128-ctr,aes256-ctr", compression=False)
+        self.assertEqual(options.ssh_args(),
+                         ["-c", "aes128-ctr,aes256-ctr", "-o", "Compression=no"])
+
+    def test_control_master_args(self):
+        master = util.ControlMaster("remote.address", 2222, "me", "/path/to/key",
+                                    ssh_options={"StrictHostKeyChecking": "no"})
+        args = master.base_args()
+        self.assertEqual(args[:3], ["ssh", "-S", master.control_path])
+        for pair in (["-p", "2222"], ["-l", "me"], ["-i", "/path/to/key"],
+                     ["-o", "BatchMode=yes"], ["-o", "StrictHostKeyChecking=no"]):
+            self.assertIn(pair, [args[i:i+2] for i in range(len(args) - 1)])
+        self.assertFalse(master.running)
+
+    def test_forward_ready_remote_relay(self):
+        listeners = []
+        class FakeControlMaster(object):
+            def start(self, timeout=None):
+                pass
+            def forward(self, tag, spec):
+                sock = socket.socket()
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                sock.bind(("localhost", int(spec.split(":")[0])))
+                sock.listen(1)
+                listeners.append(sock)
+            def cancel(self, tag, spec):
+                listeners.pop().close()
+            def check(self):
+                return True
+        port = util.free_port()
+        # the relay is on the remote side, ssh still binds locally
+        tunnel = util.OpenSSHTunnel("remote.address", "10.0.0.5", port, 9090,
+                                    control_master=FakeControlMaster(), ready_timeout=2.0)
+        self.assertTrue(tunnel.open)
+        tunnel.destroy()
+        self.assertEqual(listeners, [])
+
+    def test_master_stderr_logged(self):
+        # a stand in ssh that writes more to stderr than a pipe holds, then fails
+        script = tempfile.NamedTemporaryFile("w", suffix=".sh", delete=False)
+        script.write("#!/bin/sh\nhead -c 1000000 /dev/zero | tr '\\0' x >&2\n"
+                     "echo >&2\necho 'Connection refused' >&2\nexit 255\n")
+        script.close()
+        os.chmod(script.name, 0o700)
+        master = util.ControlMaster("remote.address", ssh_command=script.name)
+        try:
+            with self.assertRaises(TunnelError) as context:
+                master.start(timeout=5.0)
+            self.assertTrue(str(context.exception).endswith("Connection refused"))
+        finally:
+            master.stop()
+            os.remove(script.name)
+        self.assertFalse(os.path.exists(master.log_path))
+
+    def test_bad_backend(self):
+        with self.assertRaises(ValueError):
+            util.SSHTunnelManager(backend="telnet")
+
+class TestPortConflicts(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_test_port(self):
+        self.assertTrue(util.test_port(self.port, host="127.0.0.1"))
+        # not an address of this machine, so nothing here can conflict with it
+        self.assertFalse(util.test_port(self.port, host="192.0.2.1"))
+
+    def test_classify_bind_error(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.bind(("127.0.0.1", self.port))
+        except socket.error as err:
+            self.assertEqual(util.classify_bind_error(err), "in-use")
+        finally:
+            sock.close()
+
+    def test_listening_ports(self):
+        listening = util.ListeningPorts()
+        if not listening.available:
+            self.skipTest("no /proc/net/tcp")
+        self.assertTrue(listening.in_use(self.port))
+        self.assertTrue(listening.in_use(self.port, host="127.0.0.1"))
+        self.assertFalse(listening.in_use(self.port, host="192.0.2.1"))
+
+    def test_bind_before_connect(self):
+        with self.assertRaises(PortInUseError) as context:
+            util.SSHTunnel("127.0.0.1", "localhost", self.port, 9090, keyfile=__file__)
+        self.assertEqual(context.exception.port, self.port)
+        if util.ListeningPorts().available:
+            self.assertEqual(context.exception.owner.pid, os.getpid())
+
+    def test_connect_failed(self):
+        ssh_port, local_port = util.free_port("127.0.0.1"), util.free_port("127.0.0.1")
+        util.HandshakeLimiter.for_host(("127.0.0.1", ssh_port)).retries = 0
+        with self.assertRaises(TunnelError):
+            util.SSHTunnel("127.0.0.1", "127.0.0.1", local_port, 9090, port=ssh_port, keyfile=__file__)
+        # the listener was closed along with it
+        self.assertFalse(util.test_port(local_port, host="127.0.0.1"))
+
+    def test_port_owner(self):
+        listening = util.ListeningPorts()
+        if not listening.available:
+            self.skipTest("no /proc/net/tcp")
+        self.assertEqual(util.port_owner(self.port, listening).pid, os.getpid())
+        self.assertIsNone(util.port_owner(util.free_port(), listening))
+
+class FakeRelay(object):
+
+    def __init__(self, server, busy):
+        self.server = server
+        self.busy = busy
+
+    def close_if_idle(self, quiet):
+        if self.busy:
+            return False
+        self.close_relay()
+        return True
+
+    def close_relay(self):
+        self.server.relay_finished(self)
+
+class TestDrain(unittest.TestCase):
+
+    def setUp(self):
+        self.server = util.tunnel_util.ForwardServerMixin()
+        self.server.init_relays()
+
+    def test_drain_idle(self):
+        relays = [FakeRelay(self.server, False) for i in range(3)]
+        for relay in relays:
+            self.server.relay_started(relay)
+        self.assertEqual(self.server.drain(1.0), (3, 3, 0))
+
+    def test_drain_deadline(self):
+        busy = FakeRelay(self.server, True)
+        self.server.relay_started(busy)
+        self.server.relay_started(FakeRelay(self.server, False))
+        self.assertEqual(self.server.drain(0.1), (2, 1, 1))
+        self.assertEqual(self.server.relays, set())
+
+def pyro_message(msg_type, payload, flags=0, seq=1):
+    return Pyro4.message.Message(msg_type, payload, 1, flags, seq).to_bytes()
+
+class TestPyroFramer(unittest.TestCase):
+
+    def test_chunks(self):
+        framer = util.PyroFramer()
+        message = pyro_message(Pyro4.message.MSG_INVOKE, b"x" * 100)
+        self.assertEqual(framer.feed(message[:10]), 0)
+        self.assertTrue(framer.partial)
+        self.assertEqual(framer.feed(message[10:50]), 0)
+        self.assertEqual(framer.feed(message[50:] + message), 2)
+        self.assertFalse(framer.partial)
+        self.assertEqual((framer.messages, framer.replies_due), (2, 2))
+
+    def test_oneway(self):
+        framer = util.PyroFramer()
+        framer.feed(pyro_message(Pyro4.message.MSG_INVOKE, b"x", flags=Pyro4.message.FLAGS_ONEWAY))
+        self.assertEqual((framer.messages, framer.replies_due), (1, 0))
+
+    def test_not_pyro(self):
+        framer = util.PyroFramer()
+        framer.feed(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        self.assertFalse(framer.valid)
+
+class FakeChannelTransport(object):
+    """Opens "channels" as plain connections to address."""
+    def __init__(self, address):
+        self.address = address
+    def open_channel(self, kind, dest_addr, src_addr, **kwargs):
+        return socket.create_connection(self.address)
+
+class FakeChannelPool(object):
+    def __init__(self, address):
+        self.transport = FakeChannelTransport(address)
+    def acquire(self):
+        return 0, self.transport
+    def release(self, index):
+        pass
+
+class TestDrainRelay(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = socket.socket()
+        self.backend.bind(("127.0.0.1", 0))
+        self.backend.listen(1)
+        self.backend.settimeout(5.0)
+        self.server = util.tunnel_util.ForwardServer(("127.0.0.1", 0), util.tunnel_util.ForwardHandler)
+        self.server.set_route("127.0.0.1", self.backend.getsockname()[1],
+                              FakeChannelPool(self.backend.getsockname()), util.TransportOptions())
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.backend.close()
+
+    def test_drain_chunked_response(self):
+        response = pyro_message(Pyro4.message.MSG_RESULT, b"r" * 4000)
+        def respond():
+            conn, address = self.backend.accept()
+            request = pyro_message(Pyro4.message.MSG_INVOKE, b"q" * 50)
+            received = b""
+            while len(received) < len(request):
+                received += conn.recv(4096)
+            # the response comes in two parts, with a long gap between them
+            conn.sendall(response[:1000])
+            time.sleep(0.1)
+            conn.sendall(response[1000:2000])
+            time.sleep(0.1)
+            conn.sendall(response[2000:])
+            conn.recv(1)
+            conn.close()
+        backend_thread = threading.Thread(target=respond)
+        backend_thread.daemon = True
+        backend_thread.start()
+        client = socket.create_connection(self.server.socket.getsockname())
+        client.settimeout(5.0)
+        client.sendall(pyro_message(Pyro4.message.MSG_INVOKE, b"q" * 50))
+        first = client.recv(1000)
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertEqual(self.server.drain(3.0, quiet=0.02), (1, 1, 0))
+        received = first
+        while True:
+            data = client.recv(4096)
+            if not data:
+                break
+            received += data
+        client.close()
+        backend_thread.join()
+        self.assertEqual(received, response)
+
+class EchoHandler(object):
+    def __init__(self, request, client_address, server):
+        request.sendall(request.recv(64))
+        request.close()
+
+class TestAcceptLoop(unittest.TestCase):
+
+    def test_shared_loop(self):
+        loop = util.tunnel_util.AcceptLoop()
+        servers = [util.tunnel_util.ForwardServer(("127.0.0.1", 0), EchoHandler) for i in range(3)]
+        for server in servers:
+            server.serve_in(loop)
+        try:
+            for server in servers:
+                sock = socket.create_connection(server.socket.getsockname(), timeout=2.0)
+                sock.sendall(b"ping")
+                self.assertEqual(sock.recv(64), b"ping")
+                sock.close()
+            self.assertEqual(len([t for t in threading.enumerate() if t is loop.thread]), 1)
+        finally:
+            for server in servers:
+                server.shutdown()
+                server.server_close()
+        self.assertIsNone(servers[0].accept_loop)
+
+    def test_shutdown_unserved(self):
+        server = util.tunnel_util.ForwardServer(("127.0.0.1", 0), EchoHandler)
+        server.shutdown() # doesn't wait for a serve_forever that never ran
+        server.server_close()
+
+    def test_lean_tunnel(self):
+        tunnel = object.__new__(util.SSHTunnel)
+        with self.assertRaises(AttributeError):
+            tunnel.extra = None
+
+class TestMetrics(unittest.TestCase):
+
+    def test_record(self):
+        registry = util.Metrics()
+        registry.increment("calls")
+        registry.increment("calls", 2)
+        registry.gauge("open", 5)
+        registry.observe("seconds", 1.0)
+        registry.observe("seconds", 3.0)
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot["counters"], {"calls": 3})
+        self.assertEqual(snapshot["gauges"], {"open": 5})
+        self.assertEqual(snapshot["timings"]["seconds"],
+                         {"count": 2, "total": 4.0, "min": 1.0, "max": 3.0})
+
+class TestTracer(unittest.TestCase):
+
+    def test_hooks(self):
+        tracer = util.Tracer()
+        self.assertFalse(tracer.enabled)
+        events = []
+        tracer.add_hook(events.append)
+        tracer.add_hook(lambda event: 1/0) # failing hooks don't stop others
+        self.assertTrue(tracer.enabled)
+        with tracer.span("channel.open", chain_port=9090):
+            pass
+        with self.assertRaises(ValueError):
+            with tracer.span("handshake"):
+                raise ValueError("no")
+        self.assertEqual([e["event"] for e in events], ["channel.open", "error"])
+        self.assertEqual(events[0]["chain_port"], 9090)
+        self.assertIn("duration", events[0])
+        self.assertEqual(events[1]["stage"], "handshake")
+        tracer.remove_hook(events.append)
+        self.assertEqual(len(tracer.hooks), 1)
+
+    def test_disabled(self):
+        tracer = util.Tracer()
+        with tracer.span("connect"):
+            pass
+        self.assertEqual(tracer.hooks, [])
+
+class TestLinkEmulator(unittest.TestCase):
+
+    def deliver(self, chunks, **profile):
+        delivered = []
+        def send(data):
+            delivered.append((time.time(), data))
+            return len(data)
+        sender = util.DelayedSender(send, util.LinkProfile(**profile))
+        t0 = time.time()
+        for chunk in chunks:
+            sender(chunk)
+        sender.close()
+        return t0, delivered
+
+    def test_latency_pipelined(self):
+        t0, delivered = self.deliver([b"a", b"b", b"c", b"d"], latency=0.2)
+        self.assertEqual(b"".join(data for t, data in delivered), b"abcd")
+        self.assertGreaterEqual(delivered[0][0] - t0, 0.1)
+        self.assertLess(delivered[-1][0] - t0, 0.3) # one way delay, not one per chunk
+
+    def test_bandwidth(self):
+        t0, delivered = self.deliver([b"x"*1000]*4, bandwidth=10000)
+        self.assertGreaterEqual(delivered[-1][0] - t0, 0.35)
+
+    def test_off(self):
+        emulator = util.LinkEmulator()
+        self.assertIs(emulator.wrap(len), len)
+        with emulator.emulate("station", latency=0.3):
+            self.assertEqual(emulator.profile.latency, 0.3)
+            self.assertEqual(emulator.profile.bandwidth, 2**18)
+        self.assertFalse(emulator.enabled)
+
+class TestScheduling(unittest.TestCase):
+
+    def test_traffic_class(self):
+        bulk = util.TrafficClass.create("bulk")
+        self.assertEqual((bulk.priority, bulk.window_size), (1, 2**18))
+        self.assertIs(util.TrafficClass.create(bulk), bulk)
+        self.assertEqual(util.TrafficClass.create({"name": "x", "priority": 3}).priority, 3)
+        with self.assertRaises(ValueError):
+            util.TrafficClass.create("urgent")
+
+    def test_wait_turn(self):
+        scheduler = util.TrafficScheduler(max_delay=0.3)
+        self.assertEqual(scheduler.wait_turn(1), 0.0)
+        scheduler.request_started(0)
+        self.assertEqual(scheduler.wait_turn(0), 0.0) # only less urgent ones wait
+        timer = threading.Timer(0.1, scheduler.request_finished, (0,))
+        timer.start()
+        waited = scheduler.wait_turn(1)
+        self.assertGreaterEqual(waited, 0.05)
+        self.assertLess(waited, 0.25)
+        scheduler.request_started(0)
+        self.assertGreaterEqual(scheduler.wait_turn(1), 0.3) # bounded by max_delay
+        scheduler.request_started(0)
+        self.assertEqual(scheduler.wait_turn(1), 0.0) # in all, while priority 0 waits
+        scheduler.request_finished(0, 2)
+        self.assertIsNone(scheduler.most_urgent)
+
+    def test_request_timeout(self):
+        scheduler = util.TrafficScheduler(max_delay=1.0, request_timeout=0.1)
+        scheduler.request_started(0) # say, a call whose response never comes
+        waited = scheduler.wait_turn(1)
+        self.assertGreaterEqual(waited, 0.1)
+        self.assertLess(waited, 0.5)
+        self.assertIsNone(scheduler.most_urgent)
+        scheduler.request_finished(0)
+        self.assertEqual(scheduler.active[0], 0)
+
+    def test_token_bucket(self):
+        bucket = util.TokenBucket(100000, burst=10000)
+        t0 = time.time()
+        for i in range(4):
+            bucket.consume(10000)
+        self.assertGreaterEqual(time.time() - t0, 0.25)
+
+class TestHandshakeLimiter(unittest.TestCase):
+
+    def test_limit(self):
+        limiter = util.HandshakeLimiter(limit=2)
+        peak = []
+        def handshake():
+            peak.append(limiter.in_progress)
+            time.sleep(0.05)
+        threads = [threading.Thread(target=limiter.run, args=(handshake,)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max(peak), 2)
+        self.assertEqual((limiter.in_progress, limiter.waiting), (0, 0))
+
+    def test_retry(self):
+        limiter = util.HandshakeLimiter(retries=2, backoff=0.01)
+        attempts = []
+        def dropped():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise EOFError()
+            return "client"
+        self.assertEqual(limiter.run(dropped), "client")
+        limiter.retries = 1
+        attempts[:] = []
+        with self.assertRaises(EOFError):
+            limiter.run(dropped)
+        self.assertEqual(len(attempts), 2)
+
+    def test_no_retry(self):
+        limiter = util.HandshakeLimiter(backoff=0.01)
+        attempts = []
+        def rejected():
+            attempts.append(1)
+            raise paramiko.AuthenticationException("no")
+        with self.assertRaises(paramiko.AuthenticationException):
+            limiter.run(rejected)
+        self.assertEqual(len(attempts), 1)
+
+    def test_retryable(self):
+        limiter = util.HandshakeLimiter()
+        incompatible = getattr(paramiko.ssh_exception, "IncompatiblePeer", paramiko.SSHException)
+        for err in (socket.gaierror(socket.EAI_NONAME, "Name or service not known"),
+                    socket.error(errno.EHOSTUNREACH, "No route to host"),
+                    incompatible("Incompatible ssh peer (no acceptable kex algorithm)"),
+                    IOError(errno.ENOENT, "No such file or directory"),
+                    paramiko.ssh_exception.NoValidConnectionsError(
+                        {("10.0.0.5", 22): socket.error(errno.EHOSTUNREACH, "No route to host")})):
+            self.assertFalse(limiter.retryable(err), err)
+        for err in (socket.error(errno.ECONNREFUSED, "Connection refused"),
+                    socket.error(errno.ECONNRESET, "Connection reset by peer"),
+                    EOFError(),
+                    paramiko.SSHException("Error reading SSH protocol banner"),
+                    paramiko.ssh_exception.NoValidConnectionsError(
+                        {("127.0.0.1", 22): socket.error(errno.ECONNREFUSED, "Connection refused")})):
+            self.assertTrue(limiter.retryable(err), err)
+
+class TestProcessDiscovery(unittest.TestCase):
+
+    def test_parse_tunnel_args(self):
+        argv = ["/usr/bin/ssh", "-N", "-l", "me", "-p", "2222", "-L", "9090:localhost:9091",
+                "-R127.0.0.1:50000:localhost:50001", "remote", "true"]
+        self.assertEqual(util.parse_tunnel_args(argv),
+                         [("-L", "9090", "localhost", "9091", "remote"),
+                          ("-R", "50000", "localhost", "50001", "remote")])
+
+    def test_parse_bundled_flags(self):
+        self.assertEqual(util.parse_tunnel_args(["ssh", "-fNL", "8080:host:80", "alias"]),
+                         [("-L", "8080", "host", "80", "alias")])
+        self.assertEqual(util.parse_tunnel_args(["ssh", "-fNR8080:host:80", "alias"]),
+                         [("-R", "8080", "host", "80", "alias")])
+        # -i takes the rest, so L here is part of the key file name
+        self.assertEqual(util.parse_tunnel_args(["ssh", "-NiL", "8080:host:80", "alias"]), [])
+
+    def test_index_and_kill(self):
+        # a stand in "ssh" process, with a tunnel-like command line
+        proc = subprocess.Popen(["ssh", "-c", "import time; time.sleep(30)",
+                                 "-L", "59999:localhost:59998", "trifeni-test-host"],
+                                executable=sys.executable)
+        try:
+            index = util.TunnelProcessIndex()
+            for attempt in range(50):
+                found = index.find("-L", 59999, "localhost", 59998, "trifeni-test-host")
+                if found is not None:
+                    break
+                # the child might not have exec'd yet
+                time.sleep(0.1)
+                index.refresh()
+            self.assertIsNotNone(found)
+            self.assertEqual(found.pid, proc.pid)
+            # the executable has to match, not just the command line
+            self.assertEqual(util.kill_processes("trifeni-test-host"), [])
+            self.assertEqual([p.pid for p in util.list_processes("ssh", uid=os.getuid() + 1)
+                              if p.pid == proc.pid], [])
+            other_user = util.TunnelProcessIndex(uid=os.getuid() + 1)
+            self.assertIsNone(other_user.find("-L", 59999, "localhost", 59998, "trifeni-test-host"))
+            killed = util.kill_processes("ssh", "trifeni-test-host")
+            self.assertEqual([p.pid for p in killed], [proc.pid])
+            proc.wait()
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     logging.getLogger("paramiko").setLevel(logging.ERROR)
@@ -12,9 +12,18 @@ module_logger = logging.getLogger(__name__)
 
 from .configuration import config
 from .util import SSHTunnel, SSHTunnelManager
-from .pyro4tunnel import Pyro4Tunnel, DaemonTunnel, NameServerTunnel
+from .pyro4tunnel import Pyro4Tunnel, DaemonTunnel, NameServerTunnel, check_serializer
+from .proxy_pool import ProxyPool
+from .batching import batch, oneway, CommandQueue
+from .replicas import ReplicaSet, FailoverProxy
+from .manifest import Manifest, ManifestApplier, ManifestWatcher
+from .agent import TunnelAgent
+from .history import AccessHistory
+from .callbacks import CallbackDaemon
 from . import errors
 
 __all__ = ["config","SSHTunnel", "SSHTunnelManager",
            "Pyro4Tunnel", "DaemonTunnel",
-           "NameServerTunnel", "errors"]
+           "NameServerTunnel", "check_serializer", "ProxyPool",
+           "batch", "oneway", "CommandQueue", "ReplicaSet", "FailoverProxy",
+           "Manifest", "ManifestApplier", "ManifestWatcher", "TunnelAgent", "AccessHistory", "CallbackDaemon", "errors"]
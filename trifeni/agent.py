@@ -0,0 +1,196 @@
+"""
+Expose an SSHTunnelManager over Pyro4, so that its tunnels can be listed,
+inspected, created and torn down from other processes, like the ``trifeni``
+command line tool.
+"""
+import getpass
+import logging
+import os
+import tempfile
+
+import Pyro4
+
+from .util import SSHTunnelManager
+from .errors import TunnelError
+from .manifest import Manifest, ManifestApplier
+
+__all__ = ["TunnelAgent", "default_agent_dir", "default_agent_uri"]
+
+module_logger = logging.getLogger(__name__)
+
+def default_agent_dir():
+    """
+    Directory of the agent's default socket: one in the temporary directory
+    for each user, that the agent creates readable by its user alone.
+
+    Returns:
+        str
+    """
+    return os.path.join(tempfile.gettempdir(), "trifeni-{}".format(getpass.getuser()))
+
+def default_agent_uri():
+    """
+    URI the agent listens on when it's not told otherwise: the
+    ``TRIFENI_AGENT`` environment variable, or a Unix domain socket in
+    ``default_agent_dir()``, private to the user.
+
+    Returns:
+        str
+    """
+    if os.environ.get("TRIFENI_AGENT"):
+        return os.environ["TRIFENI_AGENT"]
+    path = os.path.join(default_agent_dir(), "agent.sock")
+    return "PYRO:{}@./u:{}".format(TunnelAgent.object_id, path)
+
+@Pyro4.expose
+class TunnelAgent(object):
+    """
+    Pyro4 front end of an SSHTunnelManager. Everything it returns is plain
+    data, so that it goes through any Pyro4 serializer. Errors are raised as
+    builtin exceptions: TunnelError is a Pyro4 CommunicationError, which
+    clients would take for a broken connection to the agent.
+
+    Examples:
+
+    .. code-block:: python
+
+        daemon = Pyro4.Daemon(port=9095)
+        daemon.register(TunnelAgent(), TunnelAgent.object_id)
+        daemon.requestLoop()
+
+    Attributes:
+        manager (SSHTunnelManager): manager of the tunnels.
+        applier (ManifestApplier): applies manifests to manager.
+        state_file (str): if set, the manager's state is saved here after
+            every change, for ``SSHTunnelManager.restore_state``.
+        logger (logging.getLogger): logging instance
+    """
+    object_id = "trifeni.agent"
+
+    def __init__(self, manager=None, state_file=None, logger=None):
+        """
+        Args:
+            manager (SSHTunnelManager, optional): manager to expose. A new one
+                is created by default.
+            state_file (str, optional): file to save the manager's state to.
+            logger (logging.getLogger, optional): logging instance.
+        """
+        if logger is None: logger = logging.getLogger(module_logger.name+".TunnelAgent")
+        self.logger = logger
+        if manager is None: manager = SSHTunnelManager()
+        self.manager = manager
+        self.applier = ManifestApplier(manager)
+        self.state_file = state_file
+
+    def _find(self, tunnel_id):
+        """Get the tunnel whose ID is, or starts with, tunnel_id."""
+        tunnels = self.manager.tunnels
+        if tunnel_id in tunnels:
+            return tunnels[tunnel_id]
+        matches = [_id for _id in list(tunnels) if _id.startswith(tunnel_id)]
+        if len(matches) != 1:
+            raise KeyError("{} tunnel(s) match {}".format(len(matches), tunnel_id))
+        return tunnels[matches[0]]
+
+    def _save(self):
+        if self.state_file is not None:
+            self.manager.save_state(self.state_file)
+
+    def describe(self, tunnel_id):
+        """
+        Args:
+            tunnel_id (str): ID of the tunnel, or a unique prefix of it.
+        Returns:
+            dict: the tunnel's endpoints, whether it's open, the arguments it
+                was created with, and its traffic counters (None for tunnels
+                run by OpenSSH, whose traffic trifeni doesn't see).
+        """
+        return self._describe(self._find(tunnel_id))
+
+    def _describe(self, tunnel):
+        stats = getattr(tunnel, "stats", None)
+        return {
+            "tunnel_id": tunnel.tunnel_id,
+            "backend": self.manager.backend,
+            "remote_alias": tunnel.remote_alias,
+            "remote_ip": tunnel.remote_ip,
+            "port": tunnel.port,
+            "username": tunnel.username,
+            "relay_ip": tunnel.relay_ip,
+            "local_port": tunnel.local_port,
+            "remote_port": tunnel.remote_port,
+            "reverse": tunnel.reverse,
+            "open": tunnel.open,
+            "spec": self.manager.tunnel_specs.get(tunnel.tunnel_id),
+            "stats": None if stats is None else stats.snapshot()
+        }
+
+    def list_tunnels(self):
+        """
+        Returns:
+            list: ``describe`` of every tunnel.
+        """
+        return [self._describe(tunnel) for tunnel in list(self.manager.tunnels.values())]
+
+    def stats(self):
+        """
+        Returns:
+            dict: traffic counter snapshots, by tunnel ID.
+        """
+        return {_id: tunnel.stats.snapshot() for _id, tunnel in list(self.manager.tunnels.items())
+                if getattr(tunnel, "stats", None) is not None}
+
+    def create_tunnel(self, remote_ip, relay_ip, local_port, remote_port, options=None):
+        """
+        Create a tunnel with the manager.
+
+        Args:
+            remote_ip (str): SSH alias or address.
+            relay_ip (str): forwarding address.
+            local_port (int/str): local port, or Unix domain socket path.
+            remote_port (int/str): remote port, or Unix domain socket path.
+            options (dict, optional): other SSHTunnel keyword arguments.
+        Returns:
+            dict: ``describe`` of the new tunnel.
+        Raises:
+            ValueError: if the manager already has a tunnel on local_port.
+            IOError: if the tunnel couldn't connect.
+        """
+        try:
+            tunnel = self.manager.create_tunnel(remote_ip, relay_ip, local_port, remote_port,
+                                                **(options or {}))
+        except TunnelError as err:
+            raise IOError(str(err))
+        if tunnel is None:
+            raise ValueError("A tunnel is already bound to {}:{}".format(relay_ip, local_port))
+        if not tunnel.open:
+            self.manager.destroy_tunnel(tunnel.tunnel_id)
+            raise IOError("Couldn't connect to {}".format(remote_ip))
+        self.logger.info("create_tunnel: created {}".format(tunnel.tunnel_id))
+        self._save()
+        return self.describe(tunnel.tunnel_id)
+
+    def destroy_tunnel(self, tunnel_id, drain_timeout=None):
+        """
+        Args:
+            tunnel_id (str): ID of the tunnel, or a unique prefix of it.
+            drain_timeout (float, optional): see ``SSHTunnel.destroy``.
+        Returns:
+            str: full ID of the destroyed tunnel.
+        """
+        tunnel_id = self._find(tunnel_id).tunnel_id
+        self.manager.destroy_tunnel(tunnel_id, drain_timeout=drain_timeout)
+        self.logger.info("destroy_tunnel: destroyed {}".format(tunnel_id))
+        self._save()
+        return tunnel_id
+
+    def apply_manifest(self, manifest):
+        """
+        Args:
+            manifest (dict): manifest, as in a manifest file (see Manifest).
+        Returns:
+            dict: see ``ManifestApplier.apply``.
+        """
+        result = self.applier.apply(Manifest.from_dict(manifest))
+        self._save()
+        return result
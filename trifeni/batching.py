@@ -0,0 +1,200 @@
+"""
+Helpers for sending many small calls through a tunneled proxy without paying
+a full round trip over SSH for each one.
+"""
+import logging
+import threading
+import time
+
+import Pyro4
+
+__all__ = ["batch", "oneway", "CommandQueue"]
+
+module_logger = logging.getLogger(__name__)
+
+def batch(proxy):
+    """
+    Pyro4 batch proxy for proxy. Calls made on the batch proxy are recorded,
+    and sent in a single message when it is called.
+
+    Examples:
+
+    .. code-block:: python
+
+        proxy = dt.get_remote_object(uri)
+        with trifeni.batch(proxy) as b:
+            b.point(10.0, 45.0)
+            b.point(10.1, 45.0)
+            results = list(b())
+
+    Args:
+        proxy (Pyro4.Proxy): proxy, as returned by ``get_remote_object``.
+    Returns:
+        Pyro4 batch proxy
+    """
+    return Pyro4.batch(proxy)
+
+def oneway(proxy, *method_names):
+    """
+    Make calls to method_names on proxy oneway: the proxy doesn't wait for
+    the remote method to return. Methods the server already marks with
+    ``@Pyro4.oneway`` are oneway anyway. Binds proxy if it isn't bound yet.
+
+    Args:
+        proxy (Pyro4.Proxy): proxy, as returned by ``get_remote_object``.
+        *method_names (str): names of methods to call oneway.
+    Returns:
+        Pyro4.Proxy: proxy
+    """
+    # binding replaces _pyroOneway with the server's metadata, so bind first
+    proxy._pyroBind()
+    proxy._pyroOneway.update(method_names)
+    return proxy
+
+class CommandQueue(object):
+    """
+    Coalesce calls to a remote object into Pyro4 batches. Calls are queued,
+    and sent in one message when ``max_size`` calls are waiting, or
+    ``max_delay`` seconds after the first of them was queued, whichever comes
+    first.
+
+    The queue owns its proxy: only the queue's own thread (or ``flush``)
+    uses it. Use ``Pyro4Tunnel.get_command_queue`` to create a queue with a
+    proxy of its own.
+
+    Examples:
+
+    .. code-block:: python
+
+        with DaemonTunnel(remote_server_name="remote_alias") as dt:
+            commands = dt.get_command_queue(uri, max_size=50, max_delay=0.02)
+            for az, el in pointing_updates:
+                commands.submit("point", az, el)
+
+    Attributes:
+        proxy (Pyro4.Proxy): proxy through which batches are sent.
+        max_size (int): flush when this many calls are queued.
+        max_delay (float): flush at most this many seconds after a call is
+            queued.
+        oneway (bool): Send batches oneway, not waiting for results. Otherwise
+            the queue waits for each batch, and logs failed calls. Pyro4 stops
+            running a batch at its first failed call, so the calls queued
+            after it are logged as not run.
+        stats (dict): number of calls submitted, batches sent, and failed
+            calls or batches.
+        logger (logging.getLogger): logging instance
+    """
+    def __init__(self, proxy, max_size=100, max_delay=0.05, oneway=True, logger=None):
+        if logger is None: logger = logging.getLogger(module_logger.name+".CommandQueue")
+        self.logger = logger
+        self.proxy = proxy
+        self.max_size = int(max_size)
+        self.max_delay = max_delay
+        self.oneway = oneway
+        self.stats = {"submitted": 0, "batches": 0, "errors": 0}
+        self._pending = []
+        self._first_queued = None
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self._thread = threading.Thread(target=self._flush_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, method_name, *args, **kwargs):
+        """
+        Queue a call to method_name with args and kwargs.
+
+        Args:
+            method_name (str): name of the remote method.
+            *args: passed to the remote method.
+            **kwargs: passed to the remote method.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("CommandQueue is closed")
+            if not self._pending:
+                self._first_queued = time.time()
+            self._pending.append((method_name, args, kwargs))
+            self.stats["submitted"] += 1
+            if len(self._pending) == 1 or len(self._pending) >= self.max_size:
+                self._wakeup.notify()
+
+    def flush(self):
+        """
+        Send every queued call now.
+
+        Returns:
+            list: results of the calls, if the queue isn't oneway.
+        Raises:
+            Exception: the error of the batch, or of its first failed call.
+                The calls are not queued again.
+        """
+        with self._lock:
+            calls, self._pending = self._pending, []
+            self._first_queued = None
+        return self._send(calls)
+
+    def _send(self, calls):
+        if not calls:
+            return []
+        with self._send_lock:
+            batch_proxy = Pyro4.batch(self.proxy)
+            for method_name, args, kwargs in calls:
+                getattr(batch_proxy, method_name)(*args, **kwargs)
+            results = []
+            sent = False
+            try:
+                returned = batch_proxy(oneway=self.oneway)
+                sent = True
+                if not self.oneway:
+                    for result in returned:
+                        results.append(result)
+            except Exception as err:
+                self.stats["errors"] += 1
+                if sent:
+                    failed = len(results)
+                    self.logger.error(
+                        "_send: call {} of {} to {} failed: {}. {} call(s) after it weren't run".format(
+                            failed + 1, len(calls), calls[failed][0], err, len(calls) - failed - 1))
+                else:
+                    self.logger.error("_send: batch of {} calls failed: {}".format(len(calls), err))
+                raise
+            self.stats["batches"] += 1
+        return results
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if self._pending:
+                        remaining = self._first_queued + self.max_delay - time.time()
+                        if len(self._pending) >= self.max_size or remaining <= 0:
+                            break
+                        self._wakeup.wait(remaining)
+                    else:
+                        self._wakeup.wait()
+                if self._closed and not self._pending:
+                    return
+                calls = self._pending[:self.max_size]
+                self._pending = self._pending[self.max_size:]
+                if not self._pending:
+                    self._first_queued = None
+            try:
+                self._send(calls)
+            except Exception:
+                pass # logged by _send
+
+    def close(self):
+        """Send any queued calls, and stop the queue's thread."""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,228 @@
+"""
+A Pyro4 daemon for callback objects, shared by every tunnel in a process,
+and reverse forwards to it shared per remote host.
+"""
+import logging
+import threading
+
+import Pyro4
+
+from .util import SSHTunnelManager, resolve_host, metrics
+from .errors import TunnelError
+
+__all__ = ["CallbackDaemon", "CallbackForward", "callbacks"]
+
+module_logger = logging.getLogger(__name__)
+
+class CallbackForward(object):
+    """
+    A reverse forward from a port on a remote host to a local daemon,
+    shared by the tunnels that need it.
+
+    Attributes:
+        key (tuple): address, login port and user of the host, and the
+            forwarded port.
+        manager (SSHTunnelManager): holds the reverse tunnel.
+        refcount (int): number of users of the forward.
+        open (bool): whether the reverse tunnel is open.
+        lock (threading.Lock): held while opening.
+    """
+    def __init__(self, key, manager):
+        self.key = key
+        self.manager = manager
+        self.refcount = 0
+        self.open = False
+        self.lock = threading.Lock()
+
+    def connect(self, *args, **kwargs):
+        """
+        Open the reverse tunnel, unless it's open already. Arguments are
+        passed to ``SSHTunnelManager.create_tunnel``.
+
+        Raises:
+            TunnelError: if the tunnel didn't open.
+        """
+        with self.lock:
+            if self.open:
+                return
+            tunnel = self.manager.create_tunnel(*args, **kwargs)
+            if tunnel is None or not tunnel.open:
+                self._close_tunnels()
+                raise TunnelError("Couldn't forward callbacks from {} port {}".format(
+                    self.key[0], self.key[3]))
+            self.open = True
+
+    def close(self):
+        with self.lock:
+            self.open = False
+            self._close_tunnels()
+
+    def _close_tunnels(self):
+        for tunnel_id in list(self.manager.tunnels):
+            self.manager.destroy_tunnel(tunnel_id)
+
+class CallbackDaemon(object):
+    """
+    Process wide Pyro4 daemon for callback objects: objects on remote
+    servers call back into it through a reverse forward of the daemon's port,
+    opened once per remote host, however many tunnels and proxies there are.
+    The daemon starts on first use, and serves requests with Pyro4's thread
+    pool server (``Pyro4.config.SERVERTYPE`` "thread", the default, sized by
+    ``THREADPOOL_SIZE``), on a daemon thread.
+
+    Normally this is used through ``Pyro4Tunnel.register_callback``, via the
+    module level ``callbacks`` instance.
+
+    Examples:
+
+    .. code-block:: python
+
+        with trifeni.DaemonTunnel(remote_server_name="remote_alias") as dt:
+            handler = Pyro4.Proxy(dt.register_callback(Callbacks()))
+            obj_proxy = dt.get_remote_object(uri)
+            obj_proxy.square_with_callback(100, callback_info={
+                "handler": handler, "callback_name": "some_callback"
+            })
+
+    Attributes:
+        host (str): address the daemon listens on.
+        port (int): port the daemon listens on, locally and, through the
+            reverse forwards, on the remote hosts. 0 picks a free one when the
+            daemon starts.
+        backend (str): backend of the reverse tunnels' managers.
+        daemon (Pyro4.Daemon): the daemon, or None until it starts.
+        forwards (dict): CallbackForward instances in use, by key.
+        logger (logging.getLogger): logging instance
+    """
+    def __init__(self, host="localhost", port=0, backend="paramiko", logger=None):
+        if logger is None: logger = logging.getLogger(module_logger.name+".CallbackDaemon")
+        self.logger = logger
+        self.host = host
+        self.port = port
+        self.backend = backend
+        self.daemon = None
+        self.forwards = {}
+        self._lock = threading.RLock()
+        self._thread = None
+
+    def start(self):
+        """
+        Create the daemon, and start its request loop, if that's not done
+        already.
+
+        Returns:
+            Pyro4.Daemon
+        """
+        with self._lock:
+            if self.daemon is None:
+                if Pyro4.config.SERVERTYPE != "thread":
+                    self.logger.warning("start: Pyro4 server type is {}, callbacks are served one at a time".format(
+                        Pyro4.config.SERVERTYPE))
+                self.daemon = Pyro4.Daemon(host=self.host, port=self.port)
+                self.port = self.daemon.sock.getsockname()[1]
+                self._thread = threading.Thread(target=self.daemon.requestLoop)
+                self._thread.daemon = True
+                self._thread.start()
+                self.logger.debug("start: serving callbacks on {}".format(self.daemon.locationStr))
+            return self.daemon
+
+    def register(self, obj, object_id=None):
+        """
+        Register a callback object, starting the daemon if need be. Calling
+        this again for the same object returns the same URI.
+
+        Args:
+            obj (object): Pyro4 exposed object or class.
+            object_id (str, optional): see ``Pyro4.Daemon.register``.
+        Returns:
+            Pyro4.core.URI
+        """
+        with self._lock:
+            daemon = self.start()
+            registered = getattr(obj, "_pyroId", None)
+            if registered and registered in daemon.objectsById:
+                return daemon.uriFor(registered)
+            return daemon.register(obj, objectId=object_id)
+
+    def unregister(self, obj):
+        """Unregister a callback object, or object ID."""
+        with self._lock:
+            if self.daemon is not None:
+                self.daemon.unregister(obj)
+
+    def create_manager(self):
+        return SSHTunnelManager(backend=self.backend,
+                                logger=logging.getLogger(self.logger.name + ".manager"))
+
+    def acquire_forward(self, remote_server_name, port=22, username=None, local_port=None,
+                        relay_ip=None, create_tunnel_kwargs=None):
+        """
+        Get the reverse forward of local_port on a host, opening it if need
+        be. The tunnel is opened outside the daemon's lock, so that a slow
+        or dead host doesn't hold up forwards to other hosts. A forward that
+        fails to open isn't kept, and the next acquire tries again.
+
+        Args:
+            remote_server_name (str): Either an alias or an actual address
+            port (int, optional): remote login port.
+            username (str, optional): remote username
+            local_port (int, optional): port forwarded, on the remote host and
+                locally. Defaults to the callback daemon's, starting it if
+                need be.
+            relay_ip (str, optional): address the port is forwarded to.
+                Defaults to the callback daemon's.
+            create_tunnel_kwargs (dict, optional): other SSHTunnel keyword
+                arguments, used if the forward is opened.
+        Returns:
+            CallbackForward
+        Raises:
+            TunnelError: if the forward couldn't be opened.
+        """
+        if local_port is None:
+            self.start()
+            local_port = self.port
+        if relay_ip is None: relay_ip = self.host
+        remote_alias, remote_ip, login_port, username, keyfile = resolve_host(
+            remote_server_name, port=port, username=username)
+        key = (remote_ip, int(login_port), username, int(local_port))
+        with self._lock:
+            forward = self.forwards.get(key)
+            if forward is None:
+                forward = CallbackForward(key, self.create_manager())
+                self.forwards[key] = forward
+                metrics.increment("callbacks.forwards")
+            else:
+                metrics.increment("callbacks.shared")
+            forward.refcount += 1
+        try:
+            forward.connect(remote_server_name, relay_ip, int(local_port), int(local_port),
+                            port=port, username=username, reverse=True,
+                            **(create_tunnel_kwargs or {}))
+        except Exception:
+            self.release_forward(forward)
+            raise
+        return forward
+
+    def release_forward(self, forward):
+        """Drop a reference to forward, closing it if it was the last one."""
+        with self._lock:
+            forward.refcount -= 1
+            if forward.refcount > 0:
+                return
+            if self.forwards.get(forward.key) is forward:
+                del self.forwards[forward.key]
+        forward.close()
+
+    def shutdown(self):
+        """Close every forward, and stop the daemon."""
+        with self._lock:
+            forwards = list(self.forwards.values())
+            self.forwards = {}
+            daemon, self.daemon = self.daemon, None
+        for forward in forwards:
+            forward.close()
+        if daemon is not None:
+            daemon.shutdown()
+            self._thread.join()
+
+callbacks = CallbackDaemon()
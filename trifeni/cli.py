@@ -0,0 +1,389 @@
+"""
+The ``trifeni`` command: run a tunnel agent, and list, inspect, create, tear
+down and watch its tunnels.
+
+Usage:
+
+.. code-block:: none
+
+    $ trifeni agent --state ~/.trifeni-tunnels.json &
+    $ trifeni create remote_alias 9090 9090
+    $ trifeni list
+    $ trifeni top
+    $ trifeni destroy 3f2a --drain-timeout 5
+"""
+from __future__ import print_function
+import argparse
+import errno
+import getpass
+import json
+import logging
+import os
+import signal
+import socket
+import stat
+import sys
+import time
+
+import Pyro4
+
+from .agent import TunnelAgent, default_agent_dir, default_agent_uri
+from .manifest import ManifestWatcher
+from .util import SSHTunnelManager, kill_processes
+
+__all__ = ["main", "parse_port", "route", "top_rows", "format_table", "remove_stale_socket",
+           "private_dir", "agent_daemon"]
+
+module_logger = logging.getLogger(__name__)
+
+def parse_port(port):
+    """Port number, or Unix domain socket path."""
+    return int(port) if port.isdigit() else port
+
+def route(tunnel):
+    """
+    Args:
+        tunnel (dict): tunnel description from ``TunnelAgent.describe``.
+    Returns:
+        str: where the tunnel forwards, in the direction traffic goes.
+    """
+    host = tunnel["remote_alias"] or tunnel["remote_ip"]
+    if tunnel["reverse"]:
+        return "{}:{} <- {}:{}".format(tunnel["relay_ip"], tunnel["remote_port"], host, tunnel["local_port"])
+    return "{} -> {}:{} via {}".format(tunnel["local_port"], tunnel["relay_ip"], tunnel["remote_port"], host)
+
+def human_bytes(value):
+    for unit in ("B", "K", "M", "G"):
+        if abs(value) < 1024.0:
+            return "{:.0f}{}".format(value, unit) if unit == "B" else "{:.1f}{}".format(value, unit)
+        value /= 1024.0
+    return "{:.1f}T".format(value)
+
+def format_table(header, rows):
+    """
+    Returns:
+        str: rows under header, in left aligned columns.
+    """
+    rows = [header] + [[str(cell) for cell in row] for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+                     for row in rows)
+
+top_header = ["ID", "ROUTE", "STATE", "CONNS", "OUT/s", "IN/s", "OPEN ms", "ERR/s", "ERRORS"]
+
+def top_rows(tunnels, previous=None, stall_seconds=10.0):
+    """
+    Rows of ``trifeni top``. Rates are over the time between the previous
+    snapshots and the current ones; the first time round they are totals
+    since the tunnels opened.
+
+    Args:
+        tunnels (list): tunnel descriptions from ``TunnelAgent.list_tunnels``.
+        previous (dict, optional): stats snapshots from the last refresh, by
+            tunnel ID.
+        stall_seconds (float, optional): tunnels with connections but no
+            traffic for this long show up as "stalled".
+    Returns:
+        list: rows, busiest tunnel first.
+    """
+    if previous is None: previous = {}
+    busy = []
+    for tunnel in tunnels:
+        stats = tunnel["stats"]
+        state = "open" if tunnel["open"] else "closed"
+        if stats is None:
+            busy.append((-1, [tunnel["tunnel_id"][:8], route(tunnel), state] + ["-"]*6))
+            continue
+        last = previous.get(tunnel["tunnel_id"])
+        if last is None:
+            last = dict((name, 0) for name in stats)
+            last["connect_seconds"] = 0.0
+        elapsed = max(stats["time"] - last["time"], 1e-6) if last["time"] else None
+        delta = dict((name, stats[name] - last[name]) for name in
+                     ("bytes_out", "bytes_in", "errors", "connects", "connect_seconds"))
+
+        def rate(value):
+            return value / elapsed if elapsed is not None else value
+
+        if (tunnel["open"] and stats["connections"] and stats["last_activity"] is not None
+                and stats["time"] - stats["last_activity"] > stall_seconds):
+            state = "stalled"
+        open_ms = "-"
+        if delta["connects"]:
+            open_ms = "{:.1f}".format(1000.0 * delta["connect_seconds"] / delta["connects"])
+        busy.append((rate(delta["bytes_out"] + delta["bytes_in"]), [
+            tunnel["tunnel_id"][:8], route(tunnel), state,
+            "{}/{}".format(stats["connections"], stats["connections_total"]),
+            human_bytes(rate(delta["bytes_out"])), human_bytes(rate(delta["bytes_in"])),
+            open_ms, "{:.2f}".format(rate(delta["errors"])), stats["errors"]
+        ]))
+    busy.sort(key=lambda item: item[0], reverse=True)
+    return [row for score, row in busy]
+
+def remove_stale_socket(path):
+    """
+    Remove the Unix domain socket an agent that's no longer running left at
+    path, so that a new agent can listen there.
+
+    Raises:
+        EnvironmentError: if another agent is listening on path, or path
+            isn't a socket.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError as err:
+        if err.errno == errno.ENOENT:
+            return
+        raise
+    if not stat.S_ISSOCK(mode):
+        raise EnvironmentError(errno.EEXIST, "{} exists, and isn't a socket".format(path))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error as err:
+        if err.errno != errno.ECONNREFUSED:
+            raise
+        module_logger.debug("remove_stale_socket: removing {}".format(path))
+        os.unlink(path)
+        return
+    finally:
+        sock.close()
+    raise EnvironmentError(errno.EADDRINUSE, "an agent is already listening on {}".format(path))
+
+def private_dir(path):
+    """
+    Create a directory only the current user can use, or check that path
+    already is one.
+
+    Raises:
+        EnvironmentError: if path isn't a directory, belongs to another user,
+            or other users have access to it.
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise EnvironmentError(errno.EPERM, "{} isn't a directory private to {}".format(
+            path, getpass.getuser()))
+
+def agent_daemon(uri, hmac_key=None):
+    """
+    Create the daemon an agent serves on. Whoever can talk to the agent can
+    open tunnels with the user's SSH keys, so a Unix domain socket is only
+    accessible to the user, and TCP is only served with an HMAC key that
+    clients have to sign their messages with.
+
+    Args:
+        uri (Pyro4.core.URI): where to listen.
+        hmac_key (bytes, optional): key shared with clients.
+    Returns:
+        Pyro4.Daemon
+    Raises:
+        ValueError: if uri is a TCP address, and there's no hmac_key.
+    """
+    if uri.sockname is not None:
+        # no window between bind and chmod in which others could connect
+        umask = os.umask(0o177)
+        try:
+            daemon = Pyro4.Daemon(unixsocket=uri.sockname)
+        finally:
+            os.umask(umask)
+        os.chmod(uri.sockname, 0o600)
+    else:
+        if hmac_key is None:
+            raise ValueError("won't serve {}:{} over TCP without --key-file".format(uri.host, uri.port))
+        daemon = Pyro4.Daemon(host=uri.host, port=uri.port)
+    daemon._pyroHmacKey = hmac_key
+    return daemon
+
+def read_key(path):
+    """bytes: the HMAC key in the file at path, or None if path is None."""
+    if path is None:
+        return None
+    with open(path, "rb") as f:
+        return f.read().strip()
+
+def get_agent(args):
+    agent = Pyro4.Proxy(args.agent)
+    agent._pyroTimeout = args.timeout
+    agent._pyroHmacKey = read_key(args.key_file)
+    return agent
+
+def run_agent(args):
+    uri = Pyro4.core.URI(args.agent)
+    hmac_key = read_key(args.key_file)
+    if uri.sockname is not None:
+        if os.path.dirname(uri.sockname) == default_agent_dir():
+            private_dir(default_agent_dir())
+        remove_stale_socket(uri.sockname)
+    daemon = agent_daemon(uri, hmac_key)
+    kwargs = {"backend": args.backend, "transports_per_host": args.transports_per_host}
+    manager = SSHTunnelManager(**kwargs)
+    if args.state is not None and os.path.exists(args.state):
+        restored = manager.restore_state(args.state)
+        print("restored {} tunnel(s) from {}".format(len(restored), args.state))
+    agent = TunnelAgent(manager, state_file=args.state)
+    watcher = None
+    if args.manifest is not None:
+        watcher = ManifestWatcher(args.manifest, agent.applier, interval=args.watch_interval)
+        watcher.start()
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    print("agent listening on {}".format(daemon.register(agent, TunnelAgent.object_id)))
+    sys.stdout.flush()
+    try:
+        daemon.requestLoop()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+        if watcher is not None:
+            watcher.stop()
+        if args.state is not None:
+            manager.save_state(args.state)
+        manager.cleanup(drain_timeout=args.drain_timeout)
+
+def run_apply(args):
+    with open(args.manifest, "r") as f:
+        manifest = json.load(f)
+    result = get_agent(args).apply_manifest(manifest)
+    print(", ".join("{} {}".format(result[name], name) for name in
+                    ("opened", "closed", "unchanged", "failed")))
+    return 1 if result["failed"] else 0
+
+def run_list(args):
+    tunnels = get_agent(args).list_tunnels()
+    if args.json:
+        print(json.dumps(tunnels, indent=2))
+        return
+    rows = [[t["tunnel_id"][:8], route(t), "open" if t["open"] else "closed",
+             "-" if t["stats"] is None else t["stats"]["connections"]] for t in tunnels]
+    print(format_table(["ID", "ROUTE", "STATE", "CONNS"], rows))
+
+def run_show(args):
+    print(json.dumps(get_agent(args).describe(args.tunnel_id), indent=2))
+
+def run_create(args):
+    options = {"port": args.port, "reverse": args.reverse}
+    for name in ("username", "keyfile", "transport_options", "socket_options"):
+        if getattr(args, name) is not None:
+            options[name] = getattr(args, name)
+    tunnel = get_agent(args).create_tunnel(args.remote, args.relay, parse_port(args.local_port),
+                                           parse_port(args.remote_port), options)
+    print(tunnel["tunnel_id"])
+
+def run_destroy(args):
+    agent = get_agent(args)
+    tunnel_ids = args.tunnel_ids
+    if args.all:
+        tunnel_ids = [tunnel["tunnel_id"] for tunnel in agent.list_tunnels()]
+    for tunnel_id in tunnel_ids:
+        print(agent.destroy_tunnel(tunnel_id, args.drain_timeout))
+
+def run_top(args):
+    agent = get_agent(args)
+    clear = "\x1b[2J\x1b[H" if sys.stdout.isatty() else ""
+    previous, count = None, 0
+    try:
+        while args.iterations is None or count < args.iterations:
+            if count:
+                time.sleep(args.interval)
+            tunnels = agent.list_tunnels()
+            print("{}trifeni top - {} - {} tunnel(s)\n".format(
+                clear, time.strftime("%H:%M:%S"), len(tunnels)))
+            print(format_table(top_header, top_rows(tunnels, previous, args.stall_seconds)))
+            sys.stdout.flush()
+            previous = dict((t["tunnel_id"], t["stats"]) for t in tunnels if t["stats"] is not None)
+            count += 1
+    except KeyboardInterrupt:
+        pass
+
+def run_kill_ssh(args):
+    kill_processes("ssh", args.match)
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog="trifeni", description="Manage trifeni SSH tunnels.")
+    parser.add_argument("--agent", default=default_agent_uri(),
+                        help="URI of the agent (default: $TRIFENI_AGENT, or a socket in the temporary directory)")
+    parser.add_argument("--key-file", default=os.environ.get("TRIFENI_AGENT_KEY_FILE"),
+                        help=("file with the HMAC key the agent and its clients share; needed "
+                              "to serve TCP (default: $TRIFENI_AGENT_KEY_FILE)"))
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for the agent")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    agent = subparsers.add_parser("agent", help="run a tunnel manager, and serve it at --agent")
+    agent.add_argument("--state", help="restore tunnels from, and save them to, this file")
+    agent.add_argument("--backend", default="paramiko", choices=SSHTunnelManager.backends)
+    agent.add_argument("--transports-per-host", type=int, default=1)
+    agent.add_argument("--drain-timeout", type=float, help="drain tunnels for this long on exit")
+    agent.add_argument("--manifest", help="apply this manifest, and re-apply it when it or ~/.ssh/config change")
+    agent.add_argument("--watch-interval", type=float, default=1.0,
+                       help="seconds between checks of the manifest (1.0)")
+    agent.set_defaults(func=run_agent)
+
+    apply = subparsers.add_parser("apply", help="make the agent's tunnels match a manifest")
+    apply.add_argument("manifest", help="path to a JSON manifest")
+    apply.set_defaults(func=run_apply)
+
+    tunnels = subparsers.add_parser("list", help="list tunnels")
+    tunnels.add_argument("--json", action="store_true", help="print full descriptions as JSON")
+    tunnels.set_defaults(func=run_list)
+
+    show = subparsers.add_parser("show", help="describe a tunnel, as JSON")
+    show.add_argument("tunnel_id", help="tunnel ID, or a unique prefix of it")
+    show.set_defaults(func=run_show)
+
+    create = subparsers.add_parser("create", help="create a tunnel")
+    create.add_argument("remote", help="SSH alias or address")
+    create.add_argument("local_port", help="local port, or Unix domain socket path")
+    create.add_argument("remote_port", help="remote port, or Unix domain socket path")
+    create.add_argument("--relay", default="localhost", help="forwarding address (localhost)")
+    create.add_argument("-p", "--port", type=int, default=22, help="SSH port")
+    create.add_argument("-l", "--username")
+    create.add_argument("-i", "--keyfile")
+    create.add_argument("-R", "--reverse", action="store_true", help="create a reverse tunnel")
+    create.add_argument("--transport-options", help="TransportOptions profile")
+    create.add_argument("--socket-options", help="SocketOptions profile")
+    create.set_defaults(func=run_create)
+
+    destroy = subparsers.add_parser("destroy", help="tear down tunnels")
+    destroy.add_argument("tunnel_ids", nargs="*", help="tunnel IDs, or unique prefixes of them")
+    destroy.add_argument("--all", action="store_true", help="tear down every tunnel")
+    destroy.add_argument("--drain-timeout", type=float,
+                         help="let active connections finish for up to this many seconds")
+    destroy.set_defaults(func=run_destroy)
+
+    top = subparsers.add_parser("top", help="watch throughput, connections, latency and errors")
+    top.add_argument("--interval", type=float, default=2.0, help="seconds between refreshes")
+    top.add_argument("--iterations", type=int, help="stop after this many refreshes")
+    top.add_argument("--stall-seconds", type=float, default=10.0,
+                     help="flag tunnels with connections but no traffic for this long")
+    top.set_defaults(func=run_top)
+
+    kill_ssh = subparsers.add_parser("kill-ssh", help="kill your ssh processes creating tunnels")
+    kill_ssh.add_argument("--match", default="-L", help="only kill processes with this argument (-L)")
+    kill_ssh.set_defaults(func=run_kill_ssh)
+    return parser
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+    if args.command == "agent" and args.state is not None and args.manifest is not None:
+        print("trifeni agent: use either --state or --manifest", file=sys.stderr)
+        return 2
+    try:
+        return args.func(args) or 0
+    except (Pyro4.errors.PyroError, KeyError, ValueError, EnvironmentError) as err:
+        print("trifeni {}: {}".format(args.command, err), file=sys.stderr)
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,6 @@
 from __future__ import print_function
 import json
 import os
-import re
 import logging
 
 from . import module_logger
@@ -9,15 +8,47 @@ from . import module_logger
 config_logger = logging.getLogger(module_logger.name+".config")
 
 class Configuration(object):
+    """
+    SSH host entries, by alias.
 
-    __slots__ = ("hosts", "default_identity_file")
+    Attributes:
+        hosts (dict): hosts from "~/.ssh/config" and ``ssh_configure``.
+        manifest_hosts (dict): hosts defined by the manifest last applied.
+            These take precedence over ``hosts``, and are replaced, not
+            updated, on every apply.
+        default_identity_file (str): key for hosts that don't name one.
+    """
+    __slots__ = ("hosts", "manifest_hosts", "default_identity_file")
 
     def __init__(self):
 
         self.default_identity_file = os.path.join(os.path.expanduser("~"), ".ssh/id_rsa")
         self.hosts = {}
+        self.manifest_hosts = {}
         self.ssh_default_configure()
 
+    def get_host(self, alias):
+        """
+        Args:
+            alias (str): SSH alias.
+        Returns:
+            dict: the alias's host entry, from the manifest if it defines
+                it, or None if neither the manifest nor ``hosts`` does.
+        """
+        if alias in self.manifest_hosts:
+            return self.manifest_hosts[alias]
+        return self.hosts.get(alias)
+
+    def set_manifest_hosts(self, hosts):
+        """
+        Replace the manifest's hosts. Aliases the previous manifest defined,
+        and this one doesn't, are gone, or back to their entry in ``hosts``.
+
+        Args:
+            hosts (dict): host entries, by alias.
+        """
+        self.manifest_hosts = dict(hosts)
+
     def ssh_default_configure(self):
         """
         Look in ~/.ssh/config for hosts.
@@ -58,7 +89,8 @@ class Configuration(object):
             return line_iterator, host_dict
         else:
             split = line.strip().split(" ")
-            for key in ["HostName", "Port", "User", "IdentityFile"]:
+            for key in ["HostName", "Port", "User", "IdentityFile",
+                        "Ciphers", "MACs", "Compression"]:
                 if split[0] == key:
                     val = " ".join(split[1:])
                     host_dict[host_alias][key] = val
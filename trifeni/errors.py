@@ -1,6 +1,20 @@
 import Pyro4
 
-__all__ = ["TunnelError"]
+__all__ = ["TunnelError", "PortInUseError"]
 
 class TunnelError(Pyro4.errors.CommunicationError):
     pass
+
+class PortInUseError(TunnelError):
+    """
+    The local end of a tunnel is taken.
+
+    Attributes:
+        port (int/str): the port, or Unix domain socket path.
+        owner (trifeni.util.Process): the process listening on port, or None
+            if it couldn't be found.
+    """
+    def __init__(self, message, port=None, owner=None):
+        super(PortInUseError, self).__init__(message)
+        self.port = port
+        self.owner = owner
@@ -0,0 +1,272 @@
+"""
+Access history: which objects a service gets through its tunnels, recorded
+per host, so that the next start can open their forwards in the background
+before they're asked for.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from .util import metrics, thread_map, resolve_host
+
+__all__ = ["AccessHistory", "Prewarmer"]
+
+module_logger = logging.getLogger(__name__)
+
+def spec_key(spec):
+    return json.dumps(spec, sort_keys=True)
+
+class AccessHistory(object):
+    """
+    On disk record of the objects accessed through tunnels to each host.
+    Every host gets a small JSON file with, for each object, the number of
+    sessions that accessed it and when it was last accessed. Entries are
+    ranked by their count, halved for every ``half_life`` seconds since
+    their last access, so that both frequently and recently used objects
+    come first. Only the ``max_entries`` best ranked entries are kept.
+
+    Processes writing the same host's file don't merge their records: the
+    last one to record wins.
+
+    Examples:
+
+    .. code-block:: python
+
+        history = AccessHistory()
+        with NameServerTunnel(remote_server_name="remote_alias", history=history) as ns:
+            ns.get_remote_object("SomeCoolObject")
+
+    Attributes:
+        directory (str): where host files are kept. Defaults to
+            ``~/.trifeni/history``.
+        max_entries (int): entries kept per host.
+        half_life (float): seconds after which an entry's count counts half.
+        logger (logging.getLogger): logging instance
+    """
+    def __init__(self, directory=None, max_entries=64, half_life=7*24*3600.0, logger=None):
+        if logger is None: logger = logging.getLogger(module_logger.name+".AccessHistory")
+        self.logger = logger
+        if directory is None:
+            directory = os.path.join(os.path.expanduser("~"), ".trifeni", "history")
+        self.directory = directory
+        self.max_entries = int(max_entries)
+        self.half_life = float(half_life)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def host_key(remote_ip, port=22, username=None):
+        """
+        Returns:
+            str: the name remote_ip's history goes under, after resolving
+                SSH aliases.
+        """
+        remote_alias, remote_ip, port, username, keyfile = resolve_host(
+            remote_ip, port=port, username=username)
+        return "{}@{}:{}".format(username, remote_ip, port)
+
+    def file_path(self, host):
+        return os.path.join(self.directory, "{}.json".format(re.sub(r"[^\w.@-]", "_", host)))
+
+    def entries(self, host):
+        """
+        Returns:
+            dict: host's entries, by key, loading them if need be. Each has
+                the accessed object's "spec", a "count" and a "last" access
+                time.
+        """
+        with self._lock:
+            return self._entries(host)
+
+    def _entries(self, host):
+        if host not in self._hosts:
+            entries = {}
+            try:
+                with open(self.file_path(host), "r") as f:
+                    entries = json.load(f).get("entries", {})
+            except (IOError, OSError):
+                pass
+            except ValueError as err:
+                self.logger.error("entries: Ignoring corrupt history for {}: {}".format(host, err))
+            self._hosts[host] = entries
+        return self._hosts[host]
+
+    def score(self, entry, now=None):
+        if now is None: now = time.time()
+        return entry["count"] * 0.5 ** (max(0.0, now - entry["last"]) / self.half_life)
+
+    def top(self, host, limit=None):
+        """
+        Args:
+            host (str): see ``host_key``.
+            limit (int, optional): maximum number of specs.
+        Returns:
+            list: specs of host's entries, best ranked first.
+        """
+        now = time.time()
+        with self._lock:
+            entries = list(self._entries(host).values())
+        entries.sort(key=lambda entry: self.score(entry, now), reverse=True)
+        return [entry["spec"] for entry in entries[:limit]]
+
+    def record(self, host, spec):
+        """
+        Record an access, and save host's history.
+
+        Args:
+            host (str): see ``host_key``.
+            spec (dict): JSON serializable description of what was accessed,
+                which ``Prewarmer`` gets back to open it.
+        """
+        now = time.time()
+        with self._lock:
+            entries = self._entries(host)
+            key = spec_key(spec)
+            entry = entries.setdefault(key, {"spec": spec, "count": 0})
+            entry["count"] += 1
+            entry["last"] = now
+            if len(entries) > self.max_entries:
+                ranked = sorted(entries, key=lambda key: self.score(entries[key], now), reverse=True)
+                for key in ranked[self.max_entries:]:
+                    del entries[key]
+            try:
+                self._save(host, entries)
+            except (IOError, OSError) as err:
+                self.logger.error("record: Couldn't save history for {}: {}".format(host, err))
+
+    def _save(self, host, entries):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        file_path = self.file_path(host)
+        tmp_file_path = "{}.{}.tmp".format(file_path, os.getpid())
+        with open(tmp_file_path, "w") as f:
+            json.dump({"host": host, "entries": entries}, f, separators=(",", ":"))
+        os.rename(tmp_file_path, file_path)
+
+class Prewarmer(object):
+    """
+    Open the forwards of a host's most used objects in the background, and
+    keep track of how many of the objects asked for afterwards were already
+    warm. Only the first access of each object counts, as a hit or a miss,
+    and gets recorded in the history.
+
+    Tunnels do the opening: ``warm(spec)`` is called with each spec in the
+    history the tunnel says is ``warmable``, on up to ``max_workers``
+    threads.
+
+    Attributes:
+        tunnel (Pyro4Tunnel): tunnel with ``warmable`` and ``warm`` methods.
+        history (AccessHistory): where accesses are recorded.
+        host (str): the tunnel's host key in history.
+        limit (int): number of entries to warm.
+        max_workers (int): number of entries warmed at the same time.
+        warmed (set): keys of the entries that were warmed.
+        hits (int): first accesses of objects that were already warm.
+        misses (int): first accesses of objects that weren't.
+        logger (logging.getLogger): logging instance
+    """
+    def __init__(self, tunnel, history, host, limit=8, max_workers=4, logger=None):
+        if logger is None: logger = logging.getLogger(module_logger.name+".Prewarmer")
+        self.logger = logger
+        self.tunnel = tunnel
+        self.history = history
+        self.host = host
+        self.limit = limit
+        self.max_workers = max_workers
+        self.warmed = set()
+        self.hits = 0
+        self.misses = 0
+        self._pending = {}
+        self._accessed = set()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start warming the host's best ranked entries on a thread."""
+        specs = [spec for spec in self.history.top(self.host) if self.tunnel.warmable(spec)]
+        specs = specs[:self.limit]
+        with self._lock:
+            for spec in specs:
+                self._pending[spec_key(spec)] = threading.Event()
+        self._thread = threading.Thread(target=self._warm_all, args=(specs,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _warm_all(self, specs):
+        start = time.time()
+        thread_map(self._warm, specs, max_workers=self.max_workers)
+        metrics.observe("prewarm.seconds", time.time() - start)
+        self.logger.debug("_warm_all: warmed {} of {} object(s) in {:.3f} seconds".format(
+            len(self.warmed), len(specs), time.time() - start))
+
+    def _warm(self, spec):
+        key = spec_key(spec)
+        try:
+            if self._stopped.is_set():
+                return
+            self.tunnel.warm(spec)
+            with self._lock:
+                self.warmed.add(key)
+            metrics.increment("prewarm.opened")
+        except Exception as err:
+            metrics.increment("prewarm.failed")
+            self.logger.debug("_warm: Couldn't warm {}: {}".format(spec, err))
+        finally:
+            self._pending[key].set()
+
+    def access(self, spec, timeout=None):
+        """
+        Count and record an access. If the object is still being warmed,
+        wait for that first, so that the caller doesn't race with it.
+
+        Args:
+            spec (dict): the object accessed, as recorded in history.
+            timeout (float, optional): longest to wait for the object's warm
+                up.
+        Returns:
+            bool: whether the object was warm, or None if it was accessed
+                before.
+        """
+        key = spec_key(spec)
+        with self._lock:
+            if key in self._accessed:
+                return None
+            self._accessed.add(key)
+            pending = self._pending.get(key)
+        if pending is not None:
+            pending.wait(timeout)
+        with self._lock:
+            hit = key in self.warmed
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.increment("prewarm.hits" if hit else "prewarm.misses")
+        self.history.record(self.host, spec)
+        return hit
+
+    def stats(self):
+        """
+        Returns:
+            dict: number of objects "warmed", "hits", "misses" and the
+                "hit_rate", None before the first access.
+        """
+        with self._lock:
+            accesses = self.hits + self.misses
+            return {"warmed": len(self.warmed), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": float(self.hits) / accesses if accesses else None}
+
+    def join(self, timeout=None):
+        """Wait for warming to finish."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stop(self, timeout=None):
+        """Skip entries not warmed yet, and wait for the ones in progress."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
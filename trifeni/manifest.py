@@ -0,0 +1,437 @@
+"""
+Declarative tunnels: a manifest lists hosts, forwards, reverse forwards and
+Pyro4 objects, and is applied to an SSHTunnelManager as a diff against what
+the last apply opened.
+"""
+import json
+import logging
+import os
+import threading
+import uuid
+
+import Pyro4
+
+from .configuration import config
+from .util import SSHTunnelManager, resolve_host
+
+__all__ = ["Manifest", "ManifestApplier", "ManifestWatcher"]
+
+module_logger = logging.getLogger(__name__)
+
+class Manifest(object):
+    """
+    Tunnels a station should have open, and the hosts they go to.
+
+    Examples:
+
+    .. code-block:: json
+
+        {
+            "hosts": {"station": {"HostName": "10.0.0.5", "User": "obs"}},
+            "forwards": [{"host": "station", "local_port": 9090}],
+            "reverse": [{"host": "station", "local_port": 50000, "remote_port": 50000}],
+            "objects": {
+                "DataArchive": {"host": "station", "uri": "PYRO:DataArchive@localhost:50001"},
+                "Telescope": {"host": "station", "ns_port": 9090, "local_ns_port": 9190}
+            }
+        }
+
+    Forwards and reverse forwards take a ``host`` (SSH alias or address),
+    ``local_port``, ``remote_port`` (defaults to ``local_port``) and
+    ``relay`` (defaults to "localhost"). Anything else is passed to
+    ``SSHTunnelManager.create_tunnel``. Objects get a forward to their
+    daemon, if a ``uri`` is given. Otherwise they get a forward to their
+    nameserver, on ``ns_host`` and ``ns_port``, forwarded from
+    ``local_ns_port``, and, once the object has been looked up there under
+    its ``name`` (defaults to the entry's key), a forward to its daemon's
+    port or socket, from ``local_obj_port`` if given.
+
+    Attributes:
+        hosts (dict): SSH host entries, like those of ``config.hosts``. They
+            go to ``config.manifest_hosts``.
+        forwards (list): forward tunnel entries.
+        reverse (list): reverse tunnel entries.
+        objects (dict): object entries, by name.
+    """
+    sections = ("hosts", "forwards", "reverse", "objects")
+
+    def __init__(self, hosts=None, forwards=None, reverse=None, objects=None):
+        self.hosts = dict(hosts or {})
+        self.forwards = list(forwards or [])
+        self.reverse = list(reverse or [])
+        self.objects = dict(objects or {})
+
+    @classmethod
+    def from_dict(cls, manifest):
+        unknown = set(manifest) - set(cls.sections)
+        if unknown:
+            raise ValueError("Unknown manifest section(s) {}. Choose from {}".format(
+                sorted(unknown), cls.sections))
+        manifest = dict(manifest)
+        manifest["hosts"] = cls.check_hosts(manifest.get("hosts"))
+        return cls(**manifest)
+
+    @staticmethod
+    def check_hosts(hosts):
+        """
+        Check host entries, so that a bad one is caught when the manifest is
+        loaded, rather than when a tunnel to it is created.
+
+        Args:
+            hosts (dict): SSH host entries, by alias.
+        Returns:
+            dict: the entries, with ``Port`` an int (22 by default).
+        Raises:
+            ValueError: if an entry has no ``HostName``, or a bad ``Port``.
+        """
+        checked = {}
+        for alias, entry in (hosts or {}).items():
+            if not isinstance(entry, dict) or not entry.get("HostName"):
+                raise ValueError("Manifest host {} has no HostName".format(alias))
+            entry = dict(entry)
+            try:
+                entry["Port"] = int(entry.get("Port", 22))
+            except (TypeError, ValueError):
+                raise ValueError("Manifest host {} has a bad Port {!r}".format(alias, entry["Port"]))
+            checked[alias] = entry
+        return checked
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Args:
+            file_path (str): path to a JSON manifest.
+        Returns:
+            Manifest
+        """
+        with open(file_path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.sections}
+
+    def host_entries(self):
+        """
+        Returns:
+            dict: the manifest's hosts, in the form ``config.hosts`` uses.
+        """
+        hosts = {}
+        for alias in self.hosts:
+            entry = dict(self.hosts[alias])
+            entry.setdefault("Port", 22)
+            if "IdentityFile" in entry:
+                entry["IdentityFile"] = os.path.expanduser(entry["IdentityFile"])
+            hosts[alias] = entry
+        return hosts
+
+    def _entry_spec(self, entry, reverse):
+        kwargs = dict(entry)
+        host = kwargs.pop("host")
+        local_port = kwargs.pop("local_port")
+        remote_port = kwargs.pop("remote_port", local_port)
+        relay = kwargs.pop("relay", "localhost")
+        kwargs["reverse"] = reverse
+        return {"args": [host, relay, local_port, remote_port], "kwargs": kwargs}
+
+    def nameserver_objects(self):
+        """
+        Objects to look up on their nameserver.
+
+        Returns:
+            dict: name the object is registered under, and the local
+                address and port its nameserver is forwarded from, by entry
+                name.
+        """
+        objects = {}
+        for name in self.objects:
+            entry = self.objects[name]
+            if "uri" not in entry:
+                ns_port = int(entry.get("ns_port", 9090))
+                objects[name] = (entry.get("name", name), entry.get("ns_host", "localhost"),
+                                 int(entry.get("local_ns_port", ns_port)))
+        return objects
+
+    def _object_specs(self, name, uri=None):
+        entry = self.objects[name]
+        specs = []
+        if "uri" in entry:
+            uri = Pyro4.core.URI(entry["uri"])
+        if uri is not None:
+            port = uri.sockname if uri.sockname is not None else uri.port
+            local_port = entry.get("local_obj_port", port) if uri.sockname is None else port
+            specs.append({"args": [entry["host"], uri.host, local_port, port], "kwargs": {}})
+        if "ns_port" in entry or "uri" not in entry:
+            ns_port = int(entry.get("ns_port", 9090))
+            specs.append({"args": [entry["host"], entry.get("ns_host", "localhost"),
+                                   int(entry.get("local_ns_port", ns_port)), ns_port],
+                          "kwargs": {}})
+        return specs
+
+    def tunnel_specs(self, uris=None):
+        """
+        Specs of the manifest's tunnels, keyed by what identifies a tunnel:
+        its endpoints, the address, port, user and key its host resolves to,
+        and its other arguments. Tunnels shared by several entries, like the
+        nameserver forward of objects on the same host, appear once. Call
+        this with the manifest's hosts in ``config.manifest_hosts``.
+
+        Args:
+            uris (dict, optional): URIs of the ``nameserver_objects`` found
+                so far, by entry name. Their daemons get forwards too.
+        Returns:
+            dict: ``create_tunnel`` specs, by key.
+        """
+        if uris is None: uris = {}
+        specs = [self._entry_spec(entry, False) for entry in self.forwards]
+        specs += [self._entry_spec(entry, True) for entry in self.reverse]
+        for name in sorted(self.objects):
+            specs += self._object_specs(name, uris.get(name))
+        keyed = {}
+        for spec in specs:
+            host, relay, local_port, remote_port = spec["args"]
+            kwargs = spec["kwargs"]
+            resolved = resolve_host(host, port=kwargs.get("port", 22),
+                                    username=kwargs.get("username"), keyfile=kwargs.get("keyfile"))
+            key = json.dumps([list(resolved), relay, local_port, remote_port, kwargs], sort_keys=True)
+            keyed[key] = spec
+        return keyed
+
+class ManifestApplier(object):
+    """
+    Apply manifests to an SSHTunnelManager as diffs: tunnels in the new
+    manifest but not in the last applied one are opened, tunnels that are
+    no longer in it are closed, and the rest are left alone, connections
+    and all. A tunnel whose host now resolves to another address, port,
+    user or key counts as removed and added. Tunnels the manager has from
+    elsewhere are never touched.
+
+    Objects on a nameserver are looked up through its forward once that's
+    open, on every apply, and their daemons forwarded. An object whose
+    daemon moved gets a new forward in place of the old one. The manifest's
+    hosts replace ``config.manifest_hosts`` on every apply, so hosts
+    removed from it are forgotten.
+
+    Examples:
+
+    .. code-block:: python
+
+        applier = ManifestApplier(manager)
+        applier.apply(Manifest.load("station.json"))
+        # edit station.json, then:
+        applier.apply(Manifest.load("station.json"))
+
+    Attributes:
+        manager (SSHTunnelManager): manager of the tunnels.
+        applied (dict): IDs of the tunnels the applier opened, by key (see
+            ``Manifest.tunnel_specs``).
+        uris (dict): URIs found for the manifest's nameserver objects, by
+            entry name.
+        max_workers (int): maximum number of tunnels opened at the same time.
+        drain_timeout (float): drain closed forward tunnels for up to this
+            many seconds, or None to close them straight away.
+        lookup_timeout (float): seconds to wait for a nameserver lookup.
+        logger (logging.getLogger): logging instance
+    """
+    def __init__(self, manager=None, max_workers=8, drain_timeout=None, lookup_timeout=5.0,
+                 logger=None):
+        if logger is None: logger = logging.getLogger(module_logger.name+".ManifestApplier")
+        self.logger = logger
+        if manager is None: manager = SSHTunnelManager()
+        self.manager = manager
+        self.max_workers = max_workers
+        self.drain_timeout = drain_timeout
+        self.lookup_timeout = lookup_timeout
+        self.applied = {}
+        self.uris = {}
+        self._lock = threading.Lock()
+
+    def plan(self, manifest, uris=None):
+        """
+        Returns:
+            tuple: specs to open, by key, keys to close, and keys left alone.
+        """
+        desired = manifest.tunnel_specs(uris)
+        to_open = {key: desired[key] for key in desired if key not in self.applied}
+        to_close = [key for key in self.applied if key not in desired]
+        unchanged = [key for key in self.applied if key in desired]
+        return to_open, to_close, unchanged
+
+    def look_up(self, name, ns_host, local_ns_port):
+        """
+        Look an object up on a nameserver, through its forward.
+
+        Returns:
+            Pyro4.core.URI
+        """
+        ns_uri = "PYRO:{}@{}:{}".format(Pyro4.constants.NAMESERVER_NAME, ns_host, local_ns_port)
+        with Pyro4.Proxy(ns_uri) as ns:
+            ns._pyroTimeout = self.lookup_timeout
+            return ns.lookup(name)
+
+    def apply(self, manifest):
+        """
+        Make the tunnels match manifest. Tunnels that fail to open are
+        logged, and tried again on the next apply.
+
+        Args:
+            manifest (Manifest): tunnels to have open.
+        Returns:
+            dict: number of tunnels "opened", "closed", "unchanged" and
+                "failed".
+        """
+        with self._lock:
+            config.set_manifest_hosts(manifest.host_entries())
+            before = set(self.applied)
+            objects = manifest.nameserver_objects()
+            uris = {name: self.uris[name] for name in self.uris if name in objects}
+            # nameservers first: the objects on them are looked up through
+            # their forwards.
+            failed = self._apply(manifest, uris)
+            lookups_failed = 0
+            for name in sorted(objects):
+                try:
+                    uris[name] = self.look_up(*objects[name])
+                except Exception as err:
+                    # keep the forward to where the object was, if anywhere.
+                    self.logger.error("apply: Couldn't look up {}: {}".format(name, err))
+                    lookups_failed += 1
+            self.uris = uris
+            failed |= self._apply(manifest, uris, skip=failed)
+            after = set(self.applied)
+            result = {"opened": len(after - before), "closed": len(before - after),
+                      "unchanged": len(before & after), "failed": len(failed) + lookups_failed}
+        self.logger.info("apply: {}".format(result))
+        return result
+
+    def _apply(self, manifest, uris, skip=()):
+        """
+        Returns:
+            set: keys of the tunnels that failed to open.
+        """
+        to_open, to_close, unchanged = self.plan(manifest, uris)
+        # close first, so that a changed tunnel can bind the port again.
+        for key in to_close:
+            tunnel_id = self.applied.pop(key)
+            if tunnel_id in self.manager.tunnels:
+                self.manager.destroy_tunnel(tunnel_id, drain_timeout=self.drain_timeout)
+        ids = {}
+        specs = []
+        for key in to_open:
+            if key in skip:
+                continue
+            ids[key] = uuid.uuid4().hex
+            kwargs = dict(to_open[key]["kwargs"], tunnel_id=ids[key])
+            specs.append({"args": to_open[key]["args"], "kwargs": kwargs})
+        self.manager.create_tunnels(specs, max_workers=self.max_workers)
+        failed = set()
+        for key in ids:
+            tunnel = self.manager.tunnels.get(ids[key])
+            if tunnel is not None and tunnel.open:
+                self.applied[key] = ids[key]
+                continue
+            failed.add(key)
+            if tunnel is not None:
+                self.manager.destroy_tunnel(ids[key])
+        return failed
+
+    def cleanup(self):
+        """Close every tunnel the applier opened."""
+        self.apply(Manifest())
+
+class ManifestWatcher(object):
+    """
+    Re-apply a manifest file when it, or the SSH config file, changes. Files
+    are polled: a change is picked up within ``interval`` seconds. An apply
+    with failures is retried every interval. A manifest that doesn't parse
+    is logged and ignored, leaving the tunnels as they are.
+
+    Examples:
+
+    .. code-block:: python
+
+        with ManifestWatcher("station.json", ManifestApplier(manager)) as watcher:
+            ...
+
+    Attributes:
+        file_path (str): path to the manifest.
+        applier (ManifestApplier): applies the manifest.
+        ssh_config_path (str): path to the SSH config file, or None to not
+            watch it. Hosts it defines are updated in ``config.hosts``, not
+            removed. The manifest's own hosts take precedence.
+        interval (float): seconds between polls.
+        last_result (dict): result of the last apply.
+        logger (logging.getLogger): logging instance
+    """
+    def __init__(self, file_path, applier, ssh_config_path=None, interval=1.0, logger=None):
+        if logger is None: logger = logging.getLogger(module_logger.name+".ManifestWatcher")
+        self.logger = logger
+        if ssh_config_path is None:
+            ssh_config_path = os.path.join(os.path.expanduser("~"), ".ssh/config")
+        self.file_path = file_path
+        self.applier = applier
+        self.ssh_config_path = ssh_config_path
+        self.interval = interval
+        self.last_result = None
+        self._stamps = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _changed(self, path):
+        try:
+            stat = os.stat(path)
+            stamp = (stat.st_mtime, stat.st_size, stat.st_ino)
+        except OSError:
+            stamp = None
+        changed = self._stamps.get(path, False) != stamp
+        self._stamps[path] = stamp
+        return changed
+
+    def check(self):
+        """
+        Apply the manifest if it, or the SSH config, changed since the last
+        check, or if the last apply had failures.
+
+        Returns:
+            dict: result of the apply, or None if nothing was applied.
+        """
+        ssh_config_changed = self.ssh_config_path is not None and self._changed(self.ssh_config_path)
+        manifest_changed = self._changed(self.file_path)
+        retry = self.last_result is not None and self.last_result["failed"] > 0
+        if not (ssh_config_changed or manifest_changed or retry):
+            return None
+        if ssh_config_changed and os.path.exists(self.ssh_config_path):
+            with open(self.ssh_config_path, "r") as f:
+                config.ssh_configure(config.get_hosts(iter(f.read().split("\n")), {}))
+        try:
+            manifest = Manifest.load(self.file_path)
+        except (IOError, OSError, ValueError) as err:
+            self.logger.error("check: Couldn't load {}: {}".format(self.file_path, err))
+            return None
+        self.last_result = self.applier.apply(manifest)
+        return self.last_result
+
+    def start(self):
+        """Check once, then keep checking on a thread."""
+        self.check()
+        self._thread = threading.Thread(target=self._watch_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _watch_loop(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception as err:
+                self.logger.error("_watch_loop: {}".format(err))
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
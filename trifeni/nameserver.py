@@ -0,0 +1,150 @@
+"""
+Nameserver tunnels and proxies shared by every NameServerTunnel in a process.
+"""
+import json
+import logging
+import threading
+import time
+
+import Pyro4
+
+from .util import SSHTunnelManager, metrics
+from .errors import TunnelError
+
+__all__ = ["SharedNameServer", "NameServerRegistry", "nameservers"]
+
+module_logger = logging.getLogger(__name__)
+
+class SharedNameServer(object):
+    """
+    A tunnel to a remote nameserver, and the proxy located through it,
+    shared by every NameServerTunnel that asks for the same nameserver.
+    Pyro4 serializes calls on a proxy, so threads can share ``ns``.
+
+    Attributes:
+        key (tuple): host, login port, username, whether it's local,
+            nameserver host, nameserver port, backend and the other SSHTunnel
+            keyword arguments, as JSON.
+        local_ns_port (int): local port forwarded to the nameserver.
+        create_tunnel_kwargs (dict): other SSHTunnel keyword arguments.
+        manager (SSHTunnelManager): holds the nameserver tunnel.
+        ns (Pyro4.Proxy): located nameserver proxy, or None until
+            ``connect`` succeeds.
+        refcount (int): number of NameServerTunnels using this.
+        lock (threading.Lock): held while connecting.
+    """
+    def __init__(self, key, local_ns_port, create_tunnel_kwargs=None, backend="paramiko",
+                 logger=None):
+        if logger is None: logger = logging.getLogger(module_logger.name+".SharedNameServer")
+        self.logger = logger
+        self.key = key
+        self.local_ns_port = local_ns_port
+        self.create_tunnel_kwargs = dict(create_tunnel_kwargs or {})
+        self.manager = SSHTunnelManager(backend=backend, logger=logging.getLogger(logger.name+".manager"))
+        self.ns = None
+        self.refcount = 0
+        self.lock = threading.Lock()
+
+    def connect(self, timeout=1.0, attempts=10):
+        """
+        Create the tunnel, unless the nameserver is local, and locate the
+        nameserver through it, retrying while the tunnel comes up. Does
+        nothing if already connected.
+
+        Returns:
+            Pyro4.Proxy: the nameserver.
+        """
+        with self.lock:
+            if self.ns is not None:
+                return self.ns
+            remote_server_name, port, username, local, ns_host, ns_port = self.key[:6]
+            if not local:
+                self.manager.create_tunnel(remote_server_name, ns_host, self.local_ns_port, ns_port,
+                                           port=port, username=username, **self.create_tunnel_kwargs)
+            for attempt in range(attempts):
+                try:
+                    self.ns = Pyro4.locateNS(ns_host, self.local_ns_port)
+                    break
+                except Pyro4.errors.PyroError as err:
+                    self.logger.debug("connect: locate failed: {}".format(err))
+                    if attempt < attempts - 1:
+                        time.sleep(timeout)
+            else:
+                self._close_tunnels()
+                exc = TunnelError("Failed to find NameServer on tunnel.")
+                exc.details = {'remote_server_name': remote_server_name}
+                raise exc
+            metrics.increment("nameserver.locates")
+            return self.ns
+
+    def close(self):
+        """Release the proxy, and close the tunnel."""
+        with self.lock:
+            if self.ns is not None:
+                self.ns._pyroRelease()
+                self.ns = None
+            self._close_tunnels()
+
+    def _close_tunnels(self):
+        for tunnel_id in list(self.manager.tunnels):
+            self.manager.destroy_tunnel(tunnel_id)
+
+class NameServerRegistry(object):
+    """
+    Process wide, thread safe registry of SharedNameServer instances, with
+    reference counting: the first ``acquire`` of a nameserver creates its
+    tunnel and locates it, later ones reuse it, and the last ``release``
+    closes it. Concurrent first acquires wait for a single locate.
+
+    Normally this is used through NameServerTunnel, via the module level
+    ``nameservers`` instance.
+
+    Attributes:
+        handles (dict): SharedNameServer instances in use, by key.
+    """
+    def __init__(self):
+        self.handles = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, remote_server_name, ns_host="localhost", ns_port=9090, local_ns_port=None,
+                port=22, username=None, local=False, create_tunnel_kwargs=None,
+                backend="paramiko"):
+        """
+        Get the shared nameserver for a host, connecting it if need be.
+        Acquires share a nameserver only if they ask for the same tunnel,
+        keyword arguments and backend included, except that a later acquire
+        with another local_ns_port gets the existing tunnel.
+
+        Returns:
+            SharedNameServer
+        """
+        ns_port = int(ns_port)
+        if local_ns_port is None: local_ns_port = ns_port
+        key = (remote_server_name, port, username, bool(local), ns_host, ns_port, backend,
+               json.dumps(create_tunnel_kwargs or {}, sort_keys=True, default=repr))
+        with self._lock:
+            handle = self.handles.get(key)
+            if handle is None:
+                handle = SharedNameServer(key, local_ns_port, create_tunnel_kwargs, backend=backend)
+                self.handles[key] = handle
+            else:
+                metrics.increment("nameserver.shared")
+            handle.refcount += 1
+        try:
+            handle.connect()
+        except Exception:
+            self.release(handle)
+            raise
+        return handle
+
+    def release(self, handle):
+        """Drop a reference to handle, closing it if it was the last one."""
+        with self._lock:
+            handle.refcount -= 1
+            if handle.refcount > 0:
+                return
+            if self.handles.get(handle.key) is handle:
+                del self.handles[handle.key]
+        handle.close()
+
+nameservers = NameServerRegistry()
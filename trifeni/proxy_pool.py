@@ -0,0 +1,168 @@
+import contextlib
+import logging
+import threading
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+import Pyro4
+
+from .errors import TunnelError
+
+__all__ = ["ProxyPool"]
+
+module_logger = logging.getLogger(__name__)
+
+class ProxyPool(object):
+    """
+    A fixed number of pre-bound proxies to a single Pyro4 object. Pyro4 proxies
+    shouldn't be shared between threads, so instead of creating (and binding)
+    a new proxy for every thread, threads check proxies out of the pool for
+    as long as they need them.
+
+    Proxies that raise a Pyro4.errors.CommunicationError while checked out are
+    taken out of rotation and re-bound by a background thread.
+
+    Normally pools are created through ``Pyro4Tunnel.get_proxy_pool``, which
+    takes care of creating the tunnel to the object.
+
+    Examples:
+
+    .. code-block:: python
+
+        with DaemonTunnel(remote_server_name="remote_alias") as dt:
+            pool = dt.get_proxy_pool("PYRO:Server@localhost:9091", size=8)
+
+            def work(x):
+                with pool.proxy() as proxy:
+                    return proxy.square(x)
+
+    Attributes:
+        uri (Pyro4.core.URI): URI of the pooled object.
+        size (int): number of proxies in the pool.
+        proxy_class (type): Proxy class.
+        serializer (str): Pyro4 serializer the proxies use, or None for
+            ``Pyro4.config.SERIALIZER``.
+        reconnect_interval (float): seconds between attempts to re-bind a
+            broken proxy.
+        idle (Queue.Queue): proxies ready to be checked out.
+        broken (Queue.Queue): proxies waiting to be re-bound.
+        logger (logging.getLogger): logging instance
+    """
+    def __init__(self, uri, size=4, proxy_class=None, proxies=None,
+                 reconnect_interval=1.0, serializer=None, logger=None):
+        """
+        Args:
+            uri (str/Pyro4.core.URI): URI of the object.
+            size (int, optional): number of proxies (4)
+            proxy_class (type, optional): Proxy class. Defaults to Pyro4.Proxy
+            proxies (list, optional): already bound proxies to include in the
+                pool.
+            reconnect_interval (float, optional): seconds between attempts to
+                re-bind a broken proxy (1.0)
+            serializer (str, optional): Pyro4 serializer for proxies the pool
+                creates.
+            logger (logging.getLogger, optional): logging instance.
+        """
+        if logger is None: logger = logging.getLogger(module_logger.name+".ProxyPool")
+        self.logger = logger
+        if proxy_class is None: proxy_class = Pyro4.Proxy
+        self.uri = Pyro4.core.URI(uri)
+        self.size = int(size)
+        self.proxy_class = proxy_class
+        self.reconnect_interval = reconnect_interval
+        self.serializer = serializer
+        self.idle = Queue.Queue()
+        self.broken = Queue.Queue()
+        self._proxies = list(proxies or [])[:self.size]
+        self._closed = threading.Event()
+
+        for proxy in self._proxies:
+            self.idle.put(proxy)
+        while len(self._proxies) < self.size:
+            proxy = self.create_proxy()
+            self._proxies.append(proxy)
+            self.idle.put(proxy)
+
+        self._reconnect_thread = threading.Thread(target=self._reconnect_loop)
+        self._reconnect_thread.daemon = True
+        self._reconnect_thread.start()
+
+    def create_proxy(self):
+        """Create and bind a new proxy to uri."""
+        proxy = self.proxy_class(self.uri)
+        if self.serializer is not None:
+            proxy._pyroSerializer = self.serializer
+        proxy._pyroBind()
+        return proxy
+
+    @contextlib.contextmanager
+    def proxy(self, timeout=None):
+        """
+        Check a proxy out of the pool for the duration of a with block.
+
+        Args:
+            timeout (float, optional): seconds to wait for a proxy to become
+                available. Waits indefinitely by default.
+        Yields:
+            Pyro4.Proxy
+        """
+        if self._closed.is_set():
+            raise TunnelError("ProxyPool for {} is closed".format(self.uri))
+        try:
+            proxy = self.idle.get(timeout=timeout)
+        except Queue.Empty:
+            raise TunnelError("No proxy to {} available after {} seconds".format(self.uri, timeout))
+        try:
+            yield proxy
+        except Pyro4.errors.CommunicationError:
+            self.logger.debug("proxy: {} broke, re-binding in background".format(proxy))
+            self.broken.put(proxy)
+            raise
+        except BaseException:
+            self.idle.put(proxy)
+            raise
+        else:
+            self.idle.put(proxy)
+
+    def _reconnect_loop(self):
+        while not self._closed.is_set():
+            try:
+                proxy = self.broken.get(timeout=self.reconnect_interval)
+            except Queue.Empty:
+                continue
+            try:
+                proxy._pyroRelease()
+                proxy._pyroBind()
+            except Exception as err:
+                self.logger.debug("_reconnect_loop: Couldn't re-bind to {}: {}".format(self.uri, err))
+                self.broken.put(proxy)
+                self._closed.wait(self.reconnect_interval)
+            else:
+                self.logger.debug("_reconnect_loop: re-bound to {}".format(self.uri))
+                self.idle.put(proxy)
+
+    def status(self):
+        """
+        Returns:
+            dict: number of idle, checked out and broken proxies.
+        """
+        idle, broken = self.idle.qsize(), self.broken.qsize()
+        return {"idle": idle, "broken": broken, "in_use": self.size - idle - broken}
+
+    def close(self):
+        """Stop re-binding proxies, and release every proxy in the pool."""
+        self._closed.set()
+        self._reconnect_thread.join(self.reconnect_interval + 1.0)
+        for proxy in self._proxies:
+            try:
+                proxy._pyroRelease()
+            except Exception as err:
+                self.logger.debug("close: {}".format(err))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,13 +1,46 @@
+import hashlib
 import logging
+import os
+import tempfile
+
 import Pyro4
 
-from .util import SSHTunnelManager, check_connection
+from .util import SSHTunnelManager, check_connection, is_socket_path, thread_map
+from .proxy_pool import ProxyPool
+from .batching import CommandQueue
+from .nameserver import nameservers
+from .history import AccessHistory, Prewarmer
+from .callbacks import CallbackDaemon, callbacks
 from .errors import TunnelError
 
-__all__ = ["Pyro4Tunnel", "DaemonTunnel", "NameServerTunnel"]
+__all__ = ["Pyro4Tunnel", "DaemonTunnel", "NameServerTunnel", "check_serializer"]
 
 module_logger = logging.getLogger(__name__)
 
+unsafe_serializers = ("pickle", "dill")
+
+def check_serializer(serializer):
+    """
+    Make sure serializer can be used for tunneled proxies. The serializer has
+    to be installed, and "pickle" and "dill", which can execute arbitrary code
+    when loading, are only allowed if they are in
+    ``Pyro4.config.SERIALIZERS_ACCEPTED``.
+
+    Args:
+        serializer (str): name of a Pyro4 serializer, like "serpent", "marshal",
+            "json", "msgpack", "pickle" or "dill".
+    Returns:
+        str: serializer
+    """
+    try:
+        Pyro4.util.get_serializer(serializer)
+    except Pyro4.errors.SerializeError as err:
+        raise TunnelError("Serializer {} is not available: {}".format(serializer, err))
+    if serializer in unsafe_serializers and serializer not in Pyro4.config.SERIALIZERS_ACCEPTED:
+        raise TunnelError(
+            "Serializer {0} is not allowed. Add it to Pyro4.config.SERIALIZERS_ACCEPTED to use it".format(serializer))
+    return serializer
+
 class Pyro4Tunnel(SSHTunnelManager):
     """
     Base class for interacting with remote Pyro4 objects.
@@ -25,14 +58,34 @@ class Pyro4Tunnel(SSHTunnelManager):
         local (bool): Boolean indicating whether to create a tunnel or not.
         create_tunnel_kwargs (dict): dictionary options passed to the super class's
             ``create_tunnel`` method.
+        proxy_pools (dict): ProxyPool instances created by ``get_proxy_pool``,
+            keyed by the object they were requested for.
+        command_queues (list): CommandQueue instances created by
+            ``get_command_queue``.
+        serializer (str): Pyro4 serializer for proxies created by this
+            object. None means ``Pyro4.config.SERIALIZER``.
+        history (AccessHistory): where the objects this instance gets are
+            recorded, or None to not record them.
+        prewarm (int): number of objects from history whose forwards are
+            opened in the background when the instance is created.
+        prewarmer (Prewarmer): opens them, and counts how many of the
+            objects asked for were warm, or None without history.
+        callback_forwards (dict): shared reverse forwards (CallbackForward)
+            this instance uses, by key.
     """
     def __init__(self,remote_server_name='localhost',
                        relay_ip='localhost',
                        remote_port=22,
                        remote_username=None,local=False,
-                       create_tunnel_kwargs=None,logger=None):
-
-        super(Pyro4Tunnel, self).__init__(logger=logger)
+                       create_tunnel_kwargs=None,logger=None,
+                       transports_per_host=1, stripe_policy="round-robin",
+                       serializer=None, backend="paramiko",
+                       history=None, prewarm=8):
+
+        super(Pyro4Tunnel, self).__init__(logger=logger,
+                                          transports_per_host=transports_per_host,
+                                          stripe_policy=stripe_policy,
+                                          backend=backend)
         self.remote_server_name = remote_server_name
         self.relay_ip = relay_ip
         self.remote_port = remote_port
@@ -40,8 +93,76 @@ class Pyro4Tunnel(SSHTunnelManager):
         self.local = local
         if not create_tunnel_kwargs: create_tunnel_kwargs = {}
         self.create_tunnel_kwargs = create_tunnel_kwargs
+        self.proxy_pools = {}
+        self.command_queues = []
+        if serializer is not None: serializer = check_serializer(serializer)
+        self.serializer = serializer
+        if history is True: history = AccessHistory()
+        self.history = history
+        self.prewarm = prewarm
+        self.prewarmer = None
+        self.callback_forwards = {}
+
+    def start_prewarm(self):
+        """
+        Start opening the forwards of the objects most used on this host, in
+        the background, if the instance has a history. Subclasses call this
+        once they can get objects.
+        """
+        if self.history is None or self.local:
+            return
+        host = self.history.host_key(self.remote_server_name, port=self.remote_port,
+                                     username=self.remote_username)
+        self.prewarmer = Prewarmer(self, self.history, host, limit=self.prewarm,
+                                   logger=logging.getLogger(self.logger.name + ".Prewarmer"))
+        self.prewarmer.start()
+
+    def accessed(self, spec):
+        """
+        Count and record an access to the object spec describes, waiting
+        for it if it's being warmed.
+        """
+        if self.prewarmer is not None:
+            self.prewarmer.access(spec)
+
+    def warmable(self, spec):
+        """
+        Returns:
+            bool: whether ``warm`` can open spec, recorded by this or
+                another kind of tunnel.
+        """
+        return False
+
+    def warm(self, spec):
+        """
+        Open the forward of a recorded object. Nothing is ``warmable`` here,
+        so there's nothing to open.
+        """
+        return None
+
+    def create_proxy(self, uri, proxy_class=None, serializer=None):
+        """
+        Create a proxy to uri that uses serializer, falling back to the
+        tunnel's serializer.
+
+        Args:
+            uri (str/Pyro4.core.URI): URI of the object.
+            proxy_class (object, optional): Proxy class. Defaults to Pyro4.Proxy
+            serializer (str, optional): Pyro4 serializer for this proxy.
+        Returns:
+            object: instance of a Proxy class.
+        """
+        if proxy_class is None: proxy_class = Pyro4.core.Proxy
+        if serializer is None:
+            serializer = self.serializer
+        else:
+            serializer = check_serializer(serializer)
+        proxy = proxy_class(uri)
+        if serializer is not None:
+            proxy._pyroSerializer = serializer
+        return proxy
 
-    def register_remote_daemon(self, daemon, reverse=True):
+    def register_remote_daemon(self, daemon, reverse=True, serializer=None):
         """
         Register a remote daemon with the remote Pyro4 nameserver.
         This creates a tunnel to the daemon object. Note that in "local" mode there
@@ -49,12 +170,150 @@ class Pyro4Tunnel(SSHTunnelManager):
 
         Args:
             daemon (Pyro4.Daemon):
+            serializer (str, optional): serializer remote clients will use to
+                call the daemon. Defaults to the tunnel's serializer. The
+                daemon has to accept it, that is, it has to be in
+                ``Pyro4.config.SERIALIZERS_ACCEPTED`` when the daemon is created.
+                This is checked against the current configuration.
         Returns:
             bool: Whether or not the connection was already there.
         """
+        if serializer is None: serializer = self.serializer
+        if serializer is not None:
+            if check_serializer(serializer) not in Pyro4.config.SERIALIZERS_ACCEPTED:
+                raise TunnelError("Daemon {} doesn't accept serializer {}".format(
+                    daemon.locationStr, serializer))
         if not self.local:
-            daemon_host, daemon_port = daemon.locationStr.split(":")
-            self.create_tunnel(int(daemon_port), int(daemon_port), reverse=reverse, **self.create_tunnel_kwargs)
+            if reverse:
+                self.forward_callbacks(daemon)
+            else:
+                daemon_host, daemon_port = daemon.locationStr.split(":")
+                self.create_tunnel(int(daemon_port), int(daemon_port))
+
+    def register_callback(self, obj, object_id=None):
+        """
+        Register a callback object with the process wide callback daemon
+        (see ``trifeni.callbacks``), and make sure the remote host can reach
+        it. Objects registered through any tunnel to a host share one
+        reverse forward.
+
+        Examples:
+
+        .. code-block:: python
+
+            handler = Pyro4.Proxy(dt.register_callback(Callbacks()))
+            obj_proxy.square_with_callback(100, callback_info={
+                "handler": handler, "callback_name": "some_callback"
+            })
+
+        Args:
+            obj (object): Pyro4 exposed object or class.
+            object_id (str, optional): see ``Pyro4.Daemon.register``.
+        Returns:
+            Pyro4.core.URI: URI of the object, for the remote to call back.
+        """
+        uri = callbacks.register(obj, object_id=object_id)
+        self.forward_callbacks()
+        return uri
+
+    def forward_callbacks(self, daemon=None):
+        """
+        Forward a local daemon's port from the remote host, through the
+        reverse forward shared by every tunnel to the host.
+
+        Args:
+            daemon (Pyro4.Daemon/CallbackDaemon, optional): Defaults to the
+                process wide callback daemon.
+        """
+        if self.local:
+            return
+        if daemon is None: daemon = callbacks
+        if isinstance(daemon, CallbackDaemon):
+            daemon.start()
+            relay_ip, daemon_port = daemon.host, daemon.port
+        else:
+            relay_ip, daemon_port = daemon.locationStr.rsplit(":", 1)
+            relay_ip = relay_ip.strip("[]")
+        forward = callbacks.acquire_forward(
+            self.remote_server_name, port=self.remote_port, username=self.remote_username,
+            local_port=int(daemon_port), relay_ip=relay_ip,
+            create_tunnel_kwargs=self.create_tunnel_kwargs)
+        if forward.key in self.callback_forwards:
+            callbacks.release_forward(forward)
+        else:
+            self.callback_forwards[forward.key] = forward
+
+    def get_proxy_pool(self, obj, size=4, **kwargs):
+        """
+        Get a ProxyPool of pre-bound proxies to a remote object, so that
+        threads can check out their own proxy without looking up the object,
+        checking tunnels or binding on each request. Subsequent calls for the
+        same object return the same pool.
+
+        Examples:
+
+        .. code-block:: python
+
+            with NameServerTunnel(remote_server_name="remote_alias") as ns:
+                pool = ns.get_proxy_pool("SomeCoolObject", size=8)
+                with pool.proxy() as proxy:
+                    proxy.some_cool_method()
+
+        Args:
+            obj (str/Pyro4.core.URI): whatever ``get_remote_object`` takes to
+                identify the object; a URI for DaemonTunnel, or a name for
+                NameServerTunnel.
+            size (int, optional): number of proxies in the pool (4)
+            **kwargs: passed to ``get_remote_object``.
+        Returns:
+            ProxyPool
+        """
+        key = str(obj)
+        if key not in self.proxy_pools:
+            proxy = self.get_remote_object(obj, **kwargs)
+            self.proxy_pools[key] = ProxyPool(
+                proxy._pyroUri, size=size, proxy_class=type(proxy), proxies=[proxy],
+                serializer=proxy._pyroSerializer, logger=logging.getLogger(self.logger.name + ".ProxyPool")
+            )
+        return self.proxy_pools[key]
+
+    def get_command_queue(self, obj, max_size=100, max_delay=0.05, oneway=True, **kwargs):
+        """
+        Get a CommandQueue that coalesces calls to a remote object into
+        Pyro4 batches, flushed when max_size calls are queued or max_delay
+        seconds have passed. The queue gets a proxy of its own.
+
+        Args:
+            obj (str/Pyro4.core.URI): whatever ``get_remote_object`` takes to
+                identify the object.
+            max_size (int, optional): see CommandQueue (100)
+            max_delay (float, optional): see CommandQueue (0.05)
+            oneway (bool, optional): see CommandQueue (True)
+            **kwargs: passed to ``get_remote_object``.
+        Returns:
+            CommandQueue
+        """
+        proxy = self.get_remote_object(obj, **kwargs)
+        queue = CommandQueue(proxy, max_size=max_size, max_delay=max_delay, oneway=oneway,
+                             logger=logging.getLogger(self.logger.name + ".CommandQueue"))
+        self.command_queues.append(queue)
+        return queue
+
+    def cleanup(self, drain_timeout=None):
+        if self.prewarmer is not None:
+            self.prewarmer.stop()
+            self.logger.info("cleanup: prewarm {}".format(self.prewarmer.stats()))
+            self.prewarmer = None
+        for key in list(self.callback_forwards):
+            callbacks.release_forward(self.callback_forwards.pop(key))
+        for queue in self.command_queues:
+            queue.close()
+            queue.proxy._pyroRelease()
+        self.command_queues = []
+        for key in self.proxy_pools:
+            self.proxy_pools[key].close()
+        self.proxy_pools = {}
+        super(Pyro4Tunnel, self).cleanup(drain_timeout=drain_timeout)
 
     def create_tunnel(self, local_port, remote_port, reverse=False):
         """Overridden create tunnel method"""
@@ -62,6 +321,31 @@ class Pyro4Tunnel(SSHTunnelManager):
             self.remote_server_name, self.relay_ip, local_port, remote_port,
             port=self.remote_port, username=self.remote_username,reverse=reverse,**self.create_tunnel_kwargs)
 
+    def create_socket_tunnel(self, uri, remote=None, local_socket=None):
+        """
+        Forward a local Unix domain socket to the daemon that ``uri`` points
+        to. The daemon itself can listen either on a TCP port or, with a
+        ``./u:`` URI, on a Unix domain socket on the remote host.
+
+        Args:
+            uri (Pyro4.core.URI): URI of remote object.
+            remote (int/str, optional): remote port or socket path, if
+                different from the one in ``uri``.
+            local_socket (str, optional): local socket path. Defaults to a
+                path in the temporary directory, unique to this process and
+                the remote daemon.
+        Returns:
+            Pyro4.core.URI: URI of the object through the local socket.
+        """
+        if remote is None:
+            remote = uri.sockname if uri.sockname else uri.port
+        if local_socket is None:
+            digest = hashlib.md5("{}:{}".format(self.remote_server_name, remote).encode("utf-8"))
+            local_socket = os.path.join(tempfile.gettempdir(), "trifeni-{}-{}.sock".format(
+                os.getpid(), digest.hexdigest()[:12]))
+        self.create_tunnel(local_socket, remote)
+        return Pyro4.core.URI("PYRO:{}@./u:{}".format(uri.object, local_socket))
+
 class DaemonTunnel(Pyro4Tunnel):
     """
     Find a daemon on the remote without a nameserver connection.
@@ -75,9 +359,40 @@ class DaemonTunnel(Pyro4Tunnel):
             proxy = dt.get_remote_object(uri)
 
     """
-    def get_remote_object(self, uri, remote_port=None, proxy_class=None):
+    def __init__(self, **kwargs):
+        super(DaemonTunnel, self).__init__(**kwargs)
+        self.start_prewarm()
+
+    def warmable(self, spec):
+        return "uri" in spec
+
+    def warm(self, spec):
+        self._forward(Pyro4.core.URI(spec["uri"]), spec.get("remote_port"), spec.get("local_socket"))
+
+    def _forward(self, uri, remote_port=None, local_socket=None):
+        """
+        Returns:
+            tuple: URI to reach the object through, the object's port or
+                socket path, and the remote one forwarded to.
+        """
+        if uri.sockname or local_socket is not None or is_socket_path(remote_port):
+            obj_port = uri.sockname if uri.sockname else uri.port
+            local_uri = self.create_socket_tunnel(uri, remote=remote_port, local_socket=local_socket)
+            if remote_port is None:
+                remote_port = obj_port
+            return local_uri, obj_port, remote_port
+        obj_host, obj_port = uri.location.split(":")
+        if remote_port is None:
+            remote_port = obj_port
+        self.create_tunnel(int(obj_port), int(remote_port))
+        return uri, obj_port, remote_port
+
+    def get_remote_object(self, uri, remote_port=None, proxy_class=None, local_socket=None,
+                          serializer=None):
         """
         Given some Pyro URI, create connection to a Daemon sitting on a remote server.
+        Daemons listening on a Unix domain socket (``PYRO:obj@./u:/path``) are
+        reached through a local Unix domain socket.
 
         Examples:
 
@@ -93,31 +408,33 @@ class DaemonTunnel(Pyro4Tunnel):
         Args:
             uri (str/Pyro4.core.URI): URI of remote object.
             remote_port (port, optional): The remote daemon might be sitting on a
-                different port than the ``uri`` would have us believe.
+                different port than the ``uri`` would have us believe. This
+                can also be a socket path on the remote.
             proxy_class (object, optional): Proxy class. Defaults to Pyro4.Proxy
+            local_socket (str, optional): Forward from this local Unix domain
+                socket path instead of a local TCP port. This is implied for
+                ``./u:`` URIs, in which case it defaults to a temporary path.
+            serializer (str, optional): Pyro4 serializer for this proxy.
+                Defaults to the tunnel's serializer.
         Returns:
             object: instance of a Proxy class.
         """
-        if proxy_class is None:
-            proxy_class = Pyro4.Proxy
 
         if not self.local:
             uri = Pyro4.core.URI(uri)
-            obj_host, obj_port = uri.location.split(":")
-            if remote_port is None:
-                remote_port = obj_port
-            self.create_tunnel(int(obj_port), int(remote_port))
-            proxy = proxy_class(uri)
-            if hasattr(proxy, "_daemon"): # we need to create reverse tunnel to daemon
-                d_host, d_port = proxy._daemon.locationStr.split(":")
-                self.create_tunnel(int(d_port), int(d_port), reverse=True)
+            spec = {"uri": str(uri), "remote_port": remote_port, "local_socket": local_socket}
+            self.accessed({key: spec[key] for key in spec if spec[key] is not None})
+            uri, obj_port, remote_port = self._forward(uri, remote_port, local_socket)
+            proxy = self.create_proxy(uri, proxy_class, serializer)
+            if hasattr(proxy, "_daemon"): # the remote calls back into this daemon
+                self.forward_callbacks(proxy._daemon)
             if not check_connection(proxy._pyroBind):
                 raise TunnelError(
                     ("Failed to create tunneled connection to object with uri {}, "
                      "forwarding port {} to {}").format(uri, obj_port, remote_port)
                 )
         elif self.local:
-            proxy = proxy_class(uri)
+            proxy = self.create_proxy(uri, proxy_class, serializer)
         return proxy
 
 class NameServerTunnel(Pyro4Tunnel):
@@ -136,16 +453,45 @@ class NameServerTunnel(Pyro4Tunnel):
         ns_host (str): remote Pyro4 nameserver host
         ns_port (int): remote Pyro4 nameserver port
         ns (Pyro4.naming.NameServer): Pyro4 nameserver instance
+        nameserver (SharedNameServer): the shared tunnel and proxy ns comes
+            from, or None if the nameserver isn't shared.
+        uri_cache (dict): object names to the URIs the nameserver gave for
+            them. ``get_remote_object`` looks here before asking the
+            nameserver, and binds proxies to cached URIs, looking the object
+            up again if its daemon can't be reached. Saved and restored along
+            with the tunnels.
     """
     def __init__(self, ns_host="localhost",
                        ns_port=9090,
                        local_ns_port=None,
+                       share_nameserver=True,
                        **kwargs):
-
+        """
+        Args:
+            ns_host (str, optional): remote nameserver host ("localhost")
+            ns_port (int, optional): remote nameserver port (9090)
+            local_ns_port (int, optional): see ``find_nameserver``.
+            share_nameserver (bool, optional): Use the process wide tunnel
+                and proxy to this nameserver (see ``trifeni.nameserver``),
+                so that it's located only once, however many
+                NameServerTunnels there are (True). Otherwise, this instance
+                creates and locates its own.
+            **kwargs: passed to Pyro4Tunnel.
+        """
         super(NameServerTunnel, self).__init__(**kwargs)
+        self.uri_cache = {}
         self.ns_host = ns_host
         self.ns_port = int(ns_port)
-        self.ns = self.find_nameserver(local_ns_port=local_ns_port)
+        self.nameserver = None
+        if share_nameserver:
+            self.nameserver = nameservers.acquire(
+                self.remote_server_name, ns_host=self.ns_host, ns_port=self.ns_port,
+                local_ns_port=local_ns_port, port=self.remote_port, username=self.remote_username,
+                local=self.local, create_tunnel_kwargs=self.create_tunnel_kwargs, backend=self.backend)
+            self.ns = self.nameserver.ns
+        else:
+            self.ns = self.find_nameserver(local_ns_port=local_ns_port)
+        self.start_prewarm()
 
     def __getattr__(self, attr):
         """
@@ -186,10 +532,12 @@ class NameServerTunnel(Pyro4Tunnel):
             local_ns_port = self.ns_port
 
         if not self.local:
-            self.create_tunnel(local_ns_port, self.ns_port,**self.create_tunnel_kwargs)
-            # now we check the connection to see if its running.
-            if check_connection(Pyro4.locateNS, args=(self.ns_host, local_ns_port)):
-                return Pyro4.locateNS(self.ns_host, local_ns_port)
+            self.create_tunnel(local_ns_port, self.ns_port)
+            # now we check the connection to see if its running, keeping the
+            # nameserver the check located.
+            located = []
+            if check_connection(lambda: located.append(Pyro4.locateNS(self.ns_host, local_ns_port))):
+                return located[0]
             else:
                 # Would be cool to add ip address and stuff to error message.
                 exc = TunnelError("Failed to find NameServer on tunnel.")
@@ -198,32 +546,200 @@ class NameServerTunnel(Pyro4Tunnel):
         else:
             return Pyro4.locateNS(self.ns_host, local_ns_port)
 
-    def get_remote_object(self, remote_obj_name, local_obj_port=None, proxy_class=None):
+    def get_remote_object(self, remote_obj_name, local_obj_port=None, proxy_class=None,
+                          local_socket=None, serializer=None):
         """
         Grab an object registered on the remote nameserver.
 
         Args:
             remote_obj_name (str): The name of the Pyro object registered on the
                 nameserver.
+            local_obj_port (int, optional): local forwarding port.
+            proxy_class (object, optional): Proxy class. Defaults to Pyro4.Proxy
+            local_socket (str, optional): Forward from this local Unix domain
+                socket path instead of a local TCP port. This is implied for
+                objects registered with ``./u:`` URIs.
+            serializer (str, optional): Pyro4 serializer for this proxy.
+                Defaults to the tunnel's serializer.
         Returns:
             Pyro4.core.URI: URI corresponding to requested pyro object, or
                 None if connections wasn't successful.
         """
-        if proxy_class is None: proxy_class = Pyro4.core.Proxy
-        obj_uri = self.ns.lookup(remote_obj_name)
+        if not self.local:
+            self.accessed(self._spec(remote_obj_name, local_obj_port, local_socket))
+        cached = remote_obj_name in self.uri_cache
+        proxy = self._proxy_for(self.lookup_uri(remote_obj_name), local_obj_port, local_socket,
+                                proxy_class, serializer)
+        if not cached:
+            return proxy
+        # the daemon behind a cached URI may have moved since: check, and
+        # look the object up again if it's gone.
+        try:
+            proxy._pyroBind()
+            return proxy
+        except Pyro4.errors.CommunicationError as err:
+            self.logger.debug("get_remote_object: cached URI of {} is stale: {}".format(remote_obj_name, err))
+            proxy._pyroRelease()
+        self.invalidate(remote_obj_name)
+        return self._proxy_for(self.lookup_uri(remote_obj_name), local_obj_port, local_socket,
+                               proxy_class, serializer)
+
+    def _proxy_for(self, obj_uri, local_obj_port=None, local_socket=None, proxy_class=None,
+                   serializer=None):
         if self.local:
-            return proxy_class(obj_uri)
+            return self.create_proxy(obj_uri, proxy_class, serializer)
+        return self.create_proxy(self._forward(obj_uri, local_obj_port, local_socket),
+                                 proxy_class, serializer)
+
+    def _spec(self, remote_obj_name, local_obj_port=None, local_socket=None):
+        spec = {"name": remote_obj_name, "ns_port": self.ns_port,
+                "local_obj_port": local_obj_port, "local_socket": local_socket}
+        return {key: spec[key] for key in spec if spec[key] is not None}
+
+    def warmable(self, spec):
+        return "name" in spec and spec.get("ns_port") == self.ns_port
+
+    def warm(self, spec):
+        self._forward(self.lookup_uri(spec["name"]), spec.get("local_obj_port"), spec.get("local_socket"))
+
+    def _forward(self, obj_uri, local_obj_port=None, local_socket=None):
+        """
+        Returns:
+            Pyro4.core.URI: URI to reach the object through.
+        """
+        if obj_uri.sockname or local_socket is not None:
+            return self.create_socket_tunnel(obj_uri, local_socket=local_socket)
+        obj_host, obj_port = obj_uri.location.split(":")
+        if not local_obj_port:
+            local_obj_port = int(obj_port)
+        self.create_tunnel(local_obj_port, int(obj_port))
+        return obj_uri
+
+    def get_remote_objects(self, names=None, prefix=None, regex=None,
+                           metadata_all=None, metadata_any=None,
+                           proxy_class=None, bind=True, max_workers=8, serializer=None):
+        """
+        Grab many objects registered on the remote nameserver at once. The
+        matching URIs come from a single nameserver ``list`` call. URIs are
+        then grouped by daemon, so that each distinct remote daemon is
+        forwarded only once, and tunnels and proxies are created concurrently.
+
+        Examples:
+
+        .. code-block:: python
+
+            with NameServerTunnel(remote_server_name="remote_alias") as ns:
+                devices = ns.get_remote_objects(prefix="DSS43.")
+                for name, proxy in devices.items():
+                    print(name, proxy.status())
+
+        Args:
+            names (list, optional): names of the objects to get. Raises
+                Pyro4.errors.NamingError if any of them are not registered.
+            prefix (str, optional): get objects whose names start with prefix.
+            regex (str, optional): get objects whose names match regex.
+            metadata_all (set, optional): get objects having all of this metadata.
+            metadata_any (set, optional): get objects having any of this metadata.
+            proxy_class (object, optional): Proxy class. Defaults to Pyro4.Proxy
+            bind (bool, optional): Bind each proxy before returning it (True).
+            max_workers (int, optional): maximum number of threads used to
+                create tunnels and bind proxies (8).
+            serializer (str, optional): Pyro4 serializer for the proxies.
+                Defaults to the tunnel's serializer.
+        Returns:
+            dict: object name to proxy.
+        """
+        registered = self.ns.list(prefix=prefix, regex=regex,
+                                  metadata_all=metadata_all, metadata_any=metadata_any)
+        if names is not None:
+            missing = [name for name in names if name not in registered]
+            if missing:
+                raise Pyro4.errors.NamingError("unknown name(s): {}".format(", ".join(missing)))
+            registered = {name: registered[name] for name in names}
+        uris = {name: Pyro4.core.URI(registered[name]) for name in registered}
+        self.uri_cache.update(uris)
+
+        if not self.local:
+            for name in uris:
+                self.accessed(self._spec(name))
+            daemons = {}
+            for name in uris:
+                daemons.setdefault(uris[name].location, []).append(name)
+            self.logger.debug("get_remote_objects: {} object(s) on {} daemon(s)".format(
+                len(uris), len(daemons)))
+
+            def forward(location):
+                group = daemons[location]
+                uri = uris[group[0]]
+                if uri.sockname:
+                    local_uri = self.create_socket_tunnel(uri)
+                    for name in group:
+                        uris[name] = Pyro4.core.URI("PYRO:{}@{}".format(
+                            uris[name].object, local_uri.location))
+                else:
+                    self.create_tunnel(uri.port, uri.port)
+
+            thread_map(forward, list(daemons), max_workers=max_workers)
+
+        def create_proxy(name):
+            proxy = self.create_proxy(uris[name], proxy_class, serializer)
+            if bind and not check_connection(proxy._pyroBind):
+                raise TunnelError(
+                    "Failed to create tunneled connection to object {} with uri {}".format(name, uris[name])
+                )
+            return proxy
+
+        names = sorted(uris)
+        proxies = thread_map(create_proxy, names, max_workers=max_workers)
+        return dict(zip(names, proxies))
+
+    def lookup_uri(self, remote_obj_name):
+        """
+        Get the URI of an object, from uri_cache if it's there, or from the
+        nameserver.
+
+        Args:
+            remote_obj_name (str): The name of the Pyro object registered on the
+                nameserver.
+        Returns:
+            Pyro4.core.URI
+        """
+        if remote_obj_name not in self.uri_cache:
+            self.uri_cache[remote_obj_name] = self.ns.lookup(remote_obj_name)
+        return self.uri_cache[remote_obj_name]
+
+    def invalidate(self, remote_obj_name=None):
+        """
+        Forget the cached URI of an object, for instance after its daemon has
+        moved, or of every object if remote_obj_name is None.
+        """
+        if remote_obj_name is None:
+            self.uri_cache = {}
         else:
-            obj_host, obj_port = obj_uri.location.split(":")
-            if not local_obj_port:
-                local_obj_port = int(obj_port)
-            self.create_tunnel(local_obj_port, int(obj_port), **self.create_tunnel_kwargs)
-            return proxy_class(obj_uri)
+            self.uri_cache.pop(remote_obj_name, None)
 
-    def cleanup(self):
-        if self.ns is not None:
+    def state(self):
+        state = super(NameServerTunnel, self).state()
+        state["uri_cache"] = {name: str(self.uri_cache[name]) for name in self.uri_cache}
+        return state
+
+    def set_state(self, state, max_workers=8):
+        """
+        Recreate tunnels, and fill uri_cache with the URIs in state, so that
+        the objects can be found without asking the nameserver.
+        """
+        self.uri_cache.update({name: Pyro4.core.URI(uri)
+                               for name, uri in state.get("uri_cache", {}).items()})
+        return super(NameServerTunnel, self).set_state(state, max_workers=max_workers)
+
+    def cleanup(self, drain_timeout=None):
+        if self.nameserver is not None:
+            nameservers.release(self.nameserver)
+            self.nameserver = None
+        elif self.ns is not None:
             self.ns._pyroRelease()
-        super(NameServerTunnel, self).cleanup()
+        self.ns = None
+        super(NameServerTunnel, self).cleanup(drain_timeout=drain_timeout)
 
 if __name__ == '__main__':
     pass
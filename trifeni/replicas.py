@@ -0,0 +1,380 @@
+"""
+Objects replicated on several hosts, each with its own nameserver, reached
+through tunnels to all of them.
+"""
+import logging
+import threading
+import time
+
+import Pyro4
+
+from .pyro4tunnel import NameServerTunnel
+from .util import thread_map, free_port, metrics
+from .errors import TunnelError
+
+__all__ = ["Replica", "ReplicaSet", "FailoverProxy"]
+
+module_logger = logging.getLogger(__name__)
+
+class Replica(object):
+    """
+    One of the hosts of a ReplicaSet, its NameServerTunnel, and what's known
+    about its health.
+
+    Attributes:
+        name (str): name of the replica in the set.
+        tunnel_kwargs (dict): keyword arguments for NameServerTunnel.
+        tunnel (NameServerTunnel): tunnel to the replica's nameserver, or
+            None if it couldn't be created.
+        latency (float): smoothed nameserver round trip, in seconds, or None
+            if the replica hasn't answered yet.
+        healthy (bool): whether the last probe or call succeeded.
+        failures (int): number of failed probes or calls.
+        error (Exception): last error.
+        timeout (float): Pyro4 timeout for the nameserver proxy, so that a
+            dead host can't hang a probe.
+        call_timeout (float): Pyro4 timeout for object proxies, so that a
+            call to a dead host fails, and can fail over, instead of hanging.
+            None for no timeout.
+        lock (threading.Lock): serializes use of the nameserver proxy, which
+            the probe thread shares with callers.
+    """
+    def __init__(self, name, tunnel_kwargs, timeout=None, call_timeout=None):
+        self.name = name
+        self.tunnel_kwargs = tunnel_kwargs
+        self.timeout = timeout
+        self.call_timeout = call_timeout
+        self.tunnel = None
+        self.latency = None
+        self.healthy = False
+        self.failures = 0
+        self.error = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """Create the tunnel to the replica's nameserver, replacing any old one."""
+        self.close()
+        tunnel_kwargs = dict(self.tunnel_kwargs)
+        # the replica reconnects its own nameserver when it stops answering,
+        # and sets a timeout on it, so it doesn't use the shared one.
+        tunnel_kwargs.setdefault("share_nameserver", False)
+        try:
+            self.tunnel = NameServerTunnel(**tunnel_kwargs)
+        except Exception as err:
+            self.tunnel = None
+            self.failed(err)
+            return False
+        if self.timeout is not None:
+            self.tunnel.ns._pyroTimeout = self.timeout
+        return True
+
+    def ping(self):
+        """
+        Time a round trip to the replica's nameserver.
+
+        Returns:
+            float: seconds
+        """
+        if self.tunnel is None:
+            raise TunnelError("Replica {} isn't connected".format(self.name))
+        with self.lock:
+            t0 = time.time()
+            self.tunnel.ns.ping()
+            return time.time() - t0
+
+    def lookup(self, remote_obj_name):
+        """
+        Get the URI of remote_obj_name from the replica's nameserver.
+
+        Returns:
+            Pyro4.core.URI
+        """
+        if self.tunnel is None:
+            raise TunnelError("Replica {} isn't connected".format(self.name))
+        with self.lock:
+            return self.tunnel.lookup_uri(remote_obj_name)
+
+    def get_proxy(self, remote_obj_name, proxy_class=None, serializer=None):
+        """
+        Create and bind a proxy to remote_obj_name on this replica. The
+        replicas' daemons usually listen on the same ports, so they are
+        forwarded through Unix domain sockets, whose paths are unique to each
+        host.
+
+        Returns:
+            object: instance of a Proxy class.
+        """
+        uri = self.lookup(remote_obj_name)
+        if not self.tunnel.local:
+            uri = self.tunnel.create_socket_tunnel(uri)
+        proxy = self.tunnel.create_proxy(uri, proxy_class, serializer)
+        if self.call_timeout is not None:
+            proxy._pyroTimeout = self.call_timeout
+        try:
+            proxy._pyroBind()
+        except Exception:
+            proxy._pyroRelease()
+            self.tunnel.invalidate(remote_obj_name)
+            raise
+        return proxy
+
+    def succeeded(self, latency, smoothing):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = smoothing*latency + (1.0 - smoothing)*self.latency
+        self.healthy = True
+        self.error = None
+
+    def failed(self, err):
+        self.healthy = False
+        self.failures += 1
+        self.error = err
+
+    def close(self):
+        if self.tunnel is not None:
+            try:
+                self.tunnel.cleanup()
+            except Exception as err:
+                module_logger.debug("Replica.close: {}: {}".format(self.name, err))
+            self.tunnel = None
+
+    def status(self):
+        """
+        Returns:
+            dict: latency, health, failures and last error.
+        """
+        return {"latency": self.latency, "healthy": self.healthy, "failures": self.failures,
+                "error": None if self.error is None else repr(self.error)}
+
+class ReplicaSet(object):
+    """
+    Resolve names across several tunneled nameservers, one per host running
+    a replica of the same services. Nameserver round trips are timed for
+    each replica, new proxies go to the fastest healthy replica that has the
+    object registered, and replicas whose tunnel, nameserver or daemon stops
+    answering are skipped until a probe finds them healthy again.
+
+    Examples:
+
+    .. code-block:: python
+
+        replicas = {"archive1": {"remote_server_name": "archive1"},
+                    "archive2": {"remote_server_name": "archive2"}}
+        with ReplicaSet(replicas, probe_interval=5.0) as archives:
+            archive = archives.get_remote_object("DataArchive")
+            archive.fetch("2019-03-01") # goes to archive2 if archive1 dies
+
+    Attributes:
+        replicas (dict): Replica instances, by name.
+        smoothing (float): weight of the latest round trip in the smoothed
+            latency.
+        probe_interval (float): seconds between background probes, or None
+            if replicas are only probed by ``probe``.
+        logger (logging.getLogger): logging instance
+    """
+    def __init__(self, replicas, probe_interval=None, probe_timeout=5.0, call_timeout=60.0,
+                 smoothing=0.3, max_workers=8, logger=None, **kwargs):
+        """
+        Args:
+            replicas (dict/list): NameServerTunnel keyword arguments for each
+                replica, by replica name, or a list of ``remote_server_name``
+                aliases.
+            probe_interval (float, optional): probe replicas in the background
+                this often, reconnecting unhealthy ones. Off by default.
+            probe_timeout (float, optional): seconds to wait for a
+                nameserver to answer (5.0)
+            call_timeout (float, optional): seconds to wait for a call on an
+                object proxy before it fails, and a FailoverProxy moves to
+                another replica (60.0). None to wait as long as calls take.
+            smoothing (float, optional): weight of the latest round trip in
+                the smoothed latency (0.3)
+            max_workers (int, optional): maximum number of threads used to
+                connect and probe replicas (8)
+            logger (logging.getLogger, optional): logging instance.
+            **kwargs: NameServerTunnel keyword arguments common to every
+                replica.
+        """
+        if logger is None: logger = logging.getLogger(module_logger.name+".ReplicaSet")
+        self.logger = logger
+        if not isinstance(replicas, dict):
+            replicas = {alias: {"remote_server_name": alias} for alias in replicas}
+        self.smoothing = smoothing
+        self.probe_interval = probe_interval
+        self.max_workers = max_workers
+        self.replicas = {}
+        for name in replicas:
+            tunnel_kwargs = dict(kwargs)
+            tunnel_kwargs.update(replicas[name])
+            if len(replicas) > 1 and not tunnel_kwargs.get("local", False):
+                # every replica's nameserver is likely on the same port.
+                tunnel_kwargs.setdefault("local_ns_port", free_port())
+            self.replicas[name] = Replica(name, tunnel_kwargs, timeout=probe_timeout,
+                                          call_timeout=call_timeout)
+
+        self._closed = threading.Event()
+        thread_map(lambda replica: replica.connect(), list(self.replicas.values()),
+                   max_workers=self.max_workers)
+        self.probe()
+        self._monitor_thread = None
+        if probe_interval is not None:
+            self._monitor_thread = threading.Thread(target=self._monitor_loop)
+            self._monitor_thread.daemon = True
+            self._monitor_thread.start()
+
+    def probe(self, reconnect=False):
+        """
+        Time a nameserver round trip on every replica, updating latency and
+        health.
+
+        Args:
+            reconnect (bool, optional): recreate the tunnels of replicas
+                whose nameserver doesn't answer, and probe them again.
+        Returns:
+            dict: status of each replica.
+        """
+        def probe_one(replica):
+            try:
+                replica.succeeded(replica.ping(), self.smoothing)
+                return
+            except Exception as err:
+                self.logger.debug("probe: {} failed: {}".format(replica.name, err))
+                replica.failed(err)
+            if reconnect:
+                self.logger.debug("probe: reconnecting {}".format(replica.name))
+                if replica.connect():
+                    try:
+                        replica.succeeded(replica.ping(), self.smoothing)
+                    except Exception as err:
+                        replica.failed(err)
+
+        thread_map(probe_one, list(self.replicas.values()), max_workers=self.max_workers)
+        return self.status()
+
+    def _monitor_loop(self):
+        while not self._closed.wait(self.probe_interval):
+            self.probe(reconnect=True)
+
+    def ranked(self):
+        """
+        Returns:
+            list: healthy replicas, fastest first.
+        """
+        healthy = [replica for replica in self.replicas.values() if replica.healthy]
+        return sorted(healthy, key=lambda replica: replica.latency)
+
+    def mark_failed(self, replica, err):
+        """
+        Take replica out of rotation until it's found healthy again.
+        """
+        self.logger.info("mark_failed: replica {} failed: {}".format(replica.name, err))
+        replica.failed(err)
+        metrics.increment("replicas.failures")
+
+    def select(self, remote_obj_name, proxy_class=None, serializer=None):
+        """
+        Get a bound proxy to remote_obj_name from the fastest healthy replica
+        that has it. Replicas that fail on the way are marked as failed.
+
+        Returns:
+            tuple: Replica and proxy
+        """
+        for replica in self.ranked():
+            try:
+                return replica, replica.get_proxy(remote_obj_name, proxy_class, serializer)
+            except Pyro4.errors.NamingError as err:
+                self.logger.debug("select: {} isn't registered on {}: {}".format(
+                    remote_obj_name, replica.name, err))
+            except Exception as err:
+                self.mark_failed(replica, err)
+        raise TunnelError("No healthy replica has {} ({})".format(
+            remote_obj_name, ", ".join(sorted(self.replicas))))
+
+    def get_remote_object(self, remote_obj_name, proxy_class=None, serializer=None, failover=True):
+        """
+        Get a proxy to remote_obj_name on the fastest healthy replica.
+
+        Args:
+            remote_obj_name (str): name registered on the replicas' nameservers.
+            proxy_class (object, optional): Proxy class. Defaults to Pyro4.Proxy
+            serializer (str, optional): Pyro4 serializer for this proxy.
+            failover (bool, optional): Return a FailoverProxy, which moves to
+                another replica when this one fails (True). Otherwise return
+                the plain proxy.
+        Returns:
+            FailoverProxy or proxy
+        """
+        replica, proxy = self.select(remote_obj_name, proxy_class, serializer)
+        self.logger.debug("get_remote_object: {} on {}".format(remote_obj_name, replica.name))
+        if not failover:
+            return proxy
+        return FailoverProxy(self, remote_obj_name, replica, proxy, proxy_class, serializer)
+
+    def status(self):
+        """
+        Returns:
+            dict: status of each replica, by name.
+        """
+        return {name: self.replicas[name].status() for name in self.replicas}
+
+    def cleanup(self):
+        """Stop probing, and close every replica's tunnels."""
+        self._closed.set()
+        if self._monitor_thread is not None:
+            self._monitor_thread.join()
+        for replica in self.replicas.values():
+            replica.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
+
+class FailoverProxy(object):
+    """
+    Proxy to an object of a ReplicaSet. When a call fails with a Pyro4
+    CommunicationError, the replica is marked as failed, and the call is
+    made again on the fastest healthy replica left. A call that failed may
+    still have run on the old replica, so only use this for calls that are
+    safe to repeat.
+
+    Like Pyro4 proxies, a FailoverProxy shouldn't be shared between threads.
+
+    Attributes:
+        replica (Replica): replica currently in use.
+        proxy (Pyro4.Proxy): proxy to the object on replica.
+    """
+    def __init__(self, replica_set, remote_obj_name, replica, proxy,
+                 proxy_class=None, serializer=None):
+        self._replica_set = replica_set
+        self._remote_obj_name = remote_obj_name
+        self._proxy_class = proxy_class
+        self._serializer = serializer
+        self.replica = replica
+        self.proxy = proxy
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            return getattr(self.proxy, attr)
+
+        def call(*args, **kwargs):
+            while True:
+                try:
+                    return getattr(self.proxy, attr)(*args, **kwargs)
+                except Pyro4.errors.CommunicationError as err:
+                    self._replica_set.mark_failed(self.replica, err)
+                    self.proxy._pyroRelease()
+                    self.replica, self.proxy = self._replica_set.select(
+                        self._remote_obj_name, self._proxy_class, self._serializer)
+                    metrics.increment("replicas.failovers")
+        return call
+
+    def _pyroRelease(self):
+        self.proxy._pyroRelease()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._pyroRelease()
@@ -1,2 +1,15 @@
 from .tunnel_util import *
 from .shell_util import *
+from .transport_pool import *
+from .transport_options import *
+from .socket_options import *
+from .streamlocal import *
+from .openssh_tunnel import *
+from .thread_util import *
+from .port_util import *
+from .metrics import *
+from .tracing import *
+from .framing import *
+from .link_emulator import *
+from .scheduling import *
+from .admission import *
@@ -0,0 +1,154 @@
+import contextlib
+import errno
+import logging
+import random
+import socket
+import threading
+import time
+
+import paramiko
+
+from .metrics import metrics
+from .tracing import tracer
+
+__all__ = [
+    "HandshakeLimiter"
+]
+
+module_logger = logging.getLogger(__name__)
+
+class HandshakeLimiter(object):
+    """
+    Admission control for SSH handshakes to one host. sshd drops connections
+    beyond ``MaxStartups`` unauthenticated ones (10 by default), so when many
+    tunnels start at once, handshakes past ``limit`` queue here instead, and
+    a handshake the server drops or refuses is retried after an
+    exponential, jittered backoff. Other failures, like authentication,
+    host keys or an unknown host, are never retried.
+
+    Limiters are shared per host through ``for_host``; change a host's
+    limit on its instance:
+
+    .. code-block:: python
+
+        HandshakeLimiter.for_host(("10.0.0.5", 22)).limit = 4
+
+    Queue waits are recorded in ``trifeni.util.metrics`` as
+    ``handshake.queue_seconds``, and retries as ``handshake.retries``.
+
+    Attributes:
+        host (tuple): address and port of the SSH server.
+        limit (int): handshakes in progress at the same time, or None for
+            no limit. Defaults to ``default_limit``.
+        retries (int): retries of a dropped or refused handshake.
+        backoff (float): seconds before the first retry. Each retry waits
+            twice as long as the last, up to ``max_backoff``, and a random
+            part of that.
+        max_backoff (float): longest wait before a retry, in seconds.
+        in_progress (int): handshakes in progress.
+        waiting (int): handshakes queued.
+        logger (logging.getLogger): logging instance
+    """
+    default_limit = 8
+    _hosts = {}
+    _hosts_lock = threading.Lock()
+
+    def __init__(self, host=None, limit=None, retries=5, backoff=0.25, max_backoff=5.0, logger=None):
+        if logger is None: logger = logging.getLogger(module_logger.name+".HandshakeLimiter")
+        self.logger = logger
+        self.host = host
+        self.limit = limit if limit is not None else self.default_limit
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.in_progress = 0
+        self.waiting = 0
+        self._changed = threading.Condition()
+        self._random = random.Random()
+
+    @classmethod
+    def for_host(cls, host):
+        """
+        Args:
+            host (tuple): address and port of the SSH server.
+        Returns:
+            HandshakeLimiter: the limiter of host's handshakes.
+        """
+        with cls._hosts_lock:
+            if host not in cls._hosts:
+                cls._hosts[host] = cls(host)
+            return cls._hosts[host]
+
+    @contextlib.contextmanager
+    def admit(self):
+        """
+        Wait for a free handshake slot, and hold it for the with block.
+        Yields the seconds spent waiting.
+        """
+        start = time.time()
+        with self._changed:
+            self.waiting += 1
+            try:
+                while self.limit is not None and self.in_progress >= self.limit:
+                    self._changed.wait()
+            finally:
+                self.waiting -= 1
+            self.in_progress += 1
+        waited = time.time() - start
+        metrics.observe("handshake.queue_seconds", waited)
+        if tracer.enabled:
+            tracer.emit("handshake.queue", start=start, host=self.host)
+        try:
+            yield waited
+        finally:
+            with self._changed:
+                self.in_progress -= 1
+                self._changed.notify()
+
+    def retryable(self, err):
+        """
+        Only a refused or reset connection, one closed before or during the
+        handshake, and a banner that never came are what a busy sshd does.
+        Anything else, like an unknown host, no route to it, a missing key
+        file or no algorithms in common, won't go away by retrying.
+
+        Returns:
+            bool: whether err looks like the server dropped or refused the
+                connection.
+        """
+        if isinstance(err, paramiko.ssh_exception.NoValidConnectionsError):
+            # one error for each address the host resolved to
+            return all(self.retryable(error) for error in err.errors.values())
+        if isinstance(err, EOFError):
+            return True
+        if isinstance(err, paramiko.SSHException):
+            return "protocol banner" in str(err)
+        if isinstance(err, socket.error) and not isinstance(err, socket.gaierror):
+            return err.errno in (errno.ECONNREFUSED, errno.ECONNRESET)
+        return False
+
+    def run(self, handshake):
+        """
+        Call handshake in a slot, retrying it after a backoff if the server
+        drops or refuses it. The slot is given up while backing off.
+
+        Args:
+            handshake (callable): opens a connection, raising if it fails.
+        Returns:
+            whatever handshake returns.
+        """
+        attempt = 0
+        while True:
+            with self.admit():
+                try:
+                    return handshake()
+                except Exception as err:
+                    if attempt >= self.retries or not self.retryable(err):
+                        raise
+                    error = err
+            delay = min(self.max_backoff, self.backoff * 2**attempt) * self._random.uniform(0.5, 1.0)
+            attempt += 1
+            metrics.increment("handshake.retries")
+            self.logger.debug("run: handshake to {} failed ({}), retry {} in {:.2f} seconds".format(
+                self.host, error, attempt, delay))
+            time.sleep(delay)
@@ -0,0 +1,93 @@
+import logging
+import struct
+
+import Pyro4.message
+
+__all__ = [
+    "PyroFramer"
+]
+
+module_logger = logging.getLogger(__name__)
+
+class PyroFramer(object):
+    """
+    Follow the Pyro4 messages going one way through a relayed connection,
+    from their headers alone: each header gives the length of the
+    annotations and data after it. This tells the relays whether a
+    message is still partway through, and how many calls are still owed a
+    response, however long the gaps inside a message are.
+
+    A stream that doesn't start with a Pyro4 header, or loses track of
+    them, is marked not ``valid``, and its relay falls back to judging by
+    how long the connection has been quiet.
+
+    Examples:
+
+    .. code-block:: python
+
+        requests, responses = PyroFramer(), PyroFramer()
+        requests.feed(request_data)
+        responses.feed(response_data)
+        done = requests.valid and responses.valid and not requests.partial \
+            and not responses.partial and requests.replies_due <= responses.messages
+
+    Attributes:
+        valid (bool): whether the stream looked like Pyro4 messages so far.
+        messages (int): complete messages seen.
+        replies_due (int): complete messages seen that expect a response,
+            that is, every message but oneway calls.
+    """
+    header_format = Pyro4.message.Message.header_format
+    header_size = Pyro4.message.Message.header_size
+
+    def __init__(self):
+        self.valid = True
+        self.messages = 0
+        self.replies_due = 0
+        self._header = b""
+        self._remaining = 0
+        self._oneway = False
+
+    @property
+    def partial(self):
+        """bool: whether the stream stopped partway through a message."""
+        return len(self._header) > 0 or self._remaining > 0
+
+    def feed(self, data):
+        """
+        Follow the messages in the next chunk of the stream.
+
+        Args:
+            data (bytes): data relayed.
+        Returns:
+            int: number of messages completed by data that expect a response.
+        """
+        if not self.valid:
+            return 0
+        replies_due = 0
+        pos, size = 0, len(data)
+        while pos < size:
+            if self._remaining > 0:
+                taken = min(self._remaining, size - pos)
+                self._remaining -= taken
+                pos += taken
+            else:
+                needed = self.header_size - len(self._header)
+                self._header += data[pos:pos + needed]
+                pos += needed
+                if len(self._header) < self.header_size:
+                    break
+                fields = struct.unpack(self.header_format, self._header)
+                self._header = b""
+                if fields[0] != b"PYRO":
+                    self.valid = False
+                    return replies_due
+                flags, data_size, annotations_size = fields[3], fields[5], fields[7]
+                self._remaining = data_size + annotations_size
+                self._oneway = bool(flags & Pyro4.message.FLAGS_ONEWAY)
+            if self._remaining == 0:
+                self.messages += 1
+                if not self._oneway:
+                    self.replies_due += 1
+                    replies_due += 1
+        return replies_due
@@ -0,0 +1,349 @@
+import collections
+import contextlib
+import logging
+import random
+import socket
+import threading
+import time
+
+__all__ = [
+    "LinkProfile",
+    "DelayedSender",
+    "LinkEmulator",
+    "LinkProxy",
+    "link_emulator"
+]
+
+module_logger = logging.getLogger(__name__)
+
+class LinkProfile(object):
+    """
+    Conditions of an emulated network link, for tests and benchmarks.
+
+    Examples:
+
+    .. code-block:: python
+
+        profile = LinkProfile.create("station")
+        profile = LinkProfile.create({"latency": 0.15, "bandwidth": 2**18})
+
+    Attributes:
+        latency (float): round trip time added to the link, in seconds. Each
+            direction gets half of it.
+        jitter (float): standard deviation of the extra one way delay, in
+            seconds. Data is never reordered.
+        bandwidth (float): bytes per second in each direction, or None for
+            no cap.
+        stall_rate (float): probability that the link stalls before a chunk
+            of data, like a lost packet waiting to be retransmitted.
+        stall_duration (float): length of a stall, in seconds.
+    """
+    __slots__ = ("latency", "jitter", "bandwidth", "stall_rate", "stall_duration")
+
+    profiles = {
+        "lan": {"latency": 0.001},
+        "wan": {"latency": 0.05, "jitter": 0.005, "bandwidth": 2**22},
+        "station": {"latency": 0.15, "jitter": 0.01, "bandwidth": 2**18},
+        "lossy-station": {"latency": 0.15, "jitter": 0.02, "bandwidth": 2**18,
+                          "stall_rate": 0.01, "stall_duration": 0.5}
+    }
+
+    def __init__(self, latency=0.0, jitter=0.0, bandwidth=None, stall_rate=0.0, stall_duration=0.2):
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.bandwidth = None if bandwidth is None else float(bandwidth)
+        self.stall_rate = float(stall_rate)
+        self.stall_duration = float(stall_duration)
+
+    @classmethod
+    def profile(cls, name):
+        """
+        Get one of the named profiles in ``profiles``.
+
+        Args:
+            name (str): "lan", "wan", "station" or "lossy-station"
+        Returns:
+            LinkProfile
+        """
+        if name not in cls.profiles:
+            raise ValueError("Unknown link profile {}. Choose from {}".format(
+                name, sorted(cls.profiles)))
+        return cls(**cls.profiles[name])
+
+    @classmethod
+    def create(cls, options):
+        """
+        Coerce options into LinkProfile.
+
+        Args:
+            options (LinkProfile/dict/str): Either an existing instance,
+                keyword arguments for __init__, or a profile name.
+        Returns:
+            LinkProfile
+        """
+        if isinstance(options, cls):
+            return options
+        elif isinstance(options, dict):
+            return cls(**options)
+        else:
+            return cls.profile(options)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "LinkProfile({})".format(", ".join(
+            "{}={!r}".format(name, value) for name, value in sorted(self.as_dict().items())))
+
+class DelayedSender(object):
+    """
+    Stand in for a socket or channel's ``sendall`` that delivers data after the
+    profile's one way delay, no faster than its bandwidth, and in order.
+    Delivery happens on a thread of its own, so that the link stays
+    pipelined: a chunk sent while another is in flight isn't held up by the
+    other's delay, only by the bandwidth.
+
+    Attributes:
+        profile (LinkProfile): link conditions.
+        max_buffered (int): ``__call__`` blocks while this many bytes are
+            waiting to be delivered.
+        error (Exception): error raised by the underlying send, if any. Once
+            set, ``__call__`` raises it.
+    """
+    def __init__(self, send, profile, rng=None, max_buffered=2**20):
+        self.profile = profile
+        self.max_buffered = max_buffered
+        self.error = None
+        self._send = send
+        self._random = rng if rng is not None else random.Random()
+        self._pending = collections.deque()
+        self._buffered = 0
+        self._link_free = 0.0
+        self._last_delivery = 0.0
+        self._closed = False
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._deliver_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _delivery_time(self, nbytes):
+        profile = self.profile
+        now = time.time()
+        start = max(now, self._link_free)
+        if profile.stall_rate and self._random.random() < profile.stall_rate:
+            start += profile.stall_duration
+        if profile.bandwidth:
+            start += nbytes / profile.bandwidth
+        self._link_free = start
+        delay = profile.latency / 2.0
+        if profile.jitter:
+            delay += abs(self._random.gauss(0.0, profile.jitter))
+        self._last_delivery = max(start + delay, self._last_delivery)
+        return self._last_delivery
+
+    def __call__(self, data):
+        with self._changed:
+            while self._buffered >= self.max_buffered and self.error is None:
+                self._changed.wait()
+            if self.error is not None:
+                raise self.error
+            self._pending.append((self._delivery_time(len(data)), data))
+            self._buffered += len(data)
+            self._changed.notify_all()
+        return len(data)
+
+    def _deliver_loop(self):
+        while True:
+            with self._changed:
+                while not self._pending and not self._closed:
+                    self._changed.wait()
+                if not self._pending:
+                    return
+                deliver_at, data = self._pending[0]
+            nbytes = len(data)
+            wait = deliver_at - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self._send(data)
+            except Exception as err:
+                with self._changed:
+                    self.error = err
+                    self._pending.clear()
+                    self._changed.notify_all()
+                return
+            with self._changed:
+                self._pending.popleft()
+                self._buffered -= nbytes
+                self._changed.notify_all()
+
+    def close(self, timeout=None):
+        """
+        Deliver whatever is pending, and stop the delivery thread.
+
+        Args:
+            timeout (float, optional): seconds to wait for pending data.
+        """
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        self._thread.join(timeout)
+
+class LinkEmulator(object):
+    """
+    Emulate a slow link in the relay paths of forward and reverse tunnels,
+    for tests and benchmarks. When no profile is set, which is the default,
+    relays send directly, as they normally do.
+
+    Examples:
+
+    .. code-block:: python
+
+        from trifeni.util import link_emulator
+
+        with link_emulator.emulate("station", seed=1):
+            proxy = dt.get_remote_object(uri)
+            proxy.fetch_block()
+
+    Attributes:
+        profile (LinkProfile): link conditions, or None if emulation is off.
+        seed (int): seed for the random number generators of jitter and
+            stalls.
+    """
+    def __init__(self):
+        self.profile = None
+        self.seed = None
+        self._count = 0
+
+    @property
+    def enabled(self):
+        return self.profile is not None
+
+    def configure(self, profile=None, seed=None, **kwargs):
+        """
+        Turn emulation on.
+
+        Args:
+            profile (LinkProfile/dict/str, optional): link conditions, or the
+                name of a LinkProfile profile.
+            seed (int, optional): seed for jitter and stalls.
+            **kwargs: LinkProfile attributes, overriding those of profile.
+        """
+        options = LinkProfile.create(profile if profile is not None else {}).as_dict()
+        options.update(kwargs)
+        self.profile = LinkProfile(**options)
+        self.seed = seed
+        module_logger.debug("configure: {}".format(self.profile))
+
+    def reset(self):
+        """Turn emulation off."""
+        self.profile = None
+
+    @contextlib.contextmanager
+    def emulate(self, profile=None, seed=None, **kwargs):
+        """Emulate the link for the duration of a with block."""
+        self.configure(profile, seed=seed, **kwargs)
+        try:
+            yield self.profile
+        finally:
+            self.reset()
+
+    def wrap(self, send):
+        """
+        Args:
+            send (callable): a socket or channel's sendall method.
+        Returns:
+            callable: a DelayedSender for send, or send itself if emulation
+                is off.
+        """
+        profile = self.profile
+        if profile is None:
+            return send
+        rng = None
+        if self.seed is not None:
+            self._count += 1
+            rng = random.Random(self.seed + self._count)
+        return DelayedSender(send, profile, rng=rng)
+
+    def flush(self, *senders):
+        """Deliver what's pending on senders returned by ``wrap``."""
+        for send in senders:
+            if isinstance(send, DelayedSender):
+                send.close()
+
+class LinkProxy(object):
+    """
+    TCP proxy that puts an emulated link in front of a server, for instance
+    a test SSH server, so that everything going to it, including the SSH
+    handshake, sees the link's conditions.
+
+    Attributes:
+        target (tuple): address connections are forwarded to.
+        profile (LinkProfile): link conditions.
+        port (int): port the proxy listens on, on 127.0.0.1.
+    """
+    def __init__(self, target, profile, port=0, seed=None):
+        self.target = target
+        self.profile = LinkProfile.create(profile)
+        self._emulator = LinkEmulator()
+        self._emulator.configure(self.profile, seed=seed)
+        self._listener = socket.socket()
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(("127.0.0.1", port))
+        self._listener.listen(64)
+        self.port = self._listener.getsockname()[1]
+        self._closed = threading.Event()
+        self._spawn(self._accept_loop)
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def _accept_loop(self):
+        while not self._closed.is_set():
+            try:
+                client, address = self._listener.accept()
+            except socket.error:
+                return
+            try:
+                server = socket.create_connection(self.target)
+            except socket.error as err:
+                module_logger.debug("LinkProxy._accept_loop: {}: {}".format(self.target, err))
+                client.close()
+                continue
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._spawn(self._pump, client, server)
+            self._spawn(self._pump, server, client)
+
+    def _pump(self, source, destination):
+        send = self._emulator.wrap(destination.sendall)
+        try:
+            while True:
+                data = source.recv(16384)
+                if len(data) == 0:
+                    break
+                send(data)
+        except socket.error:
+            pass
+        finally:
+            self._emulator.flush(send)
+            for sock in (source, destination):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+    def close(self):
+        """Stop accepting connections."""
+        self._closed.set()
+        self._listener.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+link_emulator = LinkEmulator()
@@ -0,0 +1,152 @@
+import contextlib
+import logging
+import threading
+import time
+
+__all__ = [
+    "Metrics",
+    "TunnelStats",
+    "metrics"
+]
+
+module_logger = logging.getLogger(__name__)
+
+class Metrics(object):
+    """
+    Thread safe registry of counters, gauges and timings. trifeni records
+    into the module level ``metrics`` instance; read it with ``snapshot``.
+
+    Examples:
+
+    .. code-block:: python
+
+        from trifeni.util import metrics
+
+        metrics.increment("drain.forced")
+        with metrics.timer("drain.seconds"):
+            ...
+        metrics.snapshot()["counters"]["drain.forced"]
+
+    Attributes:
+        counters (dict): name to count.
+        gauges (dict): name to last value.
+        timings (dict): name to a dict with the count, total, min and max of
+            the observed values.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timings = {}
+
+    def increment(self, name, value=1):
+        """Add value to counter name."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        """Set gauge name to value."""
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        """Record value, for instance a duration in seconds, under name."""
+        with self._lock:
+            stats = self.timings.get(name)
+            if stats is None:
+                self.timings[name] = {"count": 1, "total": value, "min": value, "max": value}
+            else:
+                stats["count"] += 1
+                stats["total"] += value
+                stats["min"] = min(stats["min"], value)
+                stats["max"] = max(stats["max"], value)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Observe the time spent in a with block under name."""
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - t0)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: copies of counters, gauges and timings.
+        """
+        with self._lock:
+            return {"counters": dict(self.counters),
+                    "gauges": dict(self.gauges),
+                    "timings": {name: dict(self.timings[name]) for name in self.timings}}
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self.counters = {}
+            self.gauges = {}
+            self.timings = {}
+
+class TunnelStats(object):
+    """
+    Thread safe traffic counters of a single tunnel, updated by its relays.
+    Take the difference of two snapshots for rates.
+
+    Attributes:
+        connections (int): connections being relayed.
+        connections_total (int): connections relayed so far.
+        bytes_out (int): bytes sent to the far end.
+        bytes_in (int): bytes received from the far end.
+        errors (int): connections that failed before being relayed.
+        connect_seconds (float): total time spent opening channels (forward
+            tunnels) or connecting to the target (reverse tunnels).
+        connects (int): number of timed channel opens or connects.
+        last_activity (float): time data last moved, or None.
+    """
+    __slots__ = ("_lock", "connections", "connections_total", "bytes_out", "bytes_in",
+                 "errors", "connect_seconds", "connects", "last_activity")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.connections_total = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.errors = 0
+        self.connect_seconds = 0.0
+        self.connects = 0
+        self.last_activity = None
+
+    def opened(self, seconds):
+        """Record a connection whose channel or target took seconds to open."""
+        with self._lock:
+            self.connections += 1
+            self.connections_total += 1
+            self.connect_seconds += seconds
+            self.connects += 1
+
+    def closed(self):
+        with self._lock:
+            self.connections -= 1
+
+    def failed(self):
+        with self._lock:
+            self.errors += 1
+
+    def transferred(self, bytes_out=0, bytes_in=0):
+        with self._lock:
+            self.bytes_out += bytes_out
+            self.bytes_in += bytes_in
+            self.last_activity = time.time()
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: copy of the counters, with the time it was taken.
+        """
+        with self._lock:
+            snapshot = {name: getattr(self, name) for name in self.__slots__[1:]}
+        snapshot["time"] = time.time()
+        return snapshot
+
+metrics = Metrics()
@@ -0,0 +1,390 @@
+import hashlib
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+from .transport_options import TransportOptions
+from .streamlocal import is_socket_path, test_unix_socket
+from .port_util import test_port
+from ..configuration import config
+from ..errors import TunnelError
+
+__all__ = [
+    "ControlMaster",
+    "OpenSSHTunnel"
+]
+
+module_logger = logging.getLogger(__name__)
+
+class ControlMaster(object):
+    """
+    An OpenSSH master connection (``ssh -M``) that tunnels to one host are
+    multiplexed over. Forwards are added to and removed from the running
+    master with ``ssh -O forward`` and ``ssh -O cancel``, so every tunnel to
+    a host shares a single SSH connection, and data is relayed by OpenSSH's
+    C implementation instead of paramiko.
+
+    The master runs in the foreground as a child of this process
+    (``ControlPersist=no``), so that it goes away with the tunnels that use
+    it, and so that a master that dies can be noticed and restarted. Its
+    stderr goes to ``log_path`` rather than a pipe nobody reads, which would
+    stall the master, and every forward on it, once it filled up.
+
+    Examples:
+
+    .. code-block:: python
+
+        master = ControlMaster("remote.address", 22, "me", "~/.ssh/id_rsa")
+        master.start()
+        master.forward("-L", "9090:localhost:9090")
+        ...
+        master.stop()
+
+    Attributes:
+        remote_ip (str): host address
+        port (int): SSH port
+        username (str): remote username
+        keyfile (str): path to SSH key. None lets ssh pick.
+        control_path (str): path of the master's control socket.
+        log_path (str): file the master's stderr goes to.
+        transport_options (TransportOptions): ciphers, MACs and compression.
+        ssh_options (dict): extra ``-o`` options, like
+            ``{"StrictHostKeyChecking": "no"}``.
+        ssh_command (str): ssh executable.
+        batch_mode (bool): Never prompt for a password.
+        proc (subprocess.Popen): the master process.
+        logger (logging.getLogger): logging instance
+    """
+    def __init__(self, remote_ip, port=22, username=None, keyfile=None,
+                 transport_options=None, ssh_options=None, ssh_command="ssh",
+                 batch_mode=True, logger=None):
+        if logger is None: logger = logging.getLogger(module_logger.name+".ControlMaster")
+        self.logger = logger
+        self.remote_ip = remote_ip
+        self.port = int(port)
+        self.username = username
+        self.keyfile = keyfile
+        self.transport_options = TransportOptions.create(transport_options)
+        self.ssh_options = dict(ssh_options or {})
+        self.ssh_command = ssh_command
+        self.batch_mode = batch_mode
+        digest = hashlib.md5("{}@{}:{}".format(username, remote_ip, port).encode("utf-8"))
+        self.control_path = os.path.join(tempfile.gettempdir(), "trifeni-cm-{}-{}".format(
+            os.getpid(), digest.hexdigest()[:12]))
+        self.log_path = self.control_path + ".log"
+        self.proc = None
+        self._lock = threading.Lock()
+
+    def base_args(self):
+        """list: ssh arguments common to the master and control commands."""
+        args = [self.ssh_command, "-S", self.control_path, "-p", str(self.port)]
+        if self.username is not None:
+            args.extend(["-l", self.username])
+        if self.keyfile is not None:
+            args.extend(["-i", os.path.expanduser(self.keyfile)])
+        if self.batch_mode:
+            args.extend(["-o", "BatchMode=yes"])
+        for key in sorted(self.ssh_options):
+            args.extend(["-o", "{}={}".format(key, self.ssh_options[key])])
+        return args
+
+    def _control(self, command, *extra):
+        args = self.base_args() + ["-O", command] + list(extra) + [self.remote_ip]
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate()
+        return proc.returncode, stderr.decode("utf-8", "replace").strip()
+
+    @property
+    def running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def check(self):
+        """
+        Returns:
+            bool: Whether the master process is running and accepting
+                control commands.
+        """
+        if not self.running:
+            return False
+        returncode, message = self._control("check")
+        return returncode == 0
+
+    def start(self, timeout=10.0):
+        """
+        Start the master, if it isn't running already, and wait until it
+        accepts control commands.
+
+        Args:
+            timeout (float, optional): seconds to wait for the master (10.0)
+        """
+        with self._lock:
+            if self.running:
+                return
+            if os.path.exists(self.control_path):
+                os.unlink(self.control_path)
+            args = self.base_args() + self.transport_options.ssh_args() + [
+                "-M", "-N", "-o", "ControlPersist=no", self.remote_ip]
+            self.logger.debug("start: {}".format(" ".join(args)))
+            with open(os.devnull, "r+b") as devnull, open(self.log_path, "wb") as log:
+                self.proc = subprocess.Popen(args, stdin=devnull if self.batch_mode else None,
+                                             stdout=devnull, stderr=log)
+            t0 = time.time()
+            while time.time() - t0 < timeout:
+                if self.proc.poll() is not None:
+                    message = self.log_tail()
+                    raise TunnelError("ssh master connection to {}:{} failed: {}".format(
+                        self.remote_ip, self.port, message))
+                if os.path.exists(self.control_path) and self.check():
+                    self.logger.debug("start: master to {}:{} running, pid {}".format(
+                        self.remote_ip, self.port, self.proc.pid))
+                    return
+                time.sleep(0.05)
+            self.stop()
+            raise TunnelError("ssh master connection to {}:{} not ready after {} seconds".format(
+                self.remote_ip, self.port, timeout))
+
+    def log_tail(self, nbytes=2048):
+        """
+        Args:
+            nbytes (int, optional): how much of the end of the log to read.
+        Returns:
+            str: the last lines the master wrote to stderr.
+        """
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - nbytes))
+                return f.read().decode("utf-8", "replace").strip()
+        except (IOError, OSError):
+            return ""
+
+    def forward(self, tag, spec):
+        """
+        Add a forward to the running master.
+
+        Args:
+            tag (str): "-L" or "-R"
+            spec (str): forward specification, as given to ssh's -L or -R.
+        """
+        returncode, message = self._control("forward", tag, spec)
+        if returncode != 0:
+            raise TunnelError("ssh -O forward {} {} failed: {}".format(tag, spec, message))
+
+    def cancel(self, tag, spec):
+        """
+        Remove a forward from the running master.
+
+        Args:
+            tag (str): "-L" or "-R"
+            spec (str): forward specification, as given to ``forward``.
+        """
+        if not self.running:
+            return
+        returncode, message = self._control("cancel", tag, spec)
+        if returncode != 0:
+            self.logger.debug("cancel: {} {}: {}".format(tag, spec, message))
+
+    def stop(self):
+        """Close the master connection, and every forward using it."""
+        with self._lock:
+            if self.running:
+                self._control("exit")
+                t0 = time.time()
+                while self.proc.poll() is None and time.time() - t0 < 2.0:
+                    time.sleep(0.01)
+                if self.proc.poll() is None:
+                    self.proc.kill()
+                    self.proc.wait()
+            self.proc = None
+            for path in (self.control_path, self.log_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+class OpenSSHTunnel(object):
+    """
+    Forward or reverse tunnel run by the OpenSSH client rather than paramiko.
+    It has the same interface as SSHTunnel, so SSHTunnelManager can create
+    either. Each tunnel is a forward on a ControlMaster, so many tunnels to the
+    same host share one SSH connection. The tunnel only counts as open once
+    the master has accepted the forward: ``ssh -O forward -L`` only returns
+    once the master is listening on the local end.
+
+    Examples:
+
+    .. code-block:: python
+
+        with OpenSSHTunnel("some_alias", "localhost", 9090, 9090) as tunnel:
+            # do something with tunnel
+
+    Or let SSHTunnelManager share masters between tunnels:
+
+    .. code-block:: python
+
+        with SSHTunnelManager(backend="openssh") as manager:
+            manager.create_tunnel("some_alias", "localhost", 9090, 9090)
+
+    Attributes:
+        remote_alias (str): SSH alias from trifeni.config, if any.
+        remote_ip (str): host address of the server.
+        relay_ip (str): relay address, as given to ssh's -L option.
+        local_port (int/str): local forwarding port, or Unix domain socket path.
+        remote_port (int/str): remote forwarding port, or Unix domain socket path.
+        port (int): SSH port.
+        username (str): remote username.
+        keyfile (str): path to SSH key.
+        tunnel_id (str): A UUID for this tunnel
+        reverse (bool): Whether or not this is a reverse tunnel
+        control_master (ControlMaster): the master connection.
+        owns_control_master (bool): Whether this tunnel started control_master,
+            and is therefore responsible for stopping it.
+        open (bool): Whether or not the tunnel is active
+        logger (logging.getLogger): logging instance
+    """
+    __slots__ = ("logger", "remote_alias", "remote_ip", "port", "relay_ip", "local_port",
+                 "remote_port", "reverse", "username", "keyfile", "ready_timeout", "tunnel_id",
+                 "open", "owns_control_master", "control_master")
+
+    def __init__(self,
+                remote_ip, relay_ip,
+                local_port, remote_port,
+                port=22, username=None,
+                keyfile=None, look_for_keys=False,
+                wait_for_password=False, reverse=False,
+                tunnel_id=None, logger=None,
+                control_master=None, transport_options=None,
+                ssh_options=None, ready_timeout=10.0, **kwargs):
+        """
+        Args:
+            remote_ip (str): Either an alias or an actual address
+            relay_ip (str): forwarding address
+            local_port (int/str): local forwarding port, or Unix domain socket
+                path.
+            remote_port (int/str): remote forwarding port, or Unix domain
+                socket path.
+            port (int, optional): remote login port.
+            username (str, optional): remote username
+            keyfile (str, optional): path the ssh key file.
+            look_for_keys (bool, optional): Let ssh pick keys itself, instead
+                of the configured default identity file.
+            wait_for_password (bool, optional): Let ssh prompt for a password.
+            reverse (bool, optional): flag indicating whether this tunnel is
+                reverse or not
+            tunnel_id (str, optional): some UUID for this tunnel.
+            logger (logging.getLogger, optional): logging instance.
+            control_master (ControlMaster, optional): master shared with other
+                tunnels to the same host. The tunnel won't stop a master it
+                didn't start.
+            transport_options (TransportOptions/dict/str, optional): ciphers,
+                MACs and compression, if no control_master is given.
+            ssh_options (dict, optional): extra ssh ``-o`` options, if no
+                control_master is given.
+            ready_timeout (float, optional): seconds to wait for the master
+                to be ready (10.0)
+            **kwargs: SSHTunnel options that only apply to the paramiko
+                backend (``transports``, ``socket_options``, ...). Ignored.
+        """
+        if logger is None: logger = logging.getLogger(module_logger.name+".OpenSSHTunnel")
+        self.logger = logger
+        if kwargs:
+            self.logger.debug("__init__: ignoring paramiko options {}".format(sorted(kwargs)))
+
+        from .tunnel_util import resolve_host
+        remote_alias, remote_ip, port, username, keyfile = resolve_host(
+            remote_ip, port=port, username=username, keyfile=keyfile
+        )
+        if keyfile is None and not look_for_keys and os.path.exists(config.default_identity_file):
+            keyfile = config.default_identity_file
+
+        self.remote_alias = remote_alias
+        self.remote_ip = remote_ip
+        self.port = port
+        self.relay_ip = relay_ip
+        self.local_port = local_port
+        self.remote_port = remote_port
+        self.reverse = reverse
+        self.username = username
+        self.keyfile = keyfile
+        self.ready_timeout = ready_timeout
+        if tunnel_id is None:
+            tunnel_id = uuid.uuid4().hex
+        self.tunnel_id = tunnel_id
+        self.open = False
+
+        self.owns_control_master = control_master is None
+        if control_master is None:
+            control_master = ControlMaster(
+                remote_ip, port, username, keyfile,
+                transport_options=TransportOptions.from_host_config(
+                    config.get_host(remote_alias)).update(transport_options),
+                ssh_options=ssh_options, batch_mode=not wait_for_password)
+        self.control_master = control_master
+
+        if not self.reverse and self.check_conflict():
+            raise TunnelError("Will not be able to bind {}:{}".format(self.relay_ip, self.local_port))
+        self.connect()
+
+    @property
+    def tag(self):
+        return "-R" if self.reverse else "-L"
+
+    @property
+    def spec(self):
+        """str: the forward, as given to ssh's -L or -R option."""
+        if not self.reverse and is_socket_path(self.remote_port):
+            return "{}:{}".format(self.local_port, self.remote_port)
+        return "{}:{}:{}".format(self.local_port, self.relay_ip, self.remote_port)
+
+    def connect(self):
+        """
+        Start the master connection if need be, and add the forward. The
+        master replies to ``ssh -O forward`` once the forward is set up, so
+        the tunnel is ready when it returns, if the master is still up.
+        """
+        self.logger.debug(
+            "connect: creating tunnel to remote host {}:{}. Forwarding {} {}".format(
+                self.remote_ip, self.port, self.tag, self.spec))
+        self.control_master.start(timeout=self.ready_timeout)
+        self.control_master.forward(self.tag, self.spec)
+        if not self.control_master.check():
+            raise TunnelError("ssh master connection to {} exited adding forward {} {}".format(
+                self.remote_ip, self.tag, self.spec))
+        self.open = True
+
+    def check_conflict(self):
+        """
+        Returns True if something is listening on the local end of the tunnel,
+        False otherwise. ssh binds the local end of a forward on the loopback
+        interface, whatever relay_ip is, so that's where this looks.
+        """
+        if is_socket_path(self.local_port):
+            return test_unix_socket(self.local_port)
+        return test_port(self.local_port, host="localhost")
+
+    def destroy(self, drain_timeout=None):
+        """
+        Destroy the tunnel.
+
+        Args:
+            drain_timeout (float, optional): Accepted for compatibility with
+                SSHTunnel.destroy. OpenSSH stops listening when a forward is
+                cancelled, but keeps relaying the connections that are
+                already open, until the master stops.
+        """
+        self.logger.debug("destroy: {} called".format(self.tunnel_id))
+        if self.open:
+            self.control_master.cancel(self.tag, self.spec)
+            if not self.reverse and is_socket_path(self.local_port) and os.path.exists(self.local_port):
+                os.unlink(self.local_port)
+        if self.owns_control_master:
+            self.control_master.stop()
+        self.open = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.destroy()
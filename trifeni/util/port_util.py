@@ -0,0 +1,210 @@
+import errno
+import logging
+import os
+import socket
+import struct
+
+from .shell_util import Process, proc_dir, _read_cmdline
+from ..errors import TunnelError
+
+__all__ = [
+    "test_port",
+    "free_port",
+    "classify_bind_error",
+    "port_owner",
+    "ListeningPorts"
+]
+
+module_logger = logging.getLogger(__name__)
+
+bind_errors = {
+    errno.EADDRINUSE: "in-use",
+    errno.EADDRNOTAVAIL: "unavailable",
+    errno.EACCES: "permission",
+    errno.EPERM: "permission"
+}
+
+def classify_bind_error(err):
+    """
+    Classify an error raised when binding a socket.
+
+    Args:
+        err (socket.error): error raised by bind.
+    Returns:
+        str: "in-use" if something else is bound to the address,
+            "unavailable" if the address isn't local to this machine,
+            "permission" for privileged ports, or None for anything else.
+    """
+    return bind_errors.get(getattr(err, "errno", None))
+
+def test_port(port, host="localhost"):
+    """
+    Determine if a port is already being used. Returns False if not bound,
+    True if bound.
+
+    An address that isn't local to this machine can't conflict with a local
+    listener, so it counts as not bound. Binding a privileged port without
+    permission raises TunnelError, and any other error is raised as is.
+
+    Args:
+        port (int, optional): The port to check
+        host (str, optional): The host to attempt to bind on ("localhost")
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.bind((host, port))
+    except socket.error as err:
+        kind = classify_bind_error(err)
+        module_logger.debug("test_port: {}:{}: {} ({})".format(host, port, err, kind))
+        if kind == "in-use":
+            return True
+        elif kind == "unavailable":
+            return False
+        elif kind == "permission":
+            raise TunnelError("Not allowed to bind {}:{}: {}".format(host, port, err))
+        raise
+    finally:
+        sock.close()
+    return False
+
+def free_port(host="localhost"):
+    """
+    Get a port that nothing is bound to right now. Something else could
+    still take it before it's used.
+
+    Args:
+        host (str, optional): address to bind on ("localhost")
+    Returns:
+        int
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+def port_owner(port, listening=None):
+    """
+    Find the process listening on a local TCP port, by looking for the
+    listening socket's inode among the file descriptors in ``/proc/<pid>/fd``.
+    Only processes we're allowed to look at can be found.
+
+    Args:
+        port (int): local port.
+        listening (ListeningPorts, optional): snapshot to take the socket
+            from. Defaults to a new one.
+    Returns:
+        Process: or None if no process could be found.
+    """
+    if listening is None: listening = ListeningPorts()
+    targets = {"socket:[{}]".format(inode) for inode in listening.inodes.get(int(port), ())}
+    if not targets:
+        return None
+    for pid in os.listdir(proc_dir):
+        if not pid.isdigit():
+            continue
+        fd_dir = os.path.join(proc_dir, pid, "fd")
+        try:
+            for fd in os.listdir(fd_dir):
+                if os.readlink(os.path.join(fd_dir, fd)) in targets:
+                    return Process(pid=pid, argv=_read_cmdline(pid))
+        except (IOError, OSError):
+            # the process exited, or we're not allowed to look at it
+            continue
+    return None
+
+def _parse_ipv4(address):
+    return socket.inet_ntoa(struct.pack("<I", int(address, 16)))
+
+def _parse_ipv6(address):
+    words = [struct.pack("<I", int(address[i:i+8], 16)) for i in range(0, 32, 8)]
+    return socket.inet_ntop(socket.AF_INET6, b"".join(words))
+
+class ListeningPorts(object):
+    """
+    Snapshot of the TCP ports listening on this machine, read from
+    ``/proc/net/tcp`` and ``/proc/net/tcp6``. Checking many ports against
+    one snapshot is much cheaper than bind-probing each of them, for instance
+    when creating a batch of tunnels.
+
+    A snapshot can be out of date as soon as it's taken, so it is only a
+    pre-check: tunnels still bind their listener before they count as open.
+
+    Examples:
+
+    .. code-block:: python
+
+        listening = ListeningPorts()
+        free = [port for port in range(9090, 9100) if not listening.in_use(port)]
+
+    Attributes:
+        available (bool): Whether the snapshot could be read. Where there is
+            no /proc, no port is reported as in use.
+        listeners (dict): port to the set of addresses listening on it.
+        inodes (dict): port to the inodes of the sockets listening on it.
+    """
+    proc_files = (("/proc/net/tcp", _parse_ipv4), ("/proc/net/tcp6", _parse_ipv6))
+
+    listen_state = "0A"
+
+    wildcard = ("0.0.0.0", "::")
+
+    def __init__(self):
+        self.available = False
+        self.listeners = {}
+        self.inodes = {}
+        self.refresh()
+
+    def refresh(self):
+        """Read the listening sockets again."""
+        listeners = {}
+        inodes = {}
+        available = False
+        for file_path, parse in self.proc_files:
+            if not os.path.exists(file_path):
+                continue
+            available = True
+            with open(file_path, "r") as f:
+                lines = f.readlines()[1:]
+            for line in lines:
+                fields = line.split()
+                if len(fields) < 10 or fields[3] != self.listen_state:
+                    continue
+                address, port = fields[1].split(":")
+                try:
+                    address = parse(address)
+                except (ValueError, socket.error):
+                    continue
+                if address.startswith("::ffff:"):
+                    address = address[len("::ffff:"):]
+                listeners.setdefault(int(port, 16), set()).add(address)
+                inodes.setdefault(int(port, 16), set()).add(fields[9])
+        self.available = available
+        self.listeners = listeners
+        self.inodes = inodes
+
+    def in_use(self, port, host=None):
+        """
+        Determine if port is listening, on any address if host is None or
+        the wildcard address, or on host or the wildcard address otherwise.
+
+        Args:
+            port (int): port to check
+            host (str, optional): address to check.
+        Returns:
+            bool
+        """
+        addresses = self.listeners.get(int(port))
+        if not addresses:
+            return False
+        if host is None or host in ("",) + self.wildcard:
+            return True
+        if addresses.intersection(self.wildcard):
+            return True
+        try:
+            host = socket.gethostbyname(host)
+        except socket.error:
+            return False
+        return host in addresses
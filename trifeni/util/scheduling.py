@@ -0,0 +1,289 @@
+import collections
+import logging
+import threading
+import time
+
+from .metrics import metrics
+
+__all__ = [
+    "TrafficClass",
+    "TrafficScheduler",
+    "TokenBucket",
+    "TunnelTraffic"
+]
+
+module_logger = logging.getLogger(__name__)
+
+class TrafficClass(object):
+    """
+    Priority class of a tunnel's traffic.
+
+    Tunnels to a host share the SSH link, and a response on one tunnel
+    waits behind whatever data other tunnels have in flight. Two things keep
+    that short for urgent tunnels: while an urgent tunnel waits for a
+    response, less urgent tunnels stop reading (see TrafficScheduler), and
+    bulk tunnels get a smaller channel window, which caps how much of their
+    data can be in flight, and so queued ahead of the response, at all.
+
+    Examples:
+
+    .. code-block:: python
+
+        TrafficClass.create("bulk")
+        TrafficClass.create({"name": "bulk", "priority": 1, "window_size": 2**20})
+
+    Attributes:
+        name (str): name of the class.
+        priority (int): lower is more urgent.
+        window_size (int): channel window for the class's tunnels, in bytes,
+            unless their TransportOptions set one. None leaves paramiko's
+            default.
+    """
+    __slots__ = ("name", "priority", "window_size")
+
+    classes = {
+        "control": {"priority": 0},
+        "bulk": {"priority": 1, "window_size": 2**18}
+    }
+
+    def __init__(self, name, priority=0, window_size=None):
+        self.name = name
+        self.priority = int(priority)
+        self.window_size = None if window_size is None else int(window_size)
+
+    @classmethod
+    def create(cls, options):
+        """
+        Coerce options into TrafficClass.
+
+        Args:
+            options (TrafficClass/dict/str): Either an existing instance,
+                keyword arguments for __init__, or a class name from
+                ``classes``.
+        Returns:
+            TrafficClass
+        """
+        if isinstance(options, cls):
+            return options
+        elif isinstance(options, dict):
+            return cls(**options)
+        if options not in cls.classes:
+            raise ValueError("Unknown traffic class {}. Choose from {}".format(
+                options, sorted(cls.classes)))
+        return cls(options, **cls.classes[options])
+
+    def __repr__(self):
+        return "TrafficClass({!r}, priority={}, window_size={})".format(
+            self.name, self.priority, self.window_size)
+
+class TrafficScheduler(object):
+    """
+    Priority between the scheduled tunnels to one host. Relays report
+    requests they forward, and the responses to them. While a request of
+    some priority is waiting for its response, relays of less urgent
+    tunnels hold off reading, which, through SSH flow control, soon stops
+    the other end sending their data too.
+
+    Holding off is bounded, so that urgent traffic can't starve bulk
+    transfers. Once a priority becomes the most urgent one waiting, less
+    urgent relays hold off for at most ``max_delay`` seconds in all, until
+    no request of that priority is waiting any more. A request that has
+    had no response after ``request_timeout`` seconds, because none is
+    coming or the relay couldn't tell it apart, stops counting.
+
+    Schedulers are shared per host through ``for_host``.
+
+    Attributes:
+        max_delay (float): longest less urgent relays hold off for while
+            the same priority stays the most urgent, in seconds.
+        request_timeout (float): seconds after which a request waiting for
+            its response stops counting.
+        active (collections.Counter): requests waiting for a response, by
+            priority.
+        most_urgent (int): priority of the most urgent request waiting for
+            a response, or None.
+    """
+    _hosts = {}
+    _hosts_lock = threading.Lock()
+
+    def __init__(self, max_delay=0.5, request_timeout=10.0):
+        self.max_delay = max_delay
+        self.request_timeout = request_timeout
+        self.active = collections.Counter()
+        self.most_urgent = None
+        self._started = collections.defaultdict(collections.deque)
+        self._hold_until = None
+        self._changed = threading.Condition()
+
+    @classmethod
+    def for_host(cls, host):
+        """
+        Args:
+            host (tuple): address and port of the SSH server.
+        Returns:
+            TrafficScheduler: the scheduler of host's tunnels.
+        """
+        with cls._hosts_lock:
+            if host not in cls._hosts:
+                cls._hosts[host] = cls()
+            return cls._hosts[host]
+
+    def _update(self):
+        urgent = [priority for priority in self.active if self.active[priority] > 0]
+        most_urgent = min(urgent) if urgent else None
+        if most_urgent != self.most_urgent:
+            self._hold_until = None if most_urgent is None else time.time() + self.max_delay
+        self.most_urgent = most_urgent
+        self._changed.notify_all()
+
+    def _expire(self):
+        """
+        Stop counting requests older than request_timeout.
+
+        Returns:
+            float: when the next request expires, or None.
+        """
+        oldest = time.time() - self.request_timeout
+        expired = 0
+        next_expiry = None
+        for priority in self._started:
+            started = self._started[priority]
+            while started and started[0] <= oldest:
+                started.popleft()
+                self.active[priority] -= 1
+                expired += 1
+            if started and (next_expiry is None or started[0] < next_expiry):
+                next_expiry = started[0]
+        if expired:
+            metrics.increment("scheduler.expired", expired)
+            self._update()
+        return None if next_expiry is None else next_expiry + self.request_timeout
+
+    def request_started(self, priority, count=1):
+        with self._changed:
+            self._expire()
+            self._started[priority].extend([time.time()] * count)
+            self.active[priority] += count
+            self._update()
+
+    def request_finished(self, priority, count=1):
+        with self._changed:
+            started = self._started[priority]
+            count = min(count, len(started)) # the others expired
+            for i in range(count):
+                started.popleft()
+            self.active[priority] -= count
+            self._update()
+
+    def wait_turn(self, priority):
+        """
+        Hold off while a more urgent request waits for its response, unless
+        less urgent relays have already held off for ``max_delay`` seconds
+        since that priority became the most urgent.
+
+        Returns:
+            float: seconds spent waiting.
+        """
+        urgent, hold_until = self.most_urgent, self._hold_until
+        if urgent is None or urgent >= priority or hold_until is None or time.time() >= hold_until:
+            return 0.0
+        start = time.time()
+        with self._changed:
+            next_expiry = self._expire()
+            while self.most_urgent is not None and self.most_urgent < priority:
+                until = self._hold_until if next_expiry is None else min(self._hold_until, next_expiry)
+                if self._hold_until <= time.time():
+                    metrics.increment("scheduler.max_delay")
+                    break
+                self._changed.wait(max(until - time.time(), 0))
+                next_expiry = self._expire()
+        waited = time.time() - start
+        metrics.observe("scheduler.wait_seconds", waited)
+        return waited
+
+class TokenBucket(object):
+    """
+    Rate cap: ``consume`` sleeps as long as it takes to keep the average rate
+    under ``rate``, allowing bursts of up to ``burst`` bytes.
+
+    Attributes:
+        rate (float): bytes per second.
+        burst (float): bucket size, in bytes.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst) if burst is not None else max(self.rate / 10.0, 2**16)
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        """
+        Take nbytes out of the bucket, sleeping if it runs dry.
+
+        Returns:
+            float: seconds slept.
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+class TunnelTraffic(object):
+    """
+    What a tunnel's relays need to schedule and cap its traffic.
+
+    Attributes:
+        traffic_class (TrafficClass): the tunnel's class, or None if it's
+            not scheduled.
+        scheduler (TrafficScheduler): scheduler of the tunnel's host.
+        request_bucket (TokenBucket): cap on data going towards the side the
+            tunnel connects to, or None.
+        response_bucket (TokenBucket): cap on data coming back, or None.
+    """
+    __slots__ = ("traffic_class", "scheduler", "priority", "request_bucket", "response_bucket")
+
+    def __init__(self, traffic_class=None, scheduler=None, rate_limit=None):
+        """
+        Args:
+            traffic_class (TrafficClass/dict/str, optional): see
+                ``TrafficClass.create``.
+            scheduler (TrafficScheduler, optional): required with
+                traffic_class.
+            rate_limit (float, optional): bytes per second, in each
+                direction.
+        """
+        self.traffic_class = None if traffic_class is None else TrafficClass.create(traffic_class)
+        self.scheduler = scheduler if self.traffic_class is not None else None
+        self.priority = None if self.traffic_class is None else self.traffic_class.priority
+        self.request_bucket = None if rate_limit is None else TokenBucket(rate_limit)
+        self.response_bucket = None if rate_limit is None else TokenBucket(rate_limit)
+
+    def wait_turn(self):
+        if self.scheduler is not None:
+            self.scheduler.wait_turn(self.priority)
+
+    def request_data(self, nbytes, started):
+        """
+        Report data read from the side that connected to the tunnel, and
+        the number of requests that expect a response it completed.
+        """
+        if started and self.scheduler is not None:
+            self.scheduler.request_started(self.priority, started)
+        if self.request_bucket is not None:
+            self.request_bucket.consume(nbytes)
+
+    def response_data(self, nbytes, answered):
+        """
+        Report data read from the side the tunnel connects to, and the
+        number of requests it answered.
+        """
+        if answered and self.scheduler is not None:
+            self.scheduler.request_finished(self.priority, answered)
+        if self.response_bucket is not None and nbytes:
+            self.response_bucket.consume(nbytes)
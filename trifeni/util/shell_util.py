@@ -1,6 +1,7 @@
 import logging
 import shlex
 import os
+import signal
 import subprocess
 import time
 import re
@@ -8,11 +9,17 @@ import re
 __all__ = [
     "Process","invoke_cmd",
     "pipe_cmds", "kill_processes",
-    "check_connection", "arbitrary_tunnel"
+    "check_connection", "arbitrary_tunnel",
+    "list_processes", "parse_tunnel_args", "TunnelProcessIndex"
 ]
 
 module_logger = logging.getLogger(__name__)
 
+proc_dir = "/proc"
+
+# ssh options that take an argument, from ssh(1)
+ssh_arg_options = "BbcDEeFIiJLlmOopQRSWw"
+
 class Process(object):
     """
     Class representing a basic process, with name and pid.
@@ -23,14 +30,18 @@ class Process(object):
         name (str): The name of the process
         pid (int): The process ID
     """
-    def __init__(self, name="", pid=0, ps_line=None, command_name='ssh'):
+    def __init__(self, name="", pid=0, ps_line=None, command_name='ssh', argv=None):
         """
         Create Process instance.
         Keyword Args:
             name (str): The name of the process
             pid (int): the process id
+            argv (list): The command line of the process. If name is not
+                given, it is the joined command line.
         """
-
+        if argv is None: argv = []
+        self.argv = list(argv)
+        if not name: name = " ".join(self.argv)
         self.name = name
         try:
             self.pid = int(pid)
@@ -45,7 +56,7 @@ class Process(object):
         Returns:
 
         """
-        re_pid = re.compile("\d+")
+        re_pid = re.compile(r"\d+")
         re_name = re.compile("{}.*".format(command_name))
         id = int(re_pid.findall(ps_line)[0])
         name = re_name.findall(ps_line)[0]
@@ -55,6 +66,176 @@ class Process(object):
 
         os.kill(self.pid, signal.SIGKILL)
 
+    def __repr__(self):
+        return "Process(name={!r}, pid={})".format(self.name, self.pid)
+
+def _read_cmdline(pid):
+    with open(os.path.join(proc_dir, pid, "cmdline"), "rb") as f:
+        cmdline = f.read()
+    return [arg.decode("utf-8", "replace") for arg in cmdline.split(b"\0") if arg]
+
+def _list_proc_processes(uid=None):
+    for pid in os.listdir(proc_dir):
+        if not pid.isdigit():
+            continue
+        try:
+            if uid is not None and os.stat(os.path.join(proc_dir, pid)).st_uid != uid:
+                continue
+            argv = _read_cmdline(pid)
+        except (IOError, OSError):
+            # the process exited, or we're not allowed to look at it
+            continue
+        if argv:
+            yield Process(pid=pid, argv=argv)
+
+def _list_ps_processes(uid=None):
+    # ps x only lists the current user's processes
+    output = subprocess.check_output(["ps", "x", "-o", "pid=", "-o", "command="])
+    for line in output.decode("utf-8", "replace").splitlines():
+        fields = line.strip().split(None, 1)
+        if len(fields) == 2:
+            yield Process(pid=fields[0], argv=fields[1].split())
+
+def list_processes(command_name=None, uid=None):
+    """
+    List running processes, reading ``/proc/<pid>/cmdline`` directly where
+    there is a /proc filesystem, and falling back to a single ``ps`` call
+    elsewhere. The calling process is left out.
+
+    Args:
+        command_name (str, optional): Only list processes whose executable
+            has this name (``ssh`` matches ``/usr/bin/ssh``).
+        uid (int, optional): Only list processes of this user. Without
+            /proc, only the current user's processes are listed anyway.
+    Returns:
+        list: Process instances, with their argv.
+    """
+    if os.path.isdir(proc_dir):
+        processes = _list_proc_processes(uid)
+    else:
+        processes = _list_ps_processes(uid)
+    own_pid = os.getpid()
+    return [proc for proc in processes if proc.pid != own_pid and
+            (command_name is None or os.path.basename(proc.argv[0]) == command_name)]
+
+def parse_tunnel_args(argv):
+    """
+    Get the tunnels an ssh command line creates.
+
+    Examples:
+
+    .. code-block:: python
+
+        >>> parse_tunnel_args(["ssh", "-N", "-L", "9090:localhost:9091", "remote"])
+        [('-L', '9090', 'localhost', '9091', 'remote')]
+
+    Args:
+        argv (list): ssh command line
+    Returns:
+        list: (tag, local_port, relay, remote_port, host) tuples, one for each
+            ``-L`` or ``-R`` option, with tag either "-L" or "-R". Ports are
+            kept as strings, as they can also be socket paths.
+    """
+    specs = []
+    host = None
+    options_done = False
+    args = iter(argv[1:])
+    for arg in args:
+        if arg == "--" and not options_done:
+            options_done = True
+        elif arg.startswith("-") and len(arg) > 1 and not options_done:
+            # flags can be bundled, as in "-fNL 9090:localhost:9091", and the
+            # first one taking an argument takes the rest of arg, or the next one.
+            for i in range(1, len(arg)):
+                option = arg[i]
+                if option in ssh_arg_options:
+                    value = arg[i + 1:] if i + 1 < len(arg) else next(args, "")
+                    if option in "LR":
+                        specs.append(("-" + option, value))
+                    break
+        elif host is None:
+            host = arg
+        else:
+            # the rest is the remote command
+            break
+    tunnels = []
+    for tag, spec in specs:
+        fields = spec.split(":")
+        if len(fields) == 4:
+            # bind_address:port:host:hostport
+            fields = fields[1:]
+        if len(fields) == 3:
+            tunnels.append((tag, fields[0], fields[1], fields[2], host))
+    return tunnels
+
+class TunnelProcessIndex(object):
+    """
+    Running ssh tunnel processes, indexed by the tunnels they create.
+
+    Examples:
+
+    .. code-block:: python
+
+        index = TunnelProcessIndex()
+        proc = index.find("-L", 9090, "localhost", 9090, "remote")
+
+    Attributes:
+        command_name (str): name of the ssh executable.
+        uid (int): only index this user's processes, or every user's if None.
+        tunnels (dict): maps (tag, local_port, relay, remote_port, host) to
+            the Process creating that tunnel. Ports are strings.
+        refreshed (float): time of the last scan.
+    """
+    def __init__(self, command_name="ssh", uid=None):
+        self.command_name = command_name
+        self.uid = uid
+        self.tunnels = {}
+        self.refreshed = 0.0
+        self.refresh()
+
+    def refresh(self, max_age=None):
+        """
+        Rescan running processes.
+
+        Args:
+            max_age (float, optional): only rescan if the last scan is older
+                than this many seconds.
+        """
+        now = time.time()
+        if max_age is not None and now - self.refreshed < max_age:
+            return
+        tunnels = {}
+        for proc in list_processes(self.command_name, uid=self.uid):
+            for key in parse_tunnel_args(proc.argv):
+                tunnels[key] = proc
+        self.tunnels = tunnels
+        self.refreshed = now
+
+    def add(self, proc):
+        """
+        Index a process we just started, without waiting for a rescan.
+
+        Args:
+            proc (Process): process, with its argv.
+        """
+        for key in parse_tunnel_args(proc.argv):
+            self.tunnels[key] = proc
+
+    def find(self, tag, local_port, relay, remote_port, host):
+        """
+        Get the process creating a tunnel.
+
+        Args:
+            tag (str): "-L" or "-R"
+            local_port (int/str): local port or socket path
+            relay (str): relay address
+            remote_port (int/str): remote port or socket path
+            host (str): ssh destination
+        Returns:
+            Process: or None if no process creates this tunnel.
+        """
+        return self.tunnels.get((tag, str(local_port), relay, str(remote_port), host))
+
 
 def invoke_cmd(command, command_input=None):
     """
@@ -86,29 +267,36 @@ def pipe_cmds(command1, command2):
     """
     p1 = subprocess.Popen(shlex.split(command1), stdout=subprocess.PIPE)
     p2 = subprocess.Popen(shlex.split(command2), stdin=p1.stdout, stdout=subprocess.PIPE)
-    waiting = True
-    while waiting:
-        try:
-            output = p2.stdout.readlines()
-            waiting = False
-        except IOError:
-            continue
-    return output
+    # let p1 get SIGPIPE if p2 exits first
+    p1.stdout.close()
+    output, _ = p2.communicate()
+    p1.wait()
+    return output.decode("utf-8", "replace").splitlines(True)
 
 def kill_processes(search_term, match_template=None):
     """
-    Kill processes that contain match_template.
+    Kill the current user's processes that contain match_template, like
+    ``ps x | grep`` would find them.
 
     Args:
-        search_term (str): The process to look for (python, ssh)
-        match_template (str, optional): A string that processes should contain in order to
-            be killed.
+        search_term (str): The executable of the processes to look for
+            (python, ssh)
+        match_template (str, optional): A string that processes' command line
+            should contain in order to be killed.
+    Returns:
+        list: killed Process instances.
     """
-    processes = pipe_cmds("ps x","grep {}".format(search_term))
-    for proc in processes:
-        if match_template in proc:
-            bp = Process(ps_line=proc, command_name=search_term)
-            bp.kill()
+    killed = []
+    for proc in list_processes(command_name=search_term, uid=os.getuid()):
+        if match_template is None or match_template in proc.name:
+            module_logger.debug("kill_processes: killing {}".format(proc))
+            try:
+                proc.kill()
+            except OSError as err:
+                module_logger.debug("kill_processes: {}".format(err))
+                continue
+            killed.append(proc)
+    return killed
 
 def check_connection(callback, timeout=1.0, attempts=10, args=None, kwargs=None):
     """
@@ -140,11 +328,26 @@ def check_connection(callback, timeout=1.0, attempts=10, args=None, kwargs=None)
     return False
 
 
+# the current user's tunnel processes, shared by arbitrary_tunnel calls
+_own_tunnels = None
+
+# how stale that index can get before arbitrary_tunnel rescans
+own_tunnels_max_age = 1.0
+
+def _get_own_tunnels():
+    global _own_tunnels
+    if _own_tunnels is None:
+        _own_tunnels = TunnelProcessIndex(uid=os.getuid())
+    else:
+        _own_tunnels.refresh(max_age=own_tunnels_max_age)
+    return _own_tunnels
+
 def arbitrary_tunnel(remote_ip, relay_ip,
                      local_port, remote_port,
                      port=22, username='',reverse=False, password=None):
     """
-    Create an arbitrary ssh tunnel, after checking to see if a tunnel already exists.
+    Create an arbitrary ssh tunnel, after checking to see if one of this user's ssh
+    processes already creates it.
     This just spawns the process that creates the tunnel, it doesn't check to see if the tunnel
     has successfully connected.
 
@@ -167,35 +370,30 @@ def arbitrary_tunnel(remote_ip, relay_ip,
             or else Process instance, the corresponds to already running tunnel command.
 
     """
-    module_logger.debug("Configuration: {}".format(config.hosts))
+    from .tunnel_util import resolve_host
+
     # Regular or reverse tunnel?
     if reverse:
         tag = "-R"
     else:
         tag = "-L"
 
-    command = None
-
-    if remote_ip in config.hosts:
-        if config.hosts[remote_ip] == list():
-            command_template = "ssh -N {0} {1}:{2}:{3} {4}"
-            command = command_template.format(tag, local_port, relay_ip, remote_port, remote_ip)
-        else:
-            remote_ip, username, port = config.hosts[remote_ip]
-
-    if not command:
-        command_template = "ssh -N -l {0} -p {1} {2} {3}:{4}:{5} {6}"
-        command = command_template.format(username, port,
-                                tag, local_port, relay_ip,
-                                remote_port, remote_ip)
-
-    command_relay = "{0} {1}:{2}:{3} {4}".format(tag, local_port, relay_ip, remote_port, remote_ip)
-    ssh_proc = [str(proc) for proc in pipe_cmds('ps x', 'grep ssh')]
-    for proc in ssh_proc:
-        if command_relay in proc:
-            bp = Process(ps_line=proc, command_name='ssh')
-            module_logger.debug("Found matching process: {}, pid: {}".format(bp.name,bp.pid))
-            return (bp, True)
+    remote_alias, remote_ip, port, username, keyfile = resolve_host(
+        remote_ip, port=port, username=username if username else None)
+
+    command_template = "ssh -N -l {0} -p {1} {2} {3}:{4}:{5} {6}"
+    command = command_template.format(username, port,
+                            tag, local_port, relay_ip,
+                            remote_port, remote_ip)
+    if keyfile:
+        command = command.replace("ssh -N", "ssh -N -i {}".format(keyfile), 1)
+
+    index = _get_own_tunnels()
+    bp = index.find(tag, local_port, relay_ip, remote_port, remote_ip)
+    if bp is not None:
+        module_logger.debug("Found matching process: {}, pid: {}".format(bp.name,bp.pid))
+        return (bp, True)
     module_logger.debug("Invoking command {}".format(command))
     p = invoke_cmd(command,command_input=password)
+    index.add(Process(pid=p.pid, argv=shlex.split(command)))
     return (p, False)
@@ -0,0 +1,124 @@
+import socket
+import logging
+
+__all__ = [
+    "SocketOptions"
+]
+
+module_logger = logging.getLogger(__name__)
+
+class SocketOptions(object):
+    """
+    Socket options applied to the sockets that carry tunneled traffic: the
+    local listening and accepted sockets of forward tunnels, the sockets
+    reverse tunnels open to their target, and the SSH transport sockets.
+    Options left as None are not touched, so the operating system's defaults
+    apply.
+
+    Pyro4 calls are small request/response messages, so by default Nagle's
+    algorithm is switched off (TCP_NODELAY).
+
+    Examples:
+
+    .. code-block:: python
+
+        tunnel = SSHTunnel("remote", "localhost", 9090, 9090,
+                           socket_options={"nodelay": True, "sndbuf": 2**20, "rcvbuf": 2**20})
+
+    Attributes:
+        nodelay (bool): Set TCP_NODELAY.
+        sndbuf (int): SO_SNDBUF, in bytes.
+        rcvbuf (int): SO_RCVBUF, in bytes.
+        keepalive (bool): Set SO_KEEPALIVE.
+    """
+    __slots__ = ("nodelay", "sndbuf", "rcvbuf", "keepalive")
+
+    profiles = {
+        "default": {"nodelay": True},
+        "system": {},
+        "low-latency": {"nodelay": True, "keepalive": True},
+        "bulk": {"nodelay": False, "sndbuf": 2**22, "rcvbuf": 2**22}
+    }
+
+    def __init__(self, nodelay=None, sndbuf=None, rcvbuf=None, keepalive=None):
+        self.nodelay = nodelay
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
+        self.keepalive = keepalive
+
+    @classmethod
+    def profile(cls, name):
+        """
+        Get one of the named profiles in ``profiles``.
+
+        Args:
+            name (str): "default", "system", "low-latency" or "bulk"
+        Returns:
+            SocketOptions
+        """
+        if name not in cls.profiles:
+            raise ValueError("Unknown socket profile {}. Choose from {}".format(
+                name, sorted(cls.profiles)))
+        return cls(**cls.profiles[name])
+
+    @classmethod
+    def create(cls, options):
+        """
+        Coerce options into SocketOptions. None gives the "default" profile.
+
+        Args:
+            options (SocketOptions/dict/str/None): Either an existing
+                instance, keyword arguments for __init__, or a profile name.
+        Returns:
+            SocketOptions
+        """
+        if options is None:
+            return cls.profile("default")
+        elif isinstance(options, cls):
+            return options
+        elif isinstance(options, dict):
+            return cls(**options)
+        else:
+            return cls.profile(options)
+
+    def apply(self, sock):
+        """
+        Set options on sock. TCP specific options are skipped for other socket
+        families. Failures are logged, not raised: a socket that can't be
+        tuned can still relay data.
+
+        Args:
+            sock (socket.socket): socket to configure.
+        Returns:
+            socket.socket: sock
+        """
+        options = []
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            if self.nodelay is not None:
+                options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self.nodelay)))
+            if self.keepalive is not None:
+                options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, int(self.keepalive)))
+        if self.sndbuf is not None:
+            options.append((socket.SOL_SOCKET, socket.SO_SNDBUF, int(self.sndbuf)))
+        if self.rcvbuf is not None:
+            options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, int(self.rcvbuf)))
+        for level, option, value in options:
+            try:
+                sock.setsockopt(level, option, value)
+            except socket.error as err:
+                module_logger.debug("apply: couldn't set option {} to {}: {}".format(option, value, err))
+        return sock
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__
+                if getattr(self, name) is not None}
+
+    def __eq__(self, other):
+        return isinstance(other, SocketOptions) and self.as_dict() == other.as_dict()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "SocketOptions({})".format(", ".join(
+            "{}={!r}".format(name, value) for name, value in sorted(self.as_dict().items())))
@@ -0,0 +1,122 @@
+import os
+import socket
+import threading
+import time
+import logging
+
+import paramiko
+from paramiko.channel import Channel
+from paramiko.common import cMSG_CHANNEL_OPEN
+from paramiko.message import Message
+
+__all__ = [
+    "is_socket_path",
+    "test_unix_socket",
+    "open_streamlocal_channel"
+]
+
+module_logger = logging.getLogger(__name__)
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+def is_socket_path(address):
+    """
+    Determine whether a tunnel endpoint is a Unix domain socket path rather
+    than a TCP port.
+
+    Args:
+        address (int/str): port number or socket path
+    Returns:
+        bool
+    """
+    return isinstance(address, string_types) and not address.isdigit()
+
+def test_unix_socket(path):
+    """
+    Determine if something is listening on the Unix domain socket path.
+    Returns False if not, True if it is.
+
+    Args:
+        path (str): socket path
+    """
+    if not os.path.exists(path):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error as err:
+        module_logger.debug("test_unix_socket: {}: {}".format(path, err))
+        return False
+    finally:
+        sock.close()
+    return True
+
+def open_streamlocal_channel(transport, socket_path, window_size=None,
+                             max_packet_size=None, timeout=None):
+    """
+    Open a ``direct-streamlocal@openssh.com`` channel, connecting to a Unix
+    domain socket on the remote host. This is the equivalent of
+    ``ssh -L local:/remote/socket/path``.
+
+    paramiko's Transport.open_channel only knows how to encode addresses for
+    TCP and X11 channels, so this follows it, with the streamlocal payload
+    (socket path, followed by two reserved fields).
+
+    Args:
+        transport (paramiko.Transport): authenticated transport
+        socket_path (str): path to the socket on the remote host
+        window_size (int, optional): window size for this channel.
+        max_packet_size (int, optional): max packet size for this channel.
+        timeout (float, optional): how long to wait for the server, in seconds.
+    Returns:
+        paramiko.Channel
+    """
+    if not transport.active:
+        raise paramiko.SSHException("SSH session not active")
+    if timeout is None:
+        timeout = getattr(transport, "channel_timeout", 3600)
+    transport.lock.acquire()
+    try:
+        window_size = transport._sanitize_window_size(window_size)
+        max_packet_size = transport._sanitize_packet_size(max_packet_size)
+        chanid = transport._next_channel()
+        m = Message()
+        m.add_byte(cMSG_CHANNEL_OPEN)
+        m.add_string("direct-streamlocal@openssh.com")
+        m.add_int(chanid)
+        m.add_int(window_size)
+        m.add_int(max_packet_size)
+        m.add_string(socket_path)
+        m.add_string("")
+        m.add_int(0)
+        chan = Channel(chanid)
+        transport._channels.put(chanid, chan)
+        transport.channel_events[chanid] = event = threading.Event()
+        transport.channels_seen[chanid] = True
+        chan._set_transport(transport)
+        chan._set_window(window_size, max_packet_size)
+    finally:
+        transport.lock.release()
+    transport._send_user_message(m)
+    start_ts = time.time()
+    while True:
+        event.wait(0.1)
+        if not transport.active:
+            err = transport.get_exception()
+            if err is None:
+                err = paramiko.SSHException("Unable to open channel.")
+            raise err
+        if event.is_set():
+            break
+        elif start_ts + timeout < time.time():
+            raise paramiko.SSHException("Timeout opening channel.")
+    chan = transport._channels.get(chanid)
+    if chan is not None:
+        return chan
+    err = transport.get_exception()
+    if err is None:
+        err = paramiko.SSHException("Unable to open channel.")
+    raise err
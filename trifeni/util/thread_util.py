@@ -0,0 +1,64 @@
+import threading
+import logging
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+__all__ = [
+    "thread_map"
+]
+
+module_logger = logging.getLogger(__name__)
+
+def thread_map(func, items, max_workers=8):
+    """
+    Call func on each element of items, using at most max_workers threads.
+
+    Examples:
+
+    .. code-block:: python
+
+        >>> thread_map(lambda x: x**2, [1, 2, 3])
+        [1, 4, 9]
+
+    Args:
+        func (callable): called with each element of items.
+        items (iterable): arguments for func.
+        max_workers (int, optional): maximum number of threads (8)
+    Returns:
+        list: results, in the same order as items. If any call raised, the
+            first exception (in the order of items) is re-raised once every
+            call has finished.
+    """
+    items = list(items)
+    if len(items) == 0:
+        return []
+    results = [None for item in items]
+    errors = [None for item in items]
+    queue = Queue.Queue()
+    for i, item in enumerate(items):
+        queue.put((i, item))
+
+    def worker():
+        while True:
+            try:
+                i, item = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = func(item)
+            except Exception as err:
+                module_logger.debug("thread_map: {} failed for {}: {}".format(func, item, err))
+                errors[i] = err
+
+    threads = [threading.Thread(target=worker) for i in range(min(max_workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for err in errors:
+        if err is not None:
+            raise err
+    return results
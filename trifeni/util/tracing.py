@@ -0,0 +1,147 @@
+import contextlib
+import logging
+import time
+
+import paramiko
+
+from .transport_options import TransportOptions
+
+__all__ = [
+    "Tracer",
+    "tracer"
+]
+
+module_logger = logging.getLogger(__name__)
+
+class Tracer(object):
+    """
+    Dispatch structured tunnel events to hooks. With no hooks registered,
+    ``enabled`` is False, and instrumented code checks that flag before
+    building an event, so tracing costs an attribute lookup.
+
+    Each event is a dict, with at least an ``event`` name and a ``time``
+    (seconds since the epoch, when the event started). Events that cover an
+    interval also have a ``duration``, and failed ones an ``error``. The
+    events are:
+
+    - ``resolve``: alias resolution (``alias``, ``remote_ip``, ``port``)
+    - ``connect``: TCP connection, handshake and authentication of one SSH
+      transport (``remote_ip``, ``port``)
+    - ``handshake``: SSH key exchange, within ``connect``
+    - ``auth``: authentication, within ``connect`` (``method``)
+    - ``tunnel.open`` and ``tunnel.close`` (``tunnel_id``, ``local_port``,
+      ``remote_port``, ``reverse``)
+    - ``channel.open``: opening the SSH channel for a forwarded connection
+      (``chain_host``, ``chain_port``)
+    - ``relay.first_byte``: first response byte of a forwarded connection;
+      ``duration`` is measured from when the connection was accepted.
+    - ``relay.close``: end of a forwarded connection, with ``bytes_out`` and
+      ``bytes_in``.
+    - ``error``: anything that went wrong along the way (``stage``).
+
+    Examples:
+
+    .. code-block:: python
+
+        from trifeni.util import tracer
+
+        def print_event(event):
+            print(event["event"], event.get("duration"))
+
+        tracer.add_hook(print_event)
+
+    Attributes:
+        hooks (list): callables, each called with every event.
+        enabled (bool): Whether any hook is registered.
+    """
+    def __init__(self):
+        self.hooks = []
+        self.enabled = False
+
+    def add_hook(self, hook):
+        """Register hook, a callable taking an event dict."""
+        self.hooks = self.hooks + [hook]
+        self.enabled = True
+
+    def remove_hook(self, hook):
+        """Unregister hook."""
+        self.hooks = [h for h in self.hooks if h != hook]
+        self.enabled = len(self.hooks) > 0
+
+    def emit(self, event, start=None, **fields):
+        """
+        Send an event to every hook. Hooks that raise are logged, and don't
+        stop other hooks.
+
+        Args:
+            event (str): event name
+            start (float, optional): when the event started. If given, the
+                event also gets a duration, up to now.
+            **fields: event fields
+        """
+        now = time.time()
+        fields["event"] = event
+        if start is None:
+            fields["time"] = now
+        else:
+            fields["time"] = start
+            fields["duration"] = now - start
+        for hook in self.hooks:
+            try:
+                hook(fields)
+            except Exception as err:
+                module_logger.error("emit: hook {} failed on {}: {}".format(hook, event, err))
+
+    @contextlib.contextmanager
+    def span(self, event, **fields):
+        """
+        Emit event, with its duration, when a with block ends. If the block
+        raises, an ``error`` event with ``stage`` set to event is emitted
+        instead.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        except Exception as err:
+            self.emit("error", start=start, stage=event, error=repr(err), **fields)
+            raise
+        self.emit(event, start=start, **fields)
+
+    def connect_kwargs(self, connect_kwargs, **fields):
+        """
+        Add a transport factory to paramiko.SSHClient.connect keyword
+        arguments that reports ``handshake`` and ``auth`` events, where
+        paramiko accepts a transport factory.
+
+        Args:
+            connect_kwargs (dict): keyword arguments, as returned by
+                TransportOptions.connect_kwargs
+            **fields: fields to add to the events.
+        Returns:
+            dict: connect_kwargs, updated.
+        """
+        if not TransportOptions.transport_factory_supported:
+            return connect_kwargs
+        factory = connect_kwargs.get("transport_factory", paramiko.Transport)
+
+        def traced_factory(sock, **kwargs):
+            transport = factory(sock, **kwargs)
+            transport.start_client = self._traced(transport.start_client, "handshake", fields)
+            for method in ("auth_publickey", "auth_password", "auth_interactive_dumb"):
+                setattr(transport, method, self._traced(
+                    getattr(transport, method), "auth", dict(fields, method=method[len("auth_"):])))
+            return transport
+
+        connect_kwargs["transport_factory"] = traced_factory
+        return connect_kwargs
+
+    def _traced(self, func, event, fields):
+        def traced(*args, **kwargs):
+            with self.span(event, **fields):
+                return func(*args, **kwargs)
+        return traced
+
+tracer = Tracer()
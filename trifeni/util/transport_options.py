@@ -0,0 +1,268 @@
+import inspect
+import logging
+
+import paramiko
+
+__all__ = [
+    "TransportOptions"
+]
+
+module_logger = logging.getLogger(__name__)
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+def _accepts_transport_factory():
+    try:
+        argspec = inspect.getfullargspec(paramiko.SSHClient.connect)
+    except AttributeError:
+        argspec = inspect.getargspec(paramiko.SSHClient.connect)
+    return "transport_factory" in argspec.args
+
+class TransportOptions(object):
+    """
+    Tunable SSH transport parameters. Any option left as None falls back to
+    paramiko's default.
+
+    Options can be set per host, in trifeni.config, and per tunnel, through the
+    ``transport_options`` argument to SSHTunnel. Per tunnel options take
+    precedence. ``ciphers``, ``macs`` and ``compression`` are negotiated once
+    per transport, whereas ``window_size`` and ``max_packet_size`` apply to
+    every channel, so tunnels that share transports can still use their own.
+
+    In a ~/.ssh/config file, the ``Ciphers``, ``MACs`` and ``Compression``
+    keywords are picked up for each host. Dictionary or JSON configurations can
+    additionally set ``WindowSize`` and ``MaxPacketSize``:
+
+    .. code-block:: python
+
+        config.ssh_configure({"remote": {
+            "HostName": "remote.address", "Port": 22, "User": "me",
+            "Ciphers": "aes128-gcm@openssh.com,aes128-ctr",
+            "Compression": "no",
+            "WindowSize": 16777216,
+            "MaxPacketSize": 32768}})
+
+    Attributes:
+        ciphers (tuple): preferred ciphers, in order of preference. Ciphers
+            not listed are not negotiated.
+        macs (tuple): preferred MACs, in order of preference.
+        compression (bool): Whether to ask for zlib compression.
+        window_size (int): channel window size, in bytes.
+        max_packet_size (int): channel max packet size, in bytes.
+    """
+    __slots__ = ("ciphers", "macs", "compression", "window_size", "max_packet_size")
+
+    config_keys = {
+        "Ciphers": "ciphers",
+        "MACs": "macs",
+        "Compression": "compression",
+        "WindowSize": "window_size",
+        "MaxPacketSize": "max_packet_size"
+    }
+
+    profiles = {
+        "default": {},
+        "lan": {"compression": False,
+                "ciphers": ("aes128-gcm@openssh.com", "aes128-ctr")},
+        "long-haul": {"compression": False,
+                      "window_size": 2**24,
+                      "max_packet_size": 2**15},
+        "compressed": {"compression": True}
+    }
+
+    transport_factory_supported = _accepts_transport_factory()
+
+    def __init__(self, ciphers=None, macs=None, compression=None,
+                 window_size=None, max_packet_size=None):
+        self.ciphers = self._as_tuple(ciphers)
+        self.macs = self._as_tuple(macs)
+        self.compression = self._as_bool(compression)
+        self.window_size = None if window_size is None else int(window_size)
+        self.max_packet_size = None if max_packet_size is None else int(max_packet_size)
+
+    @classmethod
+    def profile(cls, name):
+        """
+        Get one of the named profiles in ``profiles``.
+
+        Args:
+            name (str): "default", "lan", "long-haul" or "compressed"
+        Returns:
+            TransportOptions
+        """
+        if name not in cls.profiles:
+            raise ValueError("Unknown transport profile {}. Choose from {}".format(
+                name, sorted(cls.profiles)))
+        return cls(**cls.profiles[name])
+
+    @classmethod
+    def from_host_config(cls, host_info):
+        """
+        Create TransportOptions from a host entry in trifeni.config.hosts.
+
+        Args:
+            host_info (dict): host entry, as produced by Configuration.
+        Returns:
+            TransportOptions
+        """
+        if not isinstance(host_info, dict):
+            return cls()
+        kwargs = {}
+        for key in cls.config_keys:
+            if key in host_info:
+                kwargs[cls.config_keys[key]] = host_info[key]
+        return cls(**kwargs)
+
+    @classmethod
+    def create(cls, options):
+        """
+        Coerce options into TransportOptions.
+
+        Args:
+            options (TransportOptions/dict/str/None): Either an existing
+                instance, keyword arguments for __init__, or a profile name.
+        Returns:
+            TransportOptions
+        """
+        if options is None:
+            return cls()
+        elif isinstance(options, cls):
+            return options
+        elif isinstance(options, dict):
+            return cls(**options)
+        else:
+            return cls.profile(options)
+
+    def update(self, other):
+        """
+        Create new TransportOptions where options set in other take precedence.
+
+        Args:
+            other (TransportOptions/dict/str/None): see ``create``.
+        Returns:
+            TransportOptions
+        """
+        other = self.create(other)
+        merged = TransportOptions()
+        for name in self.__slots__:
+            value = getattr(other, name)
+            if value is None:
+                value = getattr(self, name)
+            setattr(merged, name, value)
+        return merged
+
+    def transport_key(self):
+        """
+        tuple: The options that are fixed once a transport is negotiated.
+            Tunnels can only share transports if these are equal.
+        """
+        return (self.ciphers, self.macs, self.compression)
+
+    def connect_kwargs(self):
+        """
+        Keyword arguments for paramiko.SSHClient.connect. When paramiko
+        accepts a ``transport_factory``, the cipher and MAC preference order
+        is applied before the handshake. Otherwise the options are reduced to
+        ``disabled_algorithms``, which restricts negotiation to the preferred
+        algorithms, in paramiko's order.
+
+        Returns:
+            dict
+        """
+        kwargs = {}
+        if self.compression is not None:
+            kwargs["compress"] = self.compression
+        if self.ciphers is None and self.macs is None:
+            return kwargs
+        if self.transport_factory_supported:
+            kwargs["transport_factory"] = self.transport_factory
+        else:
+            disabled = {}
+            if self.ciphers is not None:
+                disabled["ciphers"] = [c for c in paramiko.Transport._preferred_ciphers
+                                       if c not in self.ciphers]
+            if self.macs is not None:
+                disabled["macs"] = [m for m in paramiko.Transport._preferred_macs
+                                    if m not in self.macs]
+            kwargs["disabled_algorithms"] = disabled
+        return kwargs
+
+    def transport_factory(self, sock, **kwargs):
+        transport = paramiko.Transport(sock, **kwargs)
+        security_options = transport.get_security_options()
+        if self.ciphers is not None:
+            security_options.ciphers = [c for c in self.ciphers
+                                        if c in security_options.ciphers]
+        if self.macs is not None:
+            security_options.digests = [m for m in self.macs
+                                        if m in security_options.digests]
+        return transport
+
+    def apply(self, transport):
+        """
+        Apply the channel options to a connected paramiko.Transport. These
+        become the defaults for channels opened on, or accepted by, transport.
+        """
+        if self.window_size is not None:
+            transport.default_window_size = self.window_size
+        if self.max_packet_size is not None:
+            transport.default_max_packet_size = self.max_packet_size
+
+    def channel_kwargs(self):
+        """
+        dict: window_size and max_packet_size keyword arguments for
+            paramiko.Transport.open_channel
+        """
+        return {"window_size": self.window_size,
+                "max_packet_size": self.max_packet_size}
+
+    def ssh_args(self):
+        """
+        Command line options for the OpenSSH client. OpenSSH doesn't let
+        clients set the channel window or packet size, so window_size and
+        max_packet_size have no equivalent.
+
+        Returns:
+            list
+        """
+        args = []
+        if self.ciphers is not None:
+            args.extend(["-c", ",".join(self.ciphers)])
+        if self.macs is not None:
+            args.extend(["-m", ",".join(self.macs)])
+        if self.compression is not None:
+            args.extend(["-o", "Compression={}".format("yes" if self.compression else "no")])
+        return args
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__
+                if getattr(self, name) is not None}
+
+    def __eq__(self, other):
+        return isinstance(other, TransportOptions) and self.as_dict() == other.as_dict()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "TransportOptions({})".format(", ".join(
+            "{}={!r}".format(name, value) for name, value in sorted(self.as_dict().items())))
+
+    @staticmethod
+    def _as_tuple(value):
+        if value is None:
+            return None
+        if isinstance(value, string_types):
+            value = [v.strip() for v in value.split(",") if v.strip()]
+        return tuple(value)
+
+    @staticmethod
+    def _as_bool(value):
+        if value is None or isinstance(value, bool):
+            return value
+        if isinstance(value, string_types):
+            return value.strip().lower() in ("yes", "true", "on", "1")
+        return bool(value)
@@ -0,0 +1,277 @@
+import threading
+import logging
+
+import paramiko
+
+from .transport_options import TransportOptions
+from .tracing import tracer
+from .admission import HandshakeLimiter
+
+__all__ = [
+    "TransportPool"
+]
+
+module_logger = logging.getLogger(__name__)
+
+class TransportPool(object):
+    """
+    A group of SSH transports to a single remote host. A single paramiko
+    transport pushes every channel through one encrypted stream and one
+    transport thread, so new forwarded connections are instead spread across
+    ``size`` parallel transports. Transports that die are skipped, and
+    replaced with new connections.
+
+    Examples:
+
+    .. code-block:: python
+
+        pool = TransportPool("remote.address", 22, "me", "~/.ssh/id_rsa", size=4)
+        pool.connect()
+        index, transport = pool.acquire()
+        chan = transport.open_channel("direct-tcpip", ("localhost", 9090), ("", 0))
+        # relay data over chan
+        pool.release(index)
+        pool.close()
+
+    Attributes:
+        remote_ip (str): host address of the server to which we connect.
+        port (int): SSH login port on remote_ip.
+        username (str): username used for login.
+        keyfile (str): path to SSH key.
+        size (int): number of transports to open.
+        policy (str): How to pick a transport for a new connection. Either
+            "round-robin" or "least-loaded".
+        clients (list): paramiko.SSHClient instances, one per transport.
+        active (list): Number of channels currently relaying on each transport.
+        options (TransportOptions): SSH transport parameters for each transport.
+        limiter (HandshakeLimiter): admission control for the handshakes.
+        logger (logging.getLogger): logging instance
+    """
+    policies = ("round-robin", "least-loaded")
+
+    def __init__(self, remote_ip, port, username, keyfile,
+                 size=1, policy="round-robin", options=None, limiter=None, logger=None):
+        """
+        Args:
+            remote_ip (str): host address of remote server
+            port (int): remote login port.
+            username (str): remote username
+            keyfile (str): path the ssh key file.
+            size (int, optional): number of transports to open (1)
+            policy (str, optional): "round-robin" or "least-loaded"
+                ("round-robin")
+            options (TransportOptions/dict/str, optional): SSH transport
+                parameters. See TransportOptions.create.
+            limiter (HandshakeLimiter, optional): Defaults to the one shared
+                by connections to remote_ip and port.
+            logger (logging.getLogger, optional): logging instance.
+        """
+        if logger is None: logger = logging.getLogger(module_logger.name+".TransportPool")
+        self.logger = logger
+        if policy not in self.policies:
+            raise ValueError("Unknown stripe policy {}. Choose from {}".format(policy, self.policies))
+        if int(size) < 1:
+            raise ValueError("TransportPool needs at least one transport, got {}".format(size))
+        self.remote_ip = remote_ip
+        self.port = port
+        self.username = username
+        self.keyfile = keyfile
+        self.size = int(size)
+        self.policy = policy
+        self.options = TransportOptions.create(options)
+        if limiter is None: limiter = HandshakeLimiter.for_host((remote_ip, int(port)))
+        self.limiter = limiter
+        self.clients = []
+        self.active = []
+        self._next = 0
+        self._lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._credentials = None
+        self._reconnecting = False
+
+    @property
+    def transports(self):
+        """list: paramiko.Transport for each connected client."""
+        return [client.get_transport() for client in self.clients]
+
+    @staticmethod
+    def alive(client):
+        """Whether client's transport is still active."""
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    @property
+    def connected(self):
+        """bool: whether any of the pool's transports is active."""
+        with self._lock:
+            clients = list(self.clients)
+        return any(self.alive(client) for client in clients)
+
+    def dead(self):
+        """
+        Returns:
+            list: indices of the transports that are no longer active.
+        """
+        with self._lock:
+            return [i for i, client in enumerate(self.clients) if not self.alive(client)]
+
+    def connect(self, look_for_keys=False, password=None):
+        """
+        Open ``size`` SSH connections to the remote host. If any of them fails,
+        the ones already opened are closed and the error is raised. Calling
+        this on a pool that is already connected only replaces transports
+        that died, so tunnels sharing a pool can all call it.
+
+        Args:
+            look_for_keys (bool, optional): Automatically look for SSH keys.
+            password (str, optional): Password to use for each connection.
+        """
+        with self._connect_lock:
+            self._credentials = (look_for_keys, password)
+            if not self.clients:
+                self._connect(look_for_keys, password)
+            else:
+                self._reconnect(self.dead(), look_for_keys, password)
+
+    def reconnect(self):
+        """
+        Replace the transports that died, with the credentials of the last
+        ``connect``. Raises if none of the pool's transports is active after.
+        """
+        if self._credentials is None:
+            raise paramiko.SSHException("TransportPool to {}:{} was never connected".format(
+                self.remote_ip, self.port))
+        self.connect(*self._credentials)
+
+    def _open(self, i, look_for_keys, password):
+        kwargs = self.options.connect_kwargs()
+        if tracer.enabled:
+            kwargs = tracer.connect_kwargs(dict(kwargs), remote_ip=self.remote_ip,
+                                           port=self.port, transport=i)
+
+        def handshake():
+            client = paramiko.SSHClient()
+            client.load_system_host_keys()
+            client.set_missing_host_key_policy(paramiko.WarningPolicy())
+            try:
+                client.connect(self.remote_ip, self.port, username=self.username,
+                               key_filename=self.keyfile,
+                               look_for_keys=look_for_keys, password=password,
+                               **kwargs)
+            except Exception:
+                client.close()
+                raise
+            return client
+
+        with tracer.span("connect", remote_ip=self.remote_ip, port=self.port, transport=i):
+            client = self.limiter.run(handshake)
+        self.options.apply(client.get_transport())
+        return client
+
+    def _connect(self, look_for_keys, password):
+        clients = []
+        try:
+            for i in range(self.size):
+                clients.append(self._open(i, look_for_keys, password))
+        except Exception:
+            for client in clients:
+                client.close()
+            raise
+        self.logger.debug("connect: opened {} transport(s) to {}:{}".format(
+            self.size, self.remote_ip, self.port))
+        with self._lock:
+            self.clients = clients
+            self.active = [0 for client in clients]
+
+    def _reconnect(self, indices, look_for_keys, password):
+        error = None
+        for i in indices:
+            try:
+                client = self._open(i, look_for_keys, password)
+            except Exception as err:
+                self.logger.error("connect: Couldn't replace transport {} to {}:{}: {}".format(
+                    i, self.remote_ip, self.port, err))
+                error = err
+                continue
+            with self._lock:
+                # channels still open on the old transport release their
+                # count as they close.
+                dead, self.clients[i] = self.clients[i], client
+            dead.close()
+            self.logger.debug("connect: replaced transport {} to {}:{}".format(i, self.remote_ip, self.port))
+        if error is not None and not self.connected:
+            raise error
+
+    def _reconnect_in_background(self):
+        with self._lock:
+            if self._reconnecting:
+                return
+            self._reconnecting = True
+
+        def reconnect():
+            try:
+                self.reconnect()
+            except Exception as err:
+                self.logger.debug("acquire: reconnect failed: {}".format(err))
+            finally:
+                with self._lock:
+                    self._reconnecting = False
+
+        thread = threading.Thread(target=reconnect)
+        thread.daemon = True
+        thread.start()
+
+    def acquire(self):
+        """
+        Pick a transport for a new channel, according to ``policy``.
+        Transports that are no longer active are skipped, and replaced in
+        the background. If none is active, they're replaced first.
+
+        Returns:
+            tuple: index of the transport in the pool, and the paramiko.Transport
+                itself. The index has to be handed back to ``release`` once the
+                channel is closed.
+        """
+        try:
+            return self._acquire()
+        except paramiko.SSHException:
+            if self._credentials is None:
+                raise
+            self.logger.debug("acquire: no active transports to {}:{}, reconnecting".format(
+                self.remote_ip, self.port))
+            self.reconnect()
+            return self._acquire()
+
+    def _acquire(self):
+        with self._lock:
+            candidates = [i for i, client in enumerate(self.clients) if self.alive(client)]
+            if not candidates:
+                raise paramiko.SSHException(
+                    "No active transports to {}:{}".format(self.remote_ip, self.port))
+            if self.policy == "least-loaded":
+                index = min(candidates, key=lambda i: self.active[i])
+            else:
+                index = candidates[self._next % len(candidates)]
+                self._next += 1
+            self.active[index] += 1
+            transport = self.clients[index].get_transport()
+            dead = len(candidates) < len(self.clients)
+        if dead and self._credentials is not None:
+            self._reconnect_in_background()
+        return index, transport
+
+    def release(self, index):
+        """
+        Signal that a channel acquired on transport ``index`` has been closed.
+        """
+        with self._lock:
+            if index < len(self.active):
+                self.active[index] -= 1
+
+    def close(self):
+        """Close every transport in the pool."""
+        self._credentials = None
+        with self._lock:
+            clients, self.clients, self.active = self.clients, [], []
+        for client in clients:
+            client.close()
@@ -1,88 +1,482 @@
 import uuid
-import re
+import json
 import time
 import threading
-import Queue
 import logging
-import sys
 import getpass
 import os
 import socket
 import select
+try:
+    import selectors
+except ImportError: # Python 2: every forward server runs on a thread of its own
+    selectors = None
 try:
     import SocketServer
 except ImportError:
     import socketserver as SocketServer
-
-import paramiko
-
-from .shell_util import check_connection
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+from .transport_pool import TransportPool
+from .transport_options import TransportOptions
+from .socket_options import SocketOptions
+from .streamlocal import is_socket_path, test_unix_socket, open_streamlocal_channel
+from .openssh_tunnel import ControlMaster, OpenSSHTunnel
+from .thread_util import thread_map
+from .port_util import test_port, classify_bind_error, port_owner, ListeningPorts
+from .metrics import metrics, TunnelStats
+from .tracing import tracer
+from .link_emulator import link_emulator
+from .scheduling import TrafficScheduler, TunnelTraffic
+from .framing import PyroFramer
 from ..configuration import config
-from ..errors import TunnelError
+from ..errors import TunnelError, PortInUseError
 
 __all__ = [
     "SSHTunnel",
     "SSHTunnelManager",
-    "test_port"
+    "resolve_host"
 ]
 
 module_logger = logging.getLogger(__name__)
 
-class ForwardServer(SocketServer.ThreadingTCPServer):
+def unanswered(requests, responses, awaiting_response):
+    """
+    Number of requests on a relay still waiting for their response: from
+    the Pyro4 messages seen, if it carries Pyro4, or else one if the last
+    data went towards the side the tunnel connects to.
+    """
+    if requests.valid and responses.valid:
+        return max(requests.replies_due - responses.messages, 0)
+    return int(awaiting_response)
+
+def close_channel(chan):
+    """Close chan, which may belong to a transport that was closed under it."""
+    try:
+        chan.close()
+    except (EOFError, socket.error) as err:
+        module_logger.debug("close_channel: {}: {!r}".format(chan, err))
+
+class AcceptLoop(object):
+    """
+    A single thread accepting connections for every forward server added to
+    it, instead of each server running ``serve_forever`` on a thread of its
+    own. Accepted connections are still handled on threads of their own.
+
+    Servers are added and removed by the loop's own thread, between calls
+    to select, so removing a server waits for the loop to let go of it.
+
+    Attributes:
+        poll_interval (float): seconds the loop waits in select before
+            applying pending changes anyway.
+        thread (threading.Thread): the loop's thread, started when the first
+            server is added.
+    """
+    poll_interval = 0.5
+
+    def __init__(self):
+        self.thread = None
+        self._selector = None
+        self._changes = []
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = None, None
+
+    def add(self, server):
+        """Start accepting connections for server."""
+        self._change(server, True)
+
+    def remove(self, server):
+        """Stop accepting connections for server."""
+        self._change(server, False)
+
+    def _change(self, server, add):
+        done = threading.Event()
+        with self._lock:
+            if self.thread is None or not self.thread.is_alive():
+                if not add:
+                    return
+                self._selector = selectors.DefaultSelector()
+                self._wake_r, self._wake_w = socket.socketpair()
+                self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            self._changes.append((server, add, done))
+            try:
+                self._wake_w.send(b"\0")
+            except socket.error:
+                pass
+        done.wait()
+
+    def _apply_changes(self):
+        with self._lock:
+            changes, self._changes = self._changes, []
+        for server, add, done in changes:
+            try:
+                if add:
+                    self._selector.register(server.socket, selectors.EVENT_READ, server)
+                else:
+                    self._selector.unregister(server.socket)
+            except (KeyError, ValueError) as err:
+                module_logger.debug("AcceptLoop._apply_changes: {}: {}".format(server, err))
+            done.set()
+
+    def _run(self):
+        while True:
+            self._apply_changes()
+            for key, events in self._selector.select(self.poll_interval):
+                if key.data is None:
+                    try:
+                        self._wake_r.recv(4096)
+                    except socket.error:
+                        pass
+                else:
+                    key.data._handle_request_noblock()
+
+accept_loop = AcceptLoop()
+
+class ForwardServerMixin(object):
+    """
+    What forward servers share, whatever they listen on.
+
+    Where connections go is set on the server with ``set_route``, and read
+    by the (single, shared) ForwardHandler class, so that tunnels don't need
+    handler classes of their own.
+
+    The relays a server is running are kept track of so that they can be
+    drained: once the server stops accepting connections, each relay is
+    closed as soon as it is idle. Pyro4 connections are idle once every
+    call on them has had its whole response (see ``PyroFramer``). Other
+    connections are idle when the last data went to the client, and nothing
+    has moved for ``drain_quiet`` seconds. Relays are checked every
+    ``drain_poll`` seconds.
+    """
+    drain_quiet = 1.0
+    drain_poll = 0.02
+    chain_host = None
+    chain_port = None
+    transport_pool = None
+    transport_options = None
+    tunnel_id = None
+    stats = None
+    traffic = None
+    accept_loop = None
+    serving_forever = False
+
+    def set_route(self, chain_host, chain_port, transport_pool, transport_options, tunnel_id=None,
+                  stats=None, traffic=None):
+        """
+        Set where connections accepted by the server are forwarded.
+
+        Args:
+            chain_host (str): relay address, as seen from the SSH server.
+            chain_port (int/str): port, or Unix domain socket path.
+            transport_pool (TransportPool): transports for the channels.
+            transport_options (TransportOptions): channel parameters.
+            tunnel_id (str, optional): ID of the tunnel, for tracing.
+            stats (TunnelStats, optional): counters the relays update.
+            traffic (TunnelTraffic, optional): priority and rate cap of the
+                tunnel's traffic.
+        """
+        self.chain_host = chain_host
+        self.chain_port = chain_port
+        self.transport_pool = transport_pool
+        self.transport_options = transport_options
+        self.tunnel_id = tunnel_id
+        self.stats = stats if stats is not None else TunnelStats()
+        self.traffic = traffic
+
+    def serve_in(self, loop):
+        """
+        Accept connections on loop's thread, rather than with serve_forever.
+
+        Args:
+            loop (AcceptLoop): shared accept loop.
+        """
+        loop.add(self)
+        self.accept_loop = loop
+
+    def serve_forever(self, *args, **kwargs):
+        self.serving_forever = True
+        SocketServer.BaseServer.serve_forever(self, *args, **kwargs)
+
+    def shutdown(self):
+        if self.accept_loop is not None:
+            self.accept_loop.remove(self)
+            self.accept_loop = None
+        elif self.serving_forever:
+            # BaseServer.shutdown waits for serve_forever, so only call it
+            # on servers that ran it.
+            SocketServer.BaseServer.shutdown(self)
+
+    def init_relays(self):
+        self.relays = set()
+        self.relays_changed = threading.Condition()
+
+    def relay_started(self, handler):
+        with self.relays_changed:
+            self.relays.add(handler)
+
+    def relay_finished(self, handler):
+        with self.relays_changed:
+            self.relays.discard(handler)
+            self.relays_changed.notify_all()
+
+    def drain(self, timeout, quiet=None):
+        """
+        Wait for relays to finish, closing idle ones, for at most timeout
+        seconds, and then close whatever is left. Call this after the server
+        has stopped accepting connections.
+
+        Args:
+            timeout (float): seconds to wait.
+            quiet (float, optional): seconds a connection that isn't Pyro4
+                has to be quiet for to count as idle. Defaults to
+                ``drain_quiet``.
+        Returns:
+            tuple: number of relays that were active, closed while idle,
+                and closed at the deadline.
+        """
+        if quiet is None: quiet = self.drain_quiet
+        deadline = time.time() + timeout
+        with self.relays_changed:
+            active = len(self.relays)
+        closed = set()
+        while True:
+            with self.relays_changed:
+                relays = list(self.relays)
+                if not relays or time.time() >= deadline:
+                    break
+                self.relays_changed.wait(min(self.drain_poll, max(deadline - time.time(), 0)))
+            for relay in relays:
+                if relay not in closed and relay.close_if_idle(quiet):
+                    closed.add(relay)
+        forced = [relay for relay in relays if relay not in closed]
+        for relay in forced:
+            relay.close_relay()
+        return active, len(closed), len(forced)
+
+class ForwardServer(ForwardServerMixin, SocketServer.ThreadingTCPServer):
     daemon_threads = True
     allow_reuse_address = True
+    def __init__(self, server_address, RequestHandlerClass, socket_options=None):
+        self.socket_options = SocketOptions.create(socket_options)
+        self.init_relays()
+        SocketServer.ThreadingTCPServer.__init__(self, server_address, RequestHandlerClass)
+
     def server_bind(self):
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # buffer sizes have to be set before listen to apply to accepted sockets.
+        self.socket_options.apply(self.socket)
         self.socket.bind(self.server_address)
 
+class UnixForwardServer(ForwardServerMixin, SocketServer.ThreadingUnixStreamServer):
+    """
+    ForwardServer listening on a Unix domain socket path instead of a TCP port.
+    A stale socket file that nothing listens on is replaced.
+    """
+    daemon_threads = True
+    def __init__(self, server_address, RequestHandlerClass, socket_options=None):
+        self.socket_options = SocketOptions.create(socket_options)
+        self.init_relays()
+        SocketServer.ThreadingUnixStreamServer.__init__(self, server_address, RequestHandlerClass)
+
+    def server_bind(self):
+        if os.path.exists(self.server_address) and not test_unix_socket(self.server_address):
+            os.unlink(self.server_address)
+        self.socket_options.apply(self.socket)
+        self.socket.bind(self.server_address)
+
+    def server_close(self):
+        SocketServer.ThreadingUnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
 class ForwardHandler(SocketServer.BaseRequestHandler):
     """
     Class for handling forward SSH connection. Taken, with some modification
-    from paramiko examples.
+    from paramiko examples. Where the connection goes is read from the
+    server's route (see ``ForwardServerMixin.set_route``).
+
+    Data is relayed ``buffer_size`` bytes at a time at most: each read turns
+    into an SSH packet, so small reads cost throughput.
     """
-    def __init__(self, *args, **kwargs):
+    buffer_size = 32768
+
+    def __init__(self, request, client_address, server):
+        self.chain_host = server.chain_host
+        self.chain_port = server.chain_port
+        self.transport_pool = server.transport_pool
+        self.transport_options = server.transport_options
+        self.tunnel_id = server.tunnel_id
+        self.stats = server.stats
+        self.traffic = server.traffic
         self.running = threading.Event()
         self.running.set()
-        SocketServer.BaseRequestHandler.__init__(self, *args, **kwargs)
+        self.last_activity = time.time()
+        self.awaiting_response = False
+        self.requests = PyroFramer()
+        self.responses = PyroFramer()
+        self.relaying = threading.Lock()
+        SocketServer.BaseRequestHandler.__init__(self, request, client_address, server)
+
+    def idle(self, quiet):
+        """
+        Whether the relay can be closed without cutting off a response. For
+        Pyro4 connections, no message is partway through in either
+        direction, and every call has had its response. Otherwise, the last
+        data went to the client, and nothing has moved for quiet seconds.
+        """
+        requests, responses = self.requests, self.responses
+        if requests.valid and responses.valid:
+            return (not requests.partial and not responses.partial and
+                    requests.replies_due <= responses.messages)
+        return not self.awaiting_response and time.time() - self.last_activity >= quiet
+
+    def close_if_idle(self, quiet):
+        """
+        Close the relay if it's idle. A relay that's partway through passing
+        on a chunk of data isn't: data it has read, but not yet sent on,
+        would be lost.
+
+        Returns:
+            bool: whether the relay was closed.
+        """
+        if not self.relaying.acquire(False):
+            return False
+        try:
+            if not self.idle(quiet):
+                return False
+            self.close_relay()
+            return True
+        finally:
+            self.relaying.release()
+
+    def close_relay(self):
+        """Make the relay loop exit, from another thread."""
+        self.running.clear()
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
 
     def handle(self):
+        self.accepted = time.time() if tracer.enabled else None
+        self.server.socket_options.apply(self.request)
         try:
-            chan = self.ssh_transport.open_channel("direct-tcpip",
-                                                   (self.chain_host, self.chain_port),
-                                                   self.request.getpeername())
+            index, transport = self.transport_pool.acquire()
+        except Exception as err:
+            module_logger.debug("ForwardHandler.handler: No transport for request to {}:{}: {}".format(
+                self.chain_host, self.chain_port, err
+            ))
+            self.stats.failed()
+            if tracer.enabled:
+                tracer.emit("error", stage="channel.open", error=repr(err),
+                            tunnel_id=self.tunnel_id, chain_host=self.chain_host, chain_port=self.chain_port)
+            return
+        self.server.relay_started(self)
+        try:
+            self.relay(transport)
+        finally:
+            self.server.relay_finished(self)
+            self.transport_pool.release(index)
+
+    def open_channel(self, transport):
+        if is_socket_path(self.chain_port):
+            return open_streamlocal_channel(transport, self.chain_port,
+                                            **self.transport_options.channel_kwargs())
+        src_addr = self.request.getpeername()
+        if not isinstance(src_addr, tuple): # Unix domain socket client
+            src_addr = ("localhost", 0)
+        return transport.open_channel("direct-tcpip",
+                                      (self.chain_host, self.chain_port),
+                                      src_addr,
+                                      **self.transport_options.channel_kwargs())
+
+    def relay(self, transport):
+        stats, traffic = self.stats, self.traffic
+        open_start = time.time()
+        try:
+            with tracer.span("channel.open", tunnel_id=self.tunnel_id,
+                             chain_host=self.chain_host, chain_port=self.chain_port):
+                chan = self.open_channel(transport)
         except Exception as err:
             module_logger.debug("ForwardHandler.handler: Incoming request to {}:{} failed: {}".format(
                 self.chain_host,self.chain_port, err
             ))
+            stats.failed()
             return
         if chan is None:
             module_logger.debug(
                 "ForwardHandler.handler: Incoming request to {}:{} was rejected by the SSH server.".format(
                     self.chain_host, self.chain_port
             ))
+            stats.failed()
             return
+        stats.opened(time.time() - open_start)
 
-        module_logger.debug("ForwardHandler.handler: Connected!  Tunnel open {} -> {} -> {}:{}".format(
-                    self.request.getpeername(),chan.getpeername(),self.chain_host, self.chain_port
-        ))
-        while self.running.is_set():
-            # I think this is where we relay data between client and server
-            r, w, x = select.select([self.request, chan], [], [])
-            if self.request in r:
-                data = self.request.recv(1024)
-                if len(data) == 0:
-                    break
-                chan.send(data)
-            if chan in r:
-                data = chan.recv(1024)
-                if len(data) == 0:
-                    break
-                self.request.send(data)
-
-        peername = self.request.getpeername()
-        chan.close()
-        self.request.close()
-        module_logger.debug("ForwardHandler.handler: Tunnel closed from {}".format(peername))
+        if module_logger.isEnabledFor(logging.DEBUG):
+            module_logger.debug("ForwardHandler.handler: Connected!  Tunnel open {} -> {} -> {}:{}".format(
+                        self.request.getpeername(),chan.getpeername(),self.chain_host, self.chain_port
+            ))
+        bytes_out, bytes_in = 0, 0
+        send_out, send_in = link_emulator.wrap(chan.sendall), link_emulator.wrap(self.request.sendall)
+        try:
+            while self.running.is_set():
+                # I think this is where we relay data between client and server
+                r, w, x = select.select([self.request, chan], [], [])
+                if traffic is not None:
+                    traffic.wait_turn()
+                if self.request in r:
+                    with self.relaying:
+                        data = self.request.recv(self.buffer_size)
+                        if len(data) == 0:
+                            break
+                        started = self.requests.feed(data)
+                        if traffic is not None:
+                            if not self.requests.valid:
+                                started = int(not self.awaiting_response)
+                            traffic.request_data(len(data), started)
+                        self.awaiting_response = True
+                        self.last_activity = time.time()
+                        bytes_out += len(data)
+                        stats.transferred(bytes_out=len(data))
+                        send_out(data)
+                if chan in r:
+                    with self.relaying:
+                        data = chan.recv(self.buffer_size)
+                        if len(data) == 0:
+                            break
+                        answered = self.responses.feed(data)
+                        if traffic is not None:
+                            if not (self.requests.valid and self.responses.valid):
+                                answered = int(self.awaiting_response)
+                            traffic.response_data(len(data), answered)
+                        self.awaiting_response = False
+                        self.last_activity = time.time()
+                        if bytes_in == 0 and self.accepted is not None:
+                            tracer.emit("relay.first_byte", start=self.accepted, tunnel_id=self.tunnel_id,
+                                        chain_host=self.chain_host, chain_port=self.chain_port)
+                        bytes_in += len(data)
+                        stats.transferred(bytes_in=len(data))
+                        send_in(data)
+        finally:
+            stats.closed()
+            if traffic is not None:
+                traffic.response_data(0, unanswered(self.requests, self.responses, self.awaiting_response))
+            link_emulator.flush(send_out, send_in)
+            close_channel(chan)
+            self.request.close()
+        if self.accepted is not None:
+            tracer.emit("relay.close", start=self.accepted, tunnel_id=self.tunnel_id, chain_host=self.chain_host,
+                        chain_port=self.chain_port, bytes_out=bytes_out, bytes_in=bytes_in)
+        module_logger.debug("ForwardHandler.handler: Tunnel closed to {}:{}".format(
+            self.chain_host, self.chain_port))
 
     def serve_forever(self):
         while self.running.is_set():
@@ -95,42 +489,95 @@ class ForwardHandler(SocketServer.BaseRequestHandler):
 class ReverseHandler(object):
     """
     Class for handling reverse SSH connection. Taken, with some modification
-    from paramiko examples.
+    from paramiko examples. Data is relayed ``buffer_size`` bytes at a time
+    at most, as with ForwardHandler.
     """
-    def __init__(self, transport, relay_ip, remote_port):
+    buffer_size = 32768
+
+    def __init__(self, transport, relay_ip, remote_port, socket_options=None, stats=None,
+                 traffic=None):
 
         self.running = threading.Event()
         self.running.set()
         self.transport = transport
         self.relay_ip = relay_ip
         self.remote_port = remote_port
+        self.socket_options = SocketOptions.create(socket_options)
+        self.stats = stats if stats is not None else TunnelStats()
+        self.traffic = traffic
         self.reverse_thread_queue = Queue.Queue()
 
     def reverse_handler(self, chan):
-        sock = socket.socket()
+        accepted = time.time() if tracer.enabled else None
         host, port = self.relay_ip, self.remote_port
+        if is_socket_path(port):
+            sock, address = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM), port
+        else:
+            sock, address = socket.socket(), (host, port)
+        self.socket_options.apply(sock)
+        stats, traffic = self.stats, self.traffic
+        connect_start = time.time()
         try:
-            sock.connect((host, port))
+            sock.connect(address)
         except Exception as err:
             module_logger.debug("ReverseHandler.reverse_handler: Forwarding request to {}:{} failed: {}".format(host, port, err))
+            stats.failed()
+            close_channel(chan)
+            sock.close()
+            if accepted is not None:
+                tracer.emit("error", start=accepted, stage="reverse.connect", error=repr(err),
+                            chain_host=host, chain_port=port)
             return
 
-        module_logger.debug("ReverseHandler.reverse_handler: Connected!  Tunnel open {} -> {} -> {}".format(chan.origin_addr,
-                                                            chan.getpeername(), (host, port)))
-        while self.running.is_set():
-            r, w, x = select.select([sock, chan], [], [])
-            if sock in r:
-                data = sock.recv(1024)
-                if len(data) == 0:
-                    break
-                chan.send(data)
-            if chan in r:
-                data = chan.recv(1024)
-                if len(data) == 0:
-                    break
-                sock.send(data)
-        chan.close()
-        sock.close()
+        if module_logger.isEnabledFor(logging.DEBUG):
+            module_logger.debug("ReverseHandler.reverse_handler: Connected!  Tunnel open {} -> {} -> {}".format(chan.origin_addr,
+                                                                chan.getpeername(), (host, port)))
+        stats.opened(time.time() - connect_start)
+        bytes_out, bytes_in = 0, 0
+        awaiting_response = False
+        requests, responses = PyroFramer(), PyroFramer()
+        send_chan, send_sock = link_emulator.wrap(chan.sendall), link_emulator.wrap(sock.sendall)
+        try:
+            while self.running.is_set():
+                r, w, x = select.select([sock, chan], [], [])
+                if traffic is not None:
+                    traffic.wait_turn()
+                if sock in r:
+                    data = sock.recv(self.buffer_size)
+                    if len(data) == 0:
+                        break
+                    answered = responses.feed(data)
+                    if traffic is not None:
+                        if not (requests.valid and responses.valid):
+                            answered = int(awaiting_response)
+                        traffic.response_data(len(data), answered)
+                    awaiting_response = False
+                    bytes_in += len(data)
+                    stats.transferred(bytes_in=len(data))
+                    send_chan(data)
+                if chan in r:
+                    data = chan.recv(self.buffer_size)
+                    if len(data) == 0:
+                        break
+                    started = requests.feed(data)
+                    if traffic is not None:
+                        if not requests.valid:
+                            started = int(not awaiting_response)
+                        traffic.request_data(len(data), started)
+                    awaiting_response = True
+                    bytes_out += len(data)
+                    stats.transferred(bytes_out=len(data))
+                    send_sock(data)
+        finally:
+            stats.closed()
+            if traffic is not None:
+                traffic.response_data(0, unanswered(requests, responses, awaiting_response))
+            link_emulator.flush(send_chan, send_sock)
+            close_channel(chan)
+            sock.close()
+        if accepted is not None:
+            tracer.emit("relay.close", start=accepted, chain_host=host, chain_port=port,
+                        reverse=True, bytes_out=bytes_out, bytes_in=bytes_in)
         module_logger.debug("ReverseHandler.reverse_handler: Tunnel closed from {}".format(chan.origin_addr,))
 
     def serve_forever(self):
@@ -153,6 +600,10 @@ class ReverseHandler(object):
         module_logger.debug("ReverseHandler.shutdown: called")
         self.running.clear()
         module_logger.debug("ReverseHandler.shutdown: self.running cleared")
+        # wake serve_forever from transport.accept, rather than leave its
+        # thread around until accept times out.
+        with self.transport.lock:
+            self.transport.server_accept_cv.notify_all()
         while not self.reverse_thread_queue.empty():
             reverse_thread = self.reverse_thread_queue.get()
             module_logger.debug("ReverseHandler.shutdown: {}".format(reverse_thread))
@@ -195,19 +646,37 @@ class SSHTunnel(object):
             connect.
         relay_ip (str): host address of relay server. This is the address in
             supplied to the ``-L`` parameter of the command SSH client
-        local_port (int): The local forwarding port. This is the port before
-            the address in the ``-L`` command line SSH client paramter.
-        remote_port (int): The remote forwarding port. This is the port after
-            the address in the ``-L`` command line SSH client parameter
+        local_port (int/str): The local forwarding port. This is the port before
+            the address in the ``-L`` command line SSH client paramter. For
+            forward tunnels, this can also be a Unix domain socket path.
+        remote_port (int/str): The remote forwarding port. This is the port after
+            the address in the ``-L`` command line SSH client parameter. This
+            can also be a Unix domain socket path, on the remote host for
+            forward tunnels (``direct-streamlocal@openssh.com``), or the
+            local target for reverse tunnels.
         port (int): The port associated with remote_ip, ie a port on which
             remote_ip is listening. This corresponds to the ``-p`` option in
             the command line SSH client.
         username (str): The username to use for connecting to remote_ip. This
             corresponds to the ``-l`` command line SSH client option.
         tunnel_id (str): A UUID for this tunnel
-        tunnel_thread (threading.Thread): a thread on which the socket server
-            runs
+        tunnel_thread (threading.Thread): the thread on which a reverse
+            tunnel's server runs. Forward tunnels are served by the shared
+            accept loop's thread, so this is None for them.
         client (paramiko.SSHClient): The paramiko SSH client
+        transport_pool (TransportPool): The SSH transports over which forwarded
+            connections are spread. ``client`` is the first of these.
+        owns_transport_pool (bool): Whether this tunnel created transport_pool,
+            and is therefore responsible for closing it.
+        transport_options (TransportOptions): SSH transport parameters. These
+            are the host's options from trifeni.config, updated with any
+            options passed to __init__.
+        socket_options (SocketOptions): options for the local sockets that
+            carry tunneled traffic.
+        stats (TunnelStats): connection, traffic and error counters, updated
+            by the relays.
+        traffic (TunnelTraffic): priority class and rate cap of the tunnel's
+            traffic, or None if it has neither.
         server (server instance): socket server.
         reverse (bool): Whether or not this is a reverse tunnel
         open (bool): Whether or not the tunnel is active
@@ -219,19 +688,29 @@ class SSHTunnel(object):
         ssh -l ``username`` -p ``port`` -L ``local_port``:``relay_ip``:``remote_port`` ``remote_ip``
 
     """
+    __slots__ = ("logger", "remote_alias", "remote_ip", "port", "relay_ip", "local_port",
+                 "remote_port", "reverse", "username", "transport_options", "socket_options",
+                 "keyfile", "tunnel_id", "tunnel_thread", "client", "server", "open",
+                 "owns_transport_pool", "transport_pool", "stats", "traffic")
+
     def __init__(self,
                 remote_ip, relay_ip,
                 local_port, remote_port,
                 port=22, username=None,
                 keyfile=None,look_for_keys=False,
                 wait_for_password=False,reverse=False,
-                tunnel_id=None, logger=None):
+                tunnel_id=None, logger=None,
+                transports=1, stripe_policy="round-robin",
+                transport_pool=None, transport_options=None,
+                socket_options=None, traffic_class=None, rate_limit=None):
         """
         Args:
             remote_ip (str): Either an alias or an actual address
             relay_ip (str): forwarding address
-            local_port (int): local forwarding port
-            remote_port (int): remote forwarding port.
+            local_port (int/str): local forwarding port, or Unix domain socket
+                path for forward tunnels.
+            remote_port (int/str): remote forwarding port, or Unix domain
+                socket path.
             port (int, optional): remote login port.
             username (str, optional): remote username
             keyfile (str, optional): path the ssh key file.
@@ -241,19 +720,37 @@ class SSHTunnel(object):
                 reverse or not
             tunnel_id (str, optional): some UUID for this tunnel.
             logger (logging.getLogger, optional): logging instance.
+            transports (int, optional): Number of parallel SSH transports
+                over which forwarded connections get spread. Ignored if
+                transport_pool is provided.
+            stripe_policy (str, optional): "round-robin" or "least-loaded".
+                Ignored if transport_pool is provided.
+            transport_pool (TransportPool, optional): A pool of transports
+                shared with other tunnels to the same host. The tunnel won't
+                close a pool it didn't create.
+            transport_options (TransportOptions/dict/str, optional): SSH
+                transport parameters for this tunnel, or the name of a
+                TransportOptions profile. These take precedence over the
+                host's options in trifeni.config.
+            socket_options (SocketOptions/dict/str, optional): options for
+                the local listening and accepted sockets of forward tunnels,
+                the target sockets of reverse tunnels and the SSH transport
+                sockets, or the name of a SocketOptions profile. Defaults to
+                the "default" profile, which sets TCP_NODELAY.
+            traffic_class (TrafficClass/dict/str, optional): priority class
+                of the tunnel's traffic, like "control" or "bulk". While a
+                request on a tunnel waits for its response, tunnels of less
+                urgent classes to the same host hold off. A class's
+                window_size applies unless transport_options set one.
+            rate_limit (float, optional): cap on the tunnel's traffic, in
+                bytes per second in each direction.
         """
         if logger is None: logger = logging.getLogger(module_logger.name+".SSHTunnel")
         self.logger = logger
 
-        remote_alias = None
-        if remote_ip in config.hosts:
-            remote_alias = remote_ip
-            remote_info = config.hosts[remote_alias]
-            port = remote_info["Port"]
-            username = remote_info.get("User", None)
-            remote_ip = remote_info["HostName"]
-            keyfile = remote_info.get("IdentityFile", None)
-            self.logger.debug("__init__: remote_info for host alias {}: {}".format(remote_alias, remote_info))
+        remote_alias, remote_ip, port, username, keyfile = resolve_host(
+            remote_ip, port=port, username=username, keyfile=keyfile
+        )
 
         self.remote_alias = remote_alias
         self.remote_ip = remote_ip
@@ -262,10 +759,18 @@ class SSHTunnel(object):
         self.local_port = local_port
         self.remote_port = remote_port
         self.reverse = reverse
-
-        if username is None:
-            username = getpass.getuser()
         self.username = username
+        self.transport_options = TransportOptions.from_host_config(
+            config.get_host(remote_alias)
+        ).update(transport_options)
+        self.socket_options = SocketOptions.create(socket_options)
+        self.traffic = None
+        if traffic_class is not None or rate_limit is not None:
+            self.traffic = TunnelTraffic(traffic_class, TrafficScheduler.for_host((remote_ip, port)),
+                                         rate_limit)
+            window_size = getattr(self.traffic.traffic_class, "window_size", None)
+            if window_size is not None and self.transport_options.window_size is None:
+                self.transport_options = self.transport_options.update({"window_size": window_size})
 
         if keyfile is None:
             keyfile = config.default_identity_file
@@ -287,14 +792,65 @@ class SSHTunnel(object):
         self.client = None
         self.server = None
         self.open = False
+        self.stats = TunnelStats()
+
+        self.owns_transport_pool = transport_pool is None
+        if transport_pool is None:
+            transport_pool = TransportPool(self.remote_ip, self.port, self.username, self.keyfile,
+                                           size=transports, policy=stripe_policy,
+                                           options=self.transport_options)
+        self.transport_pool = transport_pool
 
         if self.reverse:
-            self.connect(look_for_keys=look_for_keys, wait_for_password=wait_for_password)
+            if is_socket_path(self.local_port):
+                raise TunnelError("Reverse tunnels can't listen on remote Unix domain socket {}".format(
+                    self.local_port))
         else:
-            if not self.check_conflict():
-                self.connect(look_for_keys=look_for_keys, wait_for_password=wait_for_password)
-            else:
-                raise TunnelError("Will not be able to bind {}:{}".format(self.relay_ip, self.local_port))
+            # Bind the listener up front, and hold it: a separate probe could
+            # race with other tunnels binding the same port.
+            self.server = self.bind()
+        self.connect(look_for_keys=look_for_keys, wait_for_password=wait_for_password)
+
+    def bind(self):
+        """
+        Bind and listen on the local end of a forward tunnel. Connections
+        aren't accepted until the tunnel is connected.
+
+        Returns:
+            ForwardServer or UnixForwardServer
+        Raises:
+            PortInUseError: if something else is bound to the local end, with
+                the process listening on it, if it can be found.
+            TunnelError: if the port can't be bound for another reason.
+        """
+        try:
+            if is_socket_path(self.local_port):
+                if test_unix_socket(self.local_port):
+                    raise PortInUseError("Will not be able to bind {}: already listening".format(self.local_port),
+                                         port=self.local_port)
+                return UnixForwardServer(self.local_port, ForwardHandler,
+                                         socket_options=self.socket_options)
+            return ForwardServer(("", self.local_port), ForwardHandler,
+                                 socket_options=self.socket_options)
+        except socket.error as err:
+            kind = classify_bind_error(err)
+            self.logger.debug("bind: {}:{}: {} ({})".format(self.relay_ip, self.local_port, err, kind))
+            if kind == "in-use":
+                listening = ListeningPorts()
+                if listening.available and not listening.in_use(self.local_port):
+                    raise PortInUseError(
+                        ("Will not be able to bind {}:{}: bound by a socket that isn't listening, "
+                         "like an outgoing connection: {}").format(self.relay_ip, self.local_port, err),
+                        port=self.local_port)
+                owner = port_owner(self.local_port, listening) if listening.available else None
+                raise PortInUseError("Will not be able to bind {}:{}: already listening{}".format(
+                    self.relay_ip, self.local_port, "" if owner is None else ", by {}".format(owner)),
+                    port=self.local_port, owner=owner)
+            elif kind == "permission":
+                raise TunnelError("Will not be able to bind {}:{}: privileged port: {}".format(
+                    self.relay_ip, self.local_port, err))
+            raise TunnelError("Will not be able to bind {}:{}: {}".format(
+                self.relay_ip, self.local_port, err))
 
     def connect(self,look_for_keys=False, wait_for_password=False):
         """
@@ -307,83 +863,141 @@ class SSHTunnel(object):
             look_for_keys (bool, optional): Automatically look for SSH keys.
             wait_for_password (bool, optional): If true, program execution will hang until
                 user inputs password
+        Raises:
+            TunnelError: if the SSH connection couldn't be made, after the
+                transport pool's handshake retries.
         """
         password = None
         if wait_for_password:
             password = getpass.getpass("create_tunnel: Enter SSH password: ")
+        connect_start = time.time()
 
         self.logger.debug(
             "connect: creating tunnel to remote host {}:{}. Forwarding port {} to {} using relay_ip {}".format(
                 self.remote_ip, self.port, self.local_port, self.remote_port, self.relay_ip
             )
         )
-        client = paramiko.SSHClient()
-        client.load_system_host_keys()
-        client.set_missing_host_key_policy(paramiko.WarningPolicy())
-
         try:
-            client.connect(self.remote_ip, self.port, username=self.username, key_filename=self.keyfile,
-                           look_for_keys=look_for_keys, password=password)
-
+            self.transport_pool.connect(look_for_keys=look_for_keys, password=password)
         except Exception as err:
             self.logger.error("create_tunnel: Failed to connect to {}:{}: {}".format(self.remote_ip, self.port, err))
-            return
-
+            if self.server is not None:
+                # the listener was never served, so there's nothing to shut down.
+                self.server.server_close()
+                self.server = None
+            if self.owns_transport_pool:
+                self.transport_pool.close()
+            raise TunnelError("Couldn't connect to {}:{}: {}".format(self.remote_ip, self.port, err))
+
+        # small SSH packets on the transports themselves are subject to Nagle too.
+        for pool_transport in self.transport_pool.transports:
+            self.socket_options.apply(pool_transport.sock)
+
+        client = self.transport_pool.clients[0]
         transport = client.get_transport()
 
-        def forward_tunnel():
-            class SubHandler(ForwardHandler):
-                chain_host = self.relay_ip
-                chain_port = self.remote_port
-                ssh_transport = transport
-                def __init__(self, *args, **kwargs):
-                    ForwardHandler.__init__(self, *args, **kwargs)
-            def server_factory():
-                return ForwardServer(("", self.local_port), SubHandler)
-            return server_factory()
-
-        def reverse_tunnel():
-            transport.request_port_forward("", self.local_port)
-            server = ReverseHandler(transport, self.relay_ip, self.remote_port)
-            return server
-
+        tunnel_thread = None
         if self.reverse:
-            server = reverse_tunnel()
+            transport.request_port_forward("", self.local_port)
+            server = ReverseHandler(transport, self.relay_ip, self.remote_port,
+                                    socket_options=self.socket_options, stats=self.stats,
+                                    traffic=self.traffic)
         else:
-            server = forward_tunnel()
-
-        tunnel_thread = threading.Thread(target=server.serve_forever)
-        tunnel_thread.daemon = True
-        tunnel_thread.start()
+            server = self.server
+            if server is None:
+                server = self.bind()
+            server.set_route(self.relay_ip, self.remote_port, self.transport_pool,
+                             self.transport_options, self.tunnel_id, self.stats, self.traffic)
+        if self.reverse or selectors is None:
+            tunnel_thread = threading.Thread(target=server.serve_forever)
+            tunnel_thread.daemon = True
+            tunnel_thread.start()
+        else:
+            server.serve_in(accept_loop)
 
         self.client = client
         self.server = server
         self.tunnel_thread = tunnel_thread
         self.open = True
+        if tracer.enabled:
+            tracer.emit("tunnel.open", start=connect_start, tunnel_id=self.tunnel_id,
+                        remote_ip=self.remote_ip, local_port=self.local_port,
+                        remote_port=self.remote_port, reverse=self.reverse)
 
-    def check_conflict(self):
+    def check_conflict(self, listening=None):
         """
         Returns True if there is a conflict, False if there isn't one.
+
+        Args:
+            listening (ListeningPorts, optional): snapshot of listening ports
+                to check against, instead of bind-probing the port.
         """
+        if is_socket_path(self.local_port):
+            return test_unix_socket(self.local_port)
+        if listening is not None and listening.available:
+            return listening.in_use(self.local_port, host=self.relay_ip)
         return test_port(self.local_port, host=self.relay_ip)
 
-    def destroy(self, timeout=0.1):
-        """Destroy the tunnel."""
+    def destroy(self, timeout=0.1, drain_timeout=None):
+        """
+        Destroy the tunnel.
+
+        Args:
+            drain_timeout (float, optional): Drain forward tunnels: stop
+                accepting connections, and give the active ones up to
+                drain_timeout seconds to finish what they're relaying before
+                closing them. Closes everything straight away by default.
+        """
         self.logger.debug("destroy: {} called".format(self.tunnel_id))
         # time.sleep(timeout)
-        if self.client is not None:
-            self.logger.debug("destroy: calling self.client.close")
-            self.client.close()
+        if drain_timeout is not None and self.server is not None and not self.reverse:
+            self.drain(drain_timeout)
+        if self.client is not None and self.owns_transport_pool:
+            self.logger.debug("destroy: closing transport pool")
+            self.transport_pool.close()
+        self.client = None
         if self.server is not None:
             self.logger.debug("destroy: calling self.server.shutdown")
             self.server.shutdown()
             self.logger.debug("destroy: calling self.server.server_close")
             self.server.server_close() # this is necessary to completely unbind the server.
+            self.server = None
         self.logger.debug("destroy: calling join, reverse: {}".format(self.reverse))
-        self.tunnel_thread.join(0.1)
+        if self.tunnel_thread is not None:
+            self.tunnel_thread.join(0.1)
         self.logger.debug("destroy: join finished, reverse: {}".format(self.reverse))
+        if tracer.enabled and self.open:
+            tracer.emit("tunnel.close", tunnel_id=self.tunnel_id, remote_ip=self.remote_ip,
+                        local_port=self.local_port, remote_port=self.remote_port,
+                        reverse=self.reverse)
         self.open = False
 
+    def drain(self, timeout, quiet=None):
+        """
+        Stop accepting connections on a forward tunnel, and wait up to
+        timeout seconds for active connections to finish. Connections are
+        closed as soon as they're idle, so that in-flight calls aren't cut
+        off: Pyro4 connections once every call has had its whole response,
+        others after quiet seconds without data. Whatever is left at the
+        deadline is closed. Progress goes to ``trifeni.util.metrics``.
+
+        Args:
+            timeout (float): seconds to wait for connections.
+            quiet (float, optional): see ``ForwardServerMixin.drain``.
+        """
+        self.logger.debug("drain: {} draining for up to {} seconds".format(self.tunnel_id, timeout))
+        server, self.server = self.server, None
+        server.shutdown()
+        server.server_close()
+        metrics.increment("drain.tunnels")
+        with metrics.timer("drain.seconds"):
+            active, idle_closed, forced = server.drain(timeout, quiet)
+        metrics.increment("drain.connections", active)
+        metrics.increment("drain.closed_idle", idle_closed)
+        metrics.increment("drain.forced", forced)
+        self.logger.debug("drain: {}: {} active connection(s), {} closed idle, {} forced".format(
+            self.tunnel_id, active, idle_closed, forced))
+
     def __enter__(self):
         return self
 
@@ -407,12 +1021,45 @@ class SSHTunnelManager(object):
             tunnel0 = manager.create_tunnel("remote_alias", "localhost", 9090, 9090)
             tunnel1 = manager.create_tunnel("remote_alias", "localhost", 9091, 9091)
 
+    Tunnels are SSHTunnel instances, run by paramiko, unless the manager is
+    created with ``backend="openssh"``, in which case they are OpenSSHTunnel
+    instances, and tunnels to the same host share an OpenSSH ControlMaster.
+
     Attributes:
         tunnels (dict): dictionary of tunnels managed by this instance.
+        backend (str): "paramiko" or "openssh"
+        control_masters (dict): ControlMaster instances of the "openssh"
+            backend, one per host.
+        tunnel_specs (dict): the arguments each tunnel was created with,
+            keyed by tunnel id. This is what ``save_state`` records.
         logger (logging.getLogger): logging instance
     """
-    def __init__(self, logger=None):
+    backends = ("paramiko", "openssh")
+
+    def __init__(self, logger=None, transports_per_host=1, stripe_policy="round-robin",
+                 backend="paramiko"):
+        """
+        Args:
+            logger (logging.getLogger, optional): logging instance
+            transports_per_host (int, optional): If greater than 1, forward
+                tunnels to the same host share a TransportPool with this many
+                SSH transports, and new forwarded connections are spread
+                across them.
+            stripe_policy (str, optional): "round-robin" or "least-loaded".
+            backend (str, optional): "paramiko" or "openssh".
+        """
+        if backend not in self.backends:
+            raise ValueError("Unknown tunnel backend {}. Choose from {}".format(backend, self.backends))
+        self.backend = backend
+        self.control_masters = {}
         self.tunnels = {}
+        self.tunnel_specs = {}
+        self.transport_pools = {}
+        self._lock = threading.RLock()
+        self._binding = set()
+        self._bound = threading.Condition(self._lock)
+        self.transports_per_host = int(transports_per_host)
+        self.stripe_policy = stripe_policy
         if logger is None: logger = logging.getLogger(
             module_logger.name + self.__class__.__name__
         )
@@ -420,48 +1067,288 @@ class SSHTunnelManager(object):
 
     def create_tunnel(self, *args, **kwargs):
         """
-        Create an instance of SSHTunnel and add it to the tunnels attribute
-        and attempt to detect whether there will be collisions.
+        Create an instance of SSHTunnel (or OpenSSHTunnel) and add it to the
+        tunnels attribute and attempt to detect whether there will be collisions.
 
         All arguments get passed to SSHTunnel.__init__, such that this method
         can be thought of as factory function for SSHTunnel instances. Indeed,
 
+        A tunnel for a local port that another thread is already creating a
+        tunnel for waits for that one, and then counts as a duplicate.
+
         Args:
             *args: Passed to SSHTunnel.__init__
             **kwargs: Passed to SSHTunnel.__init__
         Returns:
             SSHTunnel
+        Raises:
+            TunnelError: if the tunnel couldn't connect.
         """
         remote_ip, relay_ip, local_port, remote_port = args
-        local_ports = [(self.tunnels[_id].relay_ip, self.tunnels[_id].local_port) for _id in self.tunnels]
-        if (relay_ip, local_port) in local_ports:
-            self.logger.debug(
-                ("This tunnel manager is already responsible "
-                 "for a tunnel bound to {}:{}").format(relay_ip, local_port))
-            return
+        binding = (relay_ip, local_port)
+        with self._lock:
+            while binding in self._binding:
+                self._bound.wait()
+            local_ports = [(self.tunnels[_id].relay_ip, self.tunnels[_id].local_port) for _id in self.tunnels]
+            if binding in local_ports:
+                self.logger.debug(
+                    ("This tunnel manager is already responsible "
+                     "for a tunnel bound to {}:{}").format(relay_ip, local_port))
+                return
+            self._binding.add(binding)
 
-        tunnel = SSHTunnel(remote_ip, relay_ip, local_port, remote_port, **kwargs)
-        self.tunnels[tunnel.tunnel_id] = tunnel
+        try:
+            spec = {"args": list(args), "kwargs": self._spec_kwargs(kwargs)}
+            if self.backend == "openssh":
+                kwargs["control_master"] = self.get_control_master(remote_ip, **kwargs)
+                tunnel = OpenSSHTunnel(remote_ip, relay_ip, local_port, remote_port, **kwargs)
+            else:
+                if self.transports_per_host > 1 and not kwargs.get("reverse", False):
+                    kwargs["transport_pool"] = self.get_transport_pool(remote_ip, **kwargs)
+                tunnel = SSHTunnel(remote_ip, relay_ip, local_port, remote_port, **kwargs)
+            with self._lock:
+                self.tunnels[tunnel.tunnel_id] = tunnel
+                self.tunnel_specs[tunnel.tunnel_id] = spec
+        finally:
+            with self._lock:
+                self._binding.discard(binding)
+                self._bound.notify_all()
         return tunnel
 
-    def destroy_tunnel(self, _id):
+    def _spec_kwargs(self, kwargs):
+        spec_kwargs = {}
+        for key in kwargs:
+            value = kwargs[key]
+            if hasattr(value, "as_dict"):
+                value = value.as_dict()
+            try:
+                json.dumps(value)
+            except (TypeError, ValueError):
+                # shared transport pools and masters are created again on restore
+                self.logger.debug("create_tunnel: not recording {} in tunnel spec".format(key))
+                continue
+            spec_kwargs[key] = value
+        return spec_kwargs
+
+    def state(self):
+        """
+        Returns:
+            dict: JSON serializable state of the manager: its backend, and
+                the specs of the tunnels that are open.
+        """
+        with self._lock:
+            specs = [self.tunnel_specs[_id] for _id in self.tunnels
+                     if _id in self.tunnel_specs and self.tunnels[_id].open]
+        return {"backend": self.backend, "tunnels": specs}
+
+    def save_state(self, file_path):
+        """
+        Write the manager's state to file_path, as JSON, so that another
+        process can recreate the same tunnels with ``restore_state``. The file
+        is replaced atomically.
+
+        Args:
+            file_path (str): path to state file.
+        """
+        tmp_file_path = "{}.{}.tmp".format(file_path, os.getpid())
+        with open(tmp_file_path, "w") as f:
+            json.dump(self.state(), f, indent=2)
+        os.rename(tmp_file_path, file_path)
+        self.logger.debug("save_state: saved state to {}".format(file_path))
+
+    def restore_state(self, file_path, max_workers=8):
+        """
+        Recreate the tunnels recorded in a state file by ``save_state``.
+        Tunnels are created concurrently; tunnels that fail are logged and
+        skipped.
+
+        Args:
+            file_path (str): path to state file.
+            max_workers (int, optional): maximum number of tunnels created at
+                the same time (8)
+        Returns:
+            list: restored tunnels.
+        """
+        with open(file_path, "r") as f:
+            state = json.load(f)
+        return self.set_state(state, max_workers=max_workers)
+
+    def set_state(self, state, max_workers=8):
+        """
+        Recreate the tunnels in state, as returned by ``state``.
+
+        Args:
+            state (dict): manager state.
+            max_workers (int, optional): see ``restore_state``.
+        Returns:
+            list: restored tunnels.
         """
-        Destroy a tunnel by id
+        if state.get("backend", self.backend) != self.backend:
+            self.logger.warning("set_state: state was saved by a {} manager, restoring with {}".format(
+                state["backend"], self.backend))
+        restored = self.create_tunnels(state.get("tunnels", []), max_workers=max_workers)
+        self.logger.debug("set_state: restored {} tunnel(s)".format(len(restored)))
+        return restored
+
+    def create_tunnels(self, specs, max_workers=8, check_ports=True):
+        """
+        Create many tunnels concurrently. Tunnels that fail are logged and
+        skipped.
+
+        Examples:
+
+        .. code-block:: python
+
+            manager.create_tunnels([
+                {"args": ["remote_alias", "localhost", 9090, 9090]},
+                {"args": ["remote_alias", "localhost", 9091, 9091], "kwargs": {"reverse": True}}
+            ])
+
+        Args:
+            specs (list): dicts with the "args" and optionally "kwargs" for
+                ``create_tunnel``, like the tunnel specs of ``state``.
+            max_workers (int, optional): maximum number of tunnels created at
+                the same time (8)
+            check_ports (bool, optional): Skip forward tunnels whose local
+                port is already listening, according to a single
+                ListeningPorts snapshot, rather than attempting each of them.
+        Returns:
+            list: created tunnels.
+        """
+        listening = ListeningPorts() if check_ports else None
+
+        def create(spec):
+            args, kwargs = spec["args"], spec.get("kwargs", {})
+            remote_ip, relay_ip, local_port, remote_port = args
+            owned = [(tunnel.relay_ip, tunnel.local_port) for tunnel in list(self.tunnels.values())]
+            if (listening is not None and listening.available and not kwargs.get("reverse", False)
+                    and not is_socket_path(local_port) and (relay_ip, local_port) not in owned
+                    and listening.in_use(local_port)):
+                self.logger.error("create_tunnels: Port {} is already in use, skipping tunnel {}".format(
+                    local_port, args))
+                return
+            try:
+                return SSHTunnelManager.create_tunnel(self, *args, **kwargs)
+            except Exception as err:
+                self.logger.error("create_tunnels: Couldn't create tunnel {}: {}".format(args, err))
+
+        tunnels = thread_map(create, specs, max_workers=max_workers)
+        return [tunnel for tunnel in tunnels if tunnel is not None]
+
+    def get_transport_pool(self, remote_ip, port=22, username=None, keyfile=None,
+                           transport_options=None, **kwargs):
+        """
+        Get the TransportPool shared by forward tunnels to remote_ip, creating
+        it if need be. Reverse tunnels never share transports, as each one
+        accepts every incoming channel on its transport. Tunnels only share
+        a pool if they negotiate the same ciphers, MACs and compression.
+
+        Args:
+            remote_ip (str): Either an alias or an actual address
+            port (int, optional): remote login port.
+            username (str, optional): remote username
+            keyfile (str, optional): path the ssh key file.
+            transport_options (TransportOptions/dict/str, optional): SSH
+                transport parameters for the tunnel.
+            **kwargs: Other SSHTunnel.__init__ arguments, ignored.
+        Returns:
+            TransportPool
+        """
+        remote_alias, remote_ip, port, username, keyfile = resolve_host(
+            remote_ip, port=port, username=username, keyfile=keyfile
+        )
+        if keyfile is None:
+            keyfile = config.default_identity_file
+        options = TransportOptions.from_host_config(
+            config.get_host(remote_alias)
+        ).update(transport_options)
+        key = (remote_ip, int(port), username, options.transport_key())
+        with self._lock:
+            if key not in self.transport_pools:
+                self.transport_pools[key] = TransportPool(
+                    remote_ip, port, username, keyfile,
+                    size=self.transports_per_host, policy=self.stripe_policy,
+                    options=options
+                )
+            return self.transport_pools[key]
+
+    def get_control_master(self, remote_ip, port=22, username=None, keyfile=None,
+                           transport_options=None, ssh_options=None,
+                           wait_for_password=False, **kwargs):
+        """
+        Get the ControlMaster shared by tunnels to remote_ip, creating it if
+        need be. The master is started by the first tunnel that uses it.
+
+        Args:
+            remote_ip (str): Either an alias or an actual address
+            port (int, optional): remote login port.
+            username (str, optional): remote username
+            keyfile (str, optional): path the ssh key file.
+            transport_options (TransportOptions/dict/str, optional): ciphers,
+                MACs and compression.
+            ssh_options (dict, optional): extra ssh ``-o`` options.
+            wait_for_password (bool, optional): Let ssh prompt for a password.
+            **kwargs: Other OpenSSHTunnel.__init__ arguments, ignored.
+        Returns:
+            ControlMaster
+        """
+        remote_alias, remote_ip, port, username, keyfile = resolve_host(
+            remote_ip, port=port, username=username, keyfile=keyfile
+        )
+        if keyfile is None and os.path.exists(config.default_identity_file):
+            keyfile = config.default_identity_file
+        options = TransportOptions.from_host_config(
+            config.get_host(remote_alias)
+        ).update(transport_options)
+        key = (remote_ip, int(port), username, options.transport_key())
+        with self._lock:
+            if key not in self.control_masters:
+                self.control_masters[key] = ControlMaster(
+                    remote_ip, port, username, keyfile,
+                    transport_options=options, ssh_options=ssh_options,
+                    batch_mode=not wait_for_password,
+                    logger=logging.getLogger(self.logger.name + ".ControlMaster")
+                )
+            return self.control_masters[key]
+
+    def destroy_tunnel(self, _id, drain_timeout=None):
+        """
+        Destroy a tunnel by id, and forget it, so that its local port can be
+        used again, and it isn't saved by ``save_state``.
 
         Args:
             _id (str): The id of the tunnel to destroy
+            drain_timeout (float, optional): see SSHTunnel.destroy
         """
-        self.tunnels[_id].destroy()
+        with self._lock:
+            tunnel = self.tunnels.pop(_id)
+            self.tunnel_specs.pop(_id, None)
+        tunnel.destroy(drain_timeout=drain_timeout)
 
-    def cleanup(self):
+    def cleanup(self, drain_timeout=None):
         """
         Destroy all the tunnels associated with the manager. Note that this
         doesn't actually delete the SSHTunnel objects from memory.
+
+        Args:
+            drain_timeout (float, optional): Drain tunnels, concurrently,
+                for up to this many seconds before closing them. See
+                SSHTunnel.destroy.
         """
         self.logger.debug("cleanup: Killing {} tunnels".format(len(self.tunnels)))
-        for tunnel_id in self.tunnels:
-            self.logger.debug("cleanup: Destroying tunnel {}".format(tunnel_id))
-            self.tunnels[tunnel_id].destroy()
+        if drain_timeout is not None:
+            thread_map(lambda tunnel: tunnel.destroy(drain_timeout=drain_timeout),
+                       list(self.tunnels.values()), max_workers=max(len(self.tunnels), 1))
+        else:
+            for tunnel_id in self.tunnels:
+                self.logger.debug("cleanup: Destroying tunnel {}".format(tunnel_id))
+                self.tunnels[tunnel_id].destroy()
+        for key in self.transport_pools:
+            self.logger.debug("cleanup: Closing transport pool for {}".format(key))
+            self.transport_pools[key].close()
+        for key in self.control_masters:
+            self.logger.debug("cleanup: Stopping ssh master for {}".format(key))
+            self.control_masters[key].stop()
 
     def tunnel_status(self):
         """
@@ -480,27 +1367,32 @@ class SSHTunnelManager(object):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.cleanup()
 
-def test_port(port, host="localhost"):
+def resolve_host(remote_ip, port=22, username=None, keyfile=None):
     """
-    Determine if a port is already being used. Returns False if not bound,
-    True if bound.
+    Resolve remote_ip against the SSH aliases in trifeni.config. If remote_ip
+    is an alias, the port, username and keyfile of the alias take precedence.
 
     Args:
-        port (int, optional): The port to check
-        host (str, optional): The host to attempt to bind on ("localhost")
+        remote_ip (str): Either an alias or an actual address
+        port (int, optional): remote login port.
+        username (str, optional): remote username. Defaults to the current user.
+        keyfile (str, optional): path the ssh key file.
+    Returns:
+        tuple: remote alias (None if remote_ip isn't an alias), remote address,
+            port, username and keyfile.
     """
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    try:
-        sock.bind((host, port))
-        sock.close()
-        # sock.shutdown(1)
-        # sock.server_close()
-    except socket.error as err:
-        if err.errno == 98:
-            module_logger.debug("test_port: {}".format(err))
-            return True
-        else:
-            raise err
-
-    return False
+    start = time.time() if tracer.enabled else None
+    remote_alias = None
+    remote_info = config.get_host(remote_ip)
+    if remote_info is not None:
+        remote_alias = remote_ip
+        port = remote_info["Port"]
+        username = remote_info.get("User", None)
+        remote_ip = remote_info["HostName"]
+        keyfile = remote_info.get("IdentityFile", None)
+        module_logger.debug("resolve_host: remote_info for host alias {}: {}".format(remote_alias, remote_info))
+    if username is None:
+        username = getpass.getuser()
+    if start is not None:
+        tracer.emit("resolve", start=start, alias=remote_alias, remote_ip=remote_ip, port=port)
+    return remote_alias, remote_ip, port, username, keyfile